@@ -0,0 +1,128 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import delete, func, insert, select, union_all
+
+import models, logs
+from database import AsyncSessionLocal
+
+log = logs.get_logger("archive")
+
+# Closed trades older than this (by close time) move from the live trades
+# table to trades_archive. The live table then holds open positions plus
+# recent history, so its indexes stay small however old the platform gets.
+ARCHIVE_AFTER_DAYS = max(1, int(os.getenv("ARCHIVE_AFTER_DAYS", "90")))
+# How often the leader runs the archive job (seconds); 0 disables it
+ARCHIVE_INTERVAL = float(os.getenv("ARCHIVE_INTERVAL", "3600"))
+# Trades moved per transaction, and the pause between transactions, so the
+# write lock is only ever held for one short batch
+ARCHIVE_BATCH = int(os.getenv("ARCHIVE_BATCH", "500"))
+ARCHIVE_PAUSE = 0.05
+
+COLUMNS = [column.name for column in models.Trade.__table__.columns]
+
+
+def horizon():
+    # Everything in the archive closed, and so also opened, before this
+    return datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+
+
+def reaches_archive(start):
+    # Whether a query over trades opened (or changed) at/after start can
+    # touch archived rows
+    return start is None or start < horizon()
+
+
+# Reading across both tables
+
+def select_trades(build, order, start=None):
+    # build(model) selects the response columns from one trades table with the
+    # caller's filters; order(columns) gives the ORDER BY. The archive is only
+    # added when the range starting at start reaches back past the horizon.
+    if not reaches_archive(start):
+        return build(models.Trade).order_by(*order(models.Trade))
+    both = union_all(build(models.Trade), build(models.TradeArchive)).subquery()
+    return select(*both.c).order_by(*order(both.c))
+
+
+def newest_first(columns):
+    return (columns.open_time.desc(), columns.id.desc())
+
+
+async def newest_page(db, build, limit, offset=0):
+    # Newest-first pages. Archived trades are all older than the horizon, so
+    # a full page from the live table whose last row is newer than that is
+    # already the answer; only pages reaching further back read both tables.
+    stmt = build(models.Trade).order_by(*newest_first(models.Trade)).offset(offset).limit(limit)
+    rows = (await db.execute(stmt)).all()
+    if len(rows) == limit and rows[-1].open_time is not None and rows[-1].open_time >= horizon():
+        return rows
+    return (await db.execute(select_trades(build, newest_first).offset(offset).limit(limit))).all()
+
+
+# The archive job
+
+def archive_batch(cutoff, limit=ARCHIVE_BATCH):
+    # Oldest closed trades first. The highest id never moves: SQLite hands out
+    # max(id) + 1 for new rows, so deleting it would let a new trade reuse an
+    # archived trade's id.
+    trades = models.Trade
+    return (
+        select(trades.id)
+        .where(
+            trades.status == "CLOSED",
+            trades.close_time < cutoff,
+            trades.id < select(func.max(trades.id)).scalar_subquery(),
+        )
+        .order_by(trades.close_time)
+        .limit(limit)
+    )
+
+
+async def archive_closed(older_than=None, batch=ARCHIVE_BATCH):
+    # Moves closed trades that closed before older_than, one short
+    # transaction per batch. Never past the horizon, which the reads rely on.
+    # Returns how many trades moved.
+    cutoff = min(older_than, horizon()) if older_than is not None else horizon()
+    trades = models.Trade
+    moved = 0
+    while True:
+        async with AsyncSessionLocal() as db:
+            ids = (await db.scalars(archive_batch(cutoff, batch))).all()
+            if not ids:
+                return moved
+            # Copy and delete under the same conditions, in one transaction, so
+            # a row is in exactly one table
+            selected = (trades.id.in_(ids), trades.status == "CLOSED")
+            await db.execute(
+                insert(models.TradeArchive).from_select(
+                    COLUMNS, select(*(getattr(trades, name) for name in COLUMNS)).where(*selected)
+                )
+            )
+            await db.execute(delete(trades).where(*selected))
+            await db.commit()
+        moved += len(ids)
+        if len(ids) < batch:
+            return moved
+        await asyncio.sleep(ARCHIVE_PAUSE)
+
+
+async def run_archiver(interval=ARCHIVE_INTERVAL):
+    if interval <= 0:
+        return
+    while True:
+        try:
+            moved = await archive_closed()
+            if moved:
+                log.info("Archived closed trades", extra={"fields": {"moved": moved}})
+        except Exception:
+            log.exception("Trade archiving failed")
+        await asyncio.sleep(interval)
+
+
+if __name__ == "__main__":
+    # One-off run outside the server. ARCHIVE_AFTER_DAYS must match the
+    # servers' setting: reads only look in the archive past their horizon.
+    moved = asyncio.run(archive_closed())
+    print(f"Archived {moved} closed trades")
@@ -2,12 +2,32 @@ from passlib.context import CryptContext
 from jose import JWTError, jwt
 from datetime import datetime, timedelta
 from typing import Optional
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import asyncio
+import os
+import time
 
 SECRET_KEY = "your-secret-key-keep-it-secret"
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 300
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+# PBKDF2 cost per deployment. Hashes made with a different round count are
+# flagged by needs_update and rewritten on the user's next successful login.
+PASSWORD_HASH_ROUNDS = int(os.getenv("PASSWORD_HASH_ROUNDS", "29000"))
+# Hashing runs off the event loop: "thread" (hashlib releases the GIL) or "process"
+PASSWORD_HASH_EXECUTOR = os.getenv("PASSWORD_HASH_EXECUTOR", "thread")
+# Default: the machine's cores shared among the server's worker processes
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // int(os.getenv("WEB_CONCURRENCY", "1"))))))
+# Requests allowed to wait for a worker before new ones are turned away
+PASSWORD_HASH_MAX_QUEUE = int(os.getenv("PASSWORD_HASH_MAX_QUEUE", "256"))
+
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__min_rounds=PASSWORD_HASH_ROUNDS,
+    pbkdf2_sha256__max_rounds=PASSWORD_HASH_ROUNDS,
+)
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -15,6 +35,91 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+def get_password_hashes(passwords):
+    # Batch form for process pools: one task, many hashes
+    return [pwd_context.hash(password) for password in passwords]
+
+def verify_and_update(plain_password, hashed_password):
+    # (verified, replacement hash or None) in a single PBKDF2 pass
+    return pwd_context.verify_and_update(plain_password, hashed_password)
+
+
+class HashPoolBusy(Exception):
+    pass
+
+
+class HashPool:
+    # Bounded executor for password hashing. A semaphore caps concurrent
+    # hashes at the worker count so the queue depth is visible (and bounded)
+    # here rather than hidden inside the executor.
+
+    def __init__(self, workers=PASSWORD_HASH_WORKERS, max_queue=PASSWORD_HASH_MAX_QUEUE, kind=PASSWORD_HASH_EXECUTOR):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.kind = kind
+        self._executor = None
+        self._slots = None
+        self.waiting = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.rejected = 0
+        self.busy_seconds = 0.0
+
+    def _ensure_started(self):
+        if self._executor is None:
+            if self.kind == "process":
+                self._executor = ProcessPoolExecutor(max_workers=self.workers)
+            else:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="pwhash")
+            self._slots = asyncio.Semaphore(self.workers)
+
+    async def run(self, fn, *args):
+        self._ensure_started()
+        if self.waiting >= self.max_queue:
+            self.rejected += 1
+            raise HashPoolBusy()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        started = time.perf_counter()
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+        finally:
+            self.busy_seconds += time.perf_counter() - started
+            self.in_flight -= 1
+            self.completed += 1
+            self._slots.release()
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def stats(self):
+        return {
+            "executor": self.kind,
+            "workers": self.workers,
+            "rounds": PASSWORD_HASH_ROUNDS,
+            "queue_depth": self.waiting,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_ms": round(self.busy_seconds / self.completed * 1000, 2) if self.completed else 0.0,
+        }
+
+
+hash_pool = HashPool()
+
+async def get_password_hash_async(password):
+    return await hash_pool.run(get_password_hash, password)
+
+async def verify_and_update_async(plain_password, hashed_password):
+    return await hash_pool.run(verify_and_update, plain_password, hashed_password)
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -0,0 +1,51 @@
+import argparse
+import asyncio
+import os
+import time
+import auth_utils
+
+# Micro-benchmark for the login hashing path: single-core verify rate and
+# pooled throughput through auth_utils.hash_pool at the configured cost.
+
+def single_core(hashed, seconds):
+    done = 0
+    started = time.perf_counter()
+    while time.perf_counter() - started < seconds:
+        auth_utils.verify_password("password123", hashed)
+        done += 1
+    return done / (time.perf_counter() - started)
+
+async def pooled(hashed, seconds, concurrency):
+    done = 0
+    deadline = time.perf_counter() + seconds
+
+    async def client():
+        nonlocal done
+        while time.perf_counter() < deadline:
+            await auth_utils.verify_and_update_async("password123", hashed)
+            done += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(concurrency)))
+    return done / (time.perf_counter() - started)
+
+def main():
+    parser = argparse.ArgumentParser(description="Password hashing throughput")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--concurrency", type=int, default=auth_utils.PASSWORD_HASH_WORKERS * 4)
+    args = parser.parse_args()
+
+    hashed = auth_utils.get_password_hash("password123")
+    print(f"pbkdf2_sha256 rounds={auth_utils.PASSWORD_HASH_ROUNDS} executor={auth_utils.PASSWORD_HASH_EXECUTOR} workers={auth_utils.PASSWORD_HASH_WORKERS} cpus={os.cpu_count()}")
+
+    rate = single_core(hashed, args.seconds)
+    print(f"single core:  {rate:8.1f} logins/sec  ({1000 / rate:.1f} ms per verify)")
+
+    rate = asyncio.run(pooled(hashed, args.seconds, args.concurrency))
+    per_core = rate / auth_utils.PASSWORD_HASH_WORKERS
+    print(f"pool:         {rate:8.1f} logins/sec  ({per_core:.1f} per worker)")
+    print(auth_utils.hash_pool.stats())
+    auth_utils.hash_pool.shutdown()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+import asyncio
+import hashlib
+import inspect
+import os
+import socket
+import struct
+import tempfile
+from collections import deque
+
+import orjson
+
+import logs
+from database import SQL_ALCHEMY_DATABASE_URL
+
+log = logs.get_logger("bus")
+
+# Local pub/sub between the worker processes of one machine. Every worker
+# listens on a Unix stream socket in a shared directory and keeps one
+# connection to each other worker, so messages arrive complete and in order.
+# A worker that falls too far behind is sent a resync request (reload from
+# the database) in place of its backlog; nothing is dropped silently.
+# Workers serving the same database share a directory by default.
+BUS_DIR = os.getenv("BUS_DIR") or os.path.join(
+    tempfile.gettempdir(), "trader-" + hashlib.sha1(SQL_ALCHEMY_DATABASE_URL.encode()).hexdigest()[:12]
+)
+# Unsent messages a peer may fall behind by before they are replaced by a resync request
+MAX_BACKLOG = int(os.getenv("BUS_MAX_BACKLOG", "10000"))
+# Seconds a starting worker waits for the running ones to acknowledge it,
+# and a stopping one for its queued messages to go out
+HANDSHAKE_TIMEOUT = 2.0
+STOP_TIMEOUT = 2.0
+
+SUPPORTED = hasattr(socket, "AF_UNIX") and os.name == "posix"
+
+FRAME = struct.Struct("!I")  # length prefix of every message
+ACK = b"\x06"
+
+
+def _frame(kind, data):
+    payload = orjson.dumps({"k": kind, "d": data})
+    return FRAME.pack(len(payload)) + payload
+
+
+async def _read_frame(reader):
+    size, = FRAME.unpack(await reader.readexactly(FRAME.size))
+    return await reader.readexactly(size)
+
+
+RESYNC = _frame("resync", None)
+
+
+class Peer:
+    # Outgoing connection to one other worker. Messages queue here from the
+    # moment the peer is known, and its sender task writes them out in order.
+
+    def __init__(self, path):
+        self.path = path
+        self.frames = deque()
+        self.latest = {}  # kind -> newest unsent full-state message
+        self.wakeup = asyncio.Event()
+        self.greeted = asyncio.get_running_loop().create_future()
+        self.task = None
+        self.writer = None
+        self.resyncs = 0
+
+    def put(self, kind, frame, latest):
+        if latest:
+            self.latest[kind] = frame
+        else:
+            if len(self.frames) >= MAX_BACKLOG:
+                # Too far behind: have it reload instead of replaying everything
+                self.frames.clear()
+                self.frames.append(RESYNC)
+                self.resyncs += 1
+            self.frames.append(frame)
+        self.wakeup.set()
+
+    def take(self):
+        frames = list(self.frames) + list(self.latest.values())
+        self.frames.clear()
+        self.latest.clear()
+        return frames
+
+    def pending(self):
+        return len(self.frames) + len(self.latest)
+
+    def idle(self):
+        # Nothing queued here or still buffered in the connection
+        return not self.pending() and (self.writer is None or not self.writer.transport.get_write_buffer_size())
+
+
+class Bus:
+    def __init__(self, directory=BUS_DIR):
+        self.directory = directory
+        self.path = None
+        self.server = None
+        self.handlers = {}
+        self.inbox = asyncio.Queue()
+        self.peers = {}  # socket path -> Peer
+        self.incoming = {}  # connection task -> its writer
+        self.sent = 0
+        self.received = 0
+        self.resyncs = 0
+
+    def on(self, kind, handler):
+        # handler(data) runs for messages from other workers; it may be a coroutine
+        self.handlers[kind] = handler
+
+    async def start(self, listen=True):
+        # listen=False joins send-only (one-off scripts): others don't send to it
+        if not SUPPORTED:
+            return  # single-process mode: nobody to talk to
+        os.makedirs(self.directory, exist_ok=True)
+        if listen:
+            self.path = os.path.join(self.directory, f"{os.getpid()}.sock")
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.server = await asyncio.start_unix_server(self._accept, path=self.path)
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".sock") and path != self.path:
+                self._peer(path)
+        # A running worker acknowledges only after it has registered us, so
+        # once all have, everything they commit from then on reaches us and
+        # state loaded from the database afterwards misses nothing
+        if self.peers:
+            await asyncio.wait([peer.greeted for peer in self.peers.values()], timeout=HANDSHAKE_TIMEOUT)
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            self.server = None
+            try:
+                os.unlink(self.path)
+            except FileNotFoundError:
+                pass
+        # Let queued messages go out (an import's last accounts, the leader's
+        # last ticks) before the connections close
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + STOP_TIMEOUT
+        while not all(peer.idle() for peer in self.peers.values()) and loop.time() < deadline:
+            await asyncio.sleep(0.01)
+        tasks = [peer.task for peer in self.peers.values()]
+        for task in tasks:
+            task.cancel()
+        # Closing an incoming connection ends its task at the next read
+        for writer in self.incoming.values():
+            writer.close()
+        await asyncio.gather(*tasks, *self.incoming, return_exceptions=True)
+        self.peers.clear()
+
+    # Sending
+
+    def publish(self, kind, data, latest=False):
+        # latest=True: data is a full state that supersedes earlier messages
+        # of its kind, so a peer that is behind only gets the newest one
+        if not self.peers:
+            return
+        frame = _frame(kind, data)
+        for peer in self.peers.values():
+            peer.put(kind, frame, latest)
+
+    def _peer(self, path):
+        peer = self.peers.get(path)
+        if peer is None:
+            peer = self.peers[path] = Peer(path)
+            peer.task = asyncio.create_task(self._send(peer))
+        return peer
+
+    async def _send(self, peer):
+        writer = None
+        try:
+            reader, writer = await asyncio.open_unix_connection(peer.path)
+            peer.writer = writer
+            writer.write(_frame("hello", self.path))
+            await reader.readexactly(len(ACK))
+            peer.greeted.set_result(True)
+            while True:
+                await peer.wakeup.wait()
+                peer.wakeup.clear()
+                frames = peer.take()
+                if frames:
+                    writer.write(b"".join(frames))
+                    self.sent += len(frames)
+                    # Backpressure: while the peer is behind, messages queue
+                    # on the Peer (bounded by MAX_BACKLOG) instead
+                    await writer.drain()
+        except ConnectionRefusedError:
+            # Socket file left behind by a worker that died; clean it up
+            try:
+                os.unlink(peer.path)
+            except FileNotFoundError:
+                pass
+        except (OSError, asyncio.IncompleteReadError):
+            pass  # the worker stopped
+        finally:
+            if not peer.greeted.done():
+                peer.greeted.set_result(False)
+            self.resyncs += peer.resyncs
+            if self.peers.get(peer.path) is peer:
+                del self.peers[peer.path]
+            if writer is not None:
+                writer.close()
+
+    # Receiving: connections only queue; one task applies messages in
+    # arrival order
+
+    async def _accept(self, reader, writer):
+        task = asyncio.current_task()
+        self.incoming[task] = writer
+        try:
+            hello = orjson.loads(await _read_frame(reader))
+            if hello["d"] is not None:
+                self._peer(hello["d"])
+            writer.write(ACK)
+            await writer.drain()
+            while True:
+                self.inbox.put_nowait(await _read_frame(reader))
+        except (OSError, asyncio.IncompleteReadError):
+            pass  # the worker stopped
+        finally:
+            del self.incoming[task]
+            writer.close()
+
+    async def run(self):
+        while True:
+            message = orjson.loads(await self.inbox.get())
+            self.received += 1
+            handler = self.handlers.get(message["k"])
+            if handler is None:
+                continue
+            try:
+                result = handler(message["d"])
+                if inspect.isawaitable(result):
+                    await result
+            except Exception:
+                log.exception("Bus handler failed", extra={"fields": {"kind": message["k"]}})
+
+    def stats(self):
+        return {
+            "peers": len(self.peers),
+            "sent": self.sent,
+            "received": self.received,
+            "resyncs": self.resyncs + sum(peer.resyncs for peer in self.peers.values()),
+            "backlog": sum(peer.pending() for peer in self.peers.values()),
+            "queued": self.inbox.qsize(),
+        }
+
+
+bus = Bus()
@@ -0,0 +1,235 @@
+import calendar
+import glob
+import os
+import time
+
+import numpy as np
+
+import quotes
+
+TIMEFRAMES = {"M1": 60, "M5": 300, "M15": 900, "H1": 3600, "H4": 14400, "D1": 86400}
+TF_NAMES = list(TIMEFRAMES)
+
+# Completed bars kept in memory per symbol and timeframe
+CANDLE_CAPACITY = int(os.getenv("CANDLE_CAPACITY", "1000"))
+# Completed bars are also appended to one chunk file per timeframe and UTC day
+CANDLE_DIR = os.getenv("CANDLE_DIR", "./data/candles")
+
+BAR_FIELDS = ("time", "open", "high", "low", "close", "volume")
+RECORD_DTYPE = np.dtype([("symbol", "S12")] + [(name, "<f8") for name in BAR_FIELDS])
+
+
+class CandleStore:
+    # Per timeframe: one "live" bar per symbol in flat arrays, plus a
+    # preallocated ring of completed bars of shape (symbols, capacity).
+    # Ticks only touch the M1 live bars, in place. When an M1 bar completes it
+    # is folded into the M5 live bar, M5 into M15 and so on, so higher
+    # timeframes never look at ticks.
+
+    def __init__(self, quote_engine, capacity=CANDLE_CAPACITY, directory=CANDLE_DIR):
+        self.quotes = quote_engine
+        self.capacity = capacity
+        self.directory = directory
+        # Only one process may append to the chunk files (the leader worker)
+        self.persist = True
+        n = len(quote_engine.symbols)
+        self.symbol_names = np.array(quote_engine.symbols, dtype="S12")
+
+        self.live = [{name: np.zeros(n) for name in BAR_FIELDS} for _ in TF_NAMES]
+        self.ring = [{name: np.zeros((n, capacity)) for name in BAR_FIELDS} for _ in TF_NAMES]
+        self.head = [np.zeros(n, dtype=np.int64) for _ in TF_NAMES]  # next slot to write
+        self.count = [np.zeros(n, dtype=np.int64) for _ in TF_NAMES]
+
+        # Scratch space reused on every tick
+        self._bucket = np.zeros(n)
+        self._updated = np.zeros(n, dtype=bool)
+        self._rolled = np.zeros(n, dtype=bool)
+        self._last_time = np.zeros(n)
+
+    # Tick path
+
+    def on_tick(self, quote_engine):
+        q = self.quotes
+        live = self.live[0]
+        np.greater(q.time, self._last_time, out=self._updated)
+        self._last_time[:] = q.time
+        np.floor_divide(q.time, TIMEFRAMES["M1"], out=self._bucket)
+        self._bucket *= TIMEFRAMES["M1"]
+        np.not_equal(self._bucket, live["time"], out=self._rolled)
+        self._rolled &= self._updated
+
+        if self._rolled.any():
+            rows = np.nonzero(self._rolled)[0]
+            self._complete(0, rows)
+            live["time"][rows] = self._bucket[rows]
+            live["open"][rows] = q.bid[rows]
+            live["high"][rows] = q.bid[rows]
+            live["low"][rows] = q.bid[rows]
+            live["volume"][rows] = 0.0
+
+        updated = self._updated
+        np.maximum(live["high"], q.bid, out=live["high"], where=updated)
+        np.minimum(live["low"], q.bid, out=live["low"], where=updated)
+        np.copyto(live["close"], q.bid, where=updated)
+        np.add(live["volume"], 1.0, out=live["volume"], where=updated)
+
+    def _complete(self, level, rows):
+        # The live bars of `rows` at this level are finished: store, persist,
+        # and fold them into the next timeframe up.
+        live = self.live[level]
+        rows = rows[live["volume"][rows] > 0]
+        if not len(rows):
+            return
+        bars = {name: live[name][rows].copy() for name in BAR_FIELDS}
+        self._store(level, rows, bars)
+        self._persist(level, rows, bars)
+        if level + 1 < len(TF_NAMES):
+            self._fold(level + 1, rows, bars)
+
+    def _store(self, level, rows, bars):
+        ring = self.ring[level]
+        slots = self.head[level][rows]
+        for name in BAR_FIELDS:
+            ring[name][rows, slots] = bars[name]
+        self.head[level][rows] = (slots + 1) % self.capacity
+        self.count[level][rows] = np.minimum(self.count[level][rows] + 1, self.capacity)
+
+    def _fold(self, level, rows, bars):
+        live = self.live[level]
+        period = TIMEFRAMES[TF_NAMES[level]]
+        bucket = np.floor_divide(bars["time"], period) * period
+        rolled = bucket != live["time"][rows]
+        if rolled.any():
+            starting = rows[rolled]
+            self._complete(level, starting)
+            live["time"][starting] = bucket[rolled]
+            live["open"][starting] = bars["open"][rolled]
+            live["high"][starting] = bars["high"][rolled]
+            live["low"][starting] = bars["low"][rolled]
+            live["close"][starting] = bars["close"][rolled]
+            live["volume"][starting] = bars["volume"][rolled]
+        merging = ~rolled
+        if merging.any():
+            rows, part = rows[merging], {name: value[merging] for name, value in bars.items()}
+            live["high"][rows] = np.maximum(live["high"][rows], part["high"])
+            live["low"][rows] = np.minimum(live["low"][rows], part["low"])
+            live["close"][rows] = part["close"]
+            live["volume"][rows] += part["volume"]
+
+    # Persistence: append-only binary chunks, one per timeframe and UTC day
+
+    def _chunk_path(self, tf, day):
+        return os.path.join(self.directory, tf, time.strftime("%Y%m%d", time.gmtime(day)) + ".bin")
+
+    def _persist(self, level, rows, bars):
+        if not self.directory or not self.persist:
+            return
+        tf = TF_NAMES[level]
+        records = np.zeros(len(rows), dtype=RECORD_DTYPE)
+        records["symbol"] = self.symbol_names[rows]
+        for name in BAR_FIELDS:
+            records[name] = bars[name]
+        days = np.floor_divide(bars["time"], 86400) * 86400
+        for day in np.unique(days):
+            path = self._chunk_path(tf, day)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "ab") as f:
+                f.write(records[days == day].tobytes())
+
+    def _read_chunks(self, tf, symbol, start, end):
+        if not self.directory:
+            return np.zeros(0, dtype=RECORD_DTYPE)
+        first_day = np.floor_divide(start, 86400) * 86400
+        parts = []
+        for path in sorted(glob.glob(os.path.join(self.directory, tf, "*.bin"))):
+            day = calendar.timegm(time.strptime(os.path.basename(path)[:-4], "%Y%m%d"))
+            if day < first_day or day > end:
+                continue
+            records = np.fromfile(path, dtype=RECORD_DTYPE)
+            mask = (records["symbol"] == symbol.encode()) & (records["time"] >= start) & (records["time"] <= end)
+            parts.append(records[mask])
+        return np.concatenate(parts) if parts else np.zeros(0, dtype=RECORD_DTYPE)
+
+    def load_recent(self):
+        # Warm the rings from the newest chunk files after a restart
+        if not self.directory:
+            return
+        now = time.time()
+        for level, tf in enumerate(TF_NAMES):
+            since = now - TIMEFRAMES[tf] * self.capacity
+            files = sorted(glob.glob(os.path.join(self.directory, tf, "*.bin")))
+            for path in files[-(int(TIMEFRAMES[tf] * self.capacity / 86400) + 2):]:
+                records = np.fromfile(path, dtype=RECORD_DTYPE)
+                records = records[records["time"] >= since]
+                for symbol in np.unique(records["symbol"]):
+                    row = self.quotes.row(symbol.decode())
+                    if row is not None:
+                        self._restore(level, row, records[records["symbol"] == symbol])
+
+    def _restore(self, level, row, records):
+        # Lay bars into one symbol's ring after whatever is already there
+        records = records[np.argsort(records["time"], kind="stable")][-self.capacity:]
+        slots = (self.head[level][row] + np.arange(len(records))) % self.capacity
+        for name in BAR_FIELDS:
+            self.ring[level][name][row, slots] = records[name]
+        self.head[level][row] = (self.head[level][row] + len(records)) % self.capacity
+        self.count[level][row] = min(self.count[level][row] + len(records), self.capacity)
+
+    # Reads
+
+    def history(self, symbol, tf, start=None, end=None, limit=1000):
+        row = self.quotes.row(symbol)
+        if row is None or tf not in TIMEFRAMES:
+            return None
+        level = TF_NAMES.index(tf)
+        end = time.time() if end is None else end
+
+        count = int(self.count[level][row])
+        order = (np.arange(self.head[level][row] - count, self.head[level][row])) % self.capacity
+        ring = {name: self.ring[level][name][row, order] for name in BAR_FIELDS}
+        oldest = ring["time"][0] if count else None
+
+        bars = {}
+        if start is not None and (oldest is None or start < oldest):
+            # Older than what's in memory: read it back from the chunk files
+            for record in self._read_chunks(tf, symbol, start, end):
+                bars[float(record["time"])] = {name: float(record[name]) for name in BAR_FIELDS}
+        for i in range(count):
+            t = float(ring["time"][i])
+            if (start is None or t >= start) and t <= end:
+                bars[t] = {name: float(ring[name][i]) for name in BAR_FIELDS}
+
+        for current in self._current_bars(level, row):
+            if (start is None or current["time"] >= start) and current["time"] <= end:
+                bars[current["time"]] = current
+
+        digits = int(self.quotes.digits[row])
+        result = [bars[t] for t in sorted(bars)][-limit:]
+        for bar in result:
+            for name in ("open", "high", "low", "close"):
+                bar[name] = round(bar[name], digits)
+        return result
+
+    def _current_bars(self, level, row):
+        # Bars not yet in the ring: the live bar at `level` merged with the
+        # live bars below it that haven't been folded up yet. Usually one bar;
+        # two right after a boundary, before the lower level completes.
+        period = TIMEFRAMES[TF_NAMES[level]]
+        bars = []
+        for lower in range(level, -1, -1):
+            live = self.live[lower]
+            if live["volume"][row] <= 0:
+                continue
+            bucket = (float(live["time"][row]) // period) * period
+            if bars and bars[-1]["time"] == bucket:
+                bar = bars[-1]
+                bar["high"] = max(bar["high"], float(live["high"][row]))
+                bar["low"] = min(bar["low"], float(live["low"][row]))
+                bar["close"] = float(live["close"][row])
+                bar["volume"] += float(live["volume"][row])
+            else:
+                bars.append({"time": bucket, **{name: float(live[name][row]) for name in BAR_FIELDS[1:]}})
+        return bars
+
+
+store = CandleStore(quotes.engine)
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+from sqlalchemy import and_, or_, select
+from database import engine, Base, upgrade_schema
+import models, ledger, export, archive, encoding
+
+# Runs EXPLAIN QUERY PLAN for every hot query and fails if any of them
+# falls back to a full table scan or a temp B-tree sort.
+
+NOW = datetime.utcnow()
+
+HOT_QUERIES = {
+    "get_my_trades": select(models.Trade).where(models.Trade.user_id == 1).order_by(models.Trade.open_time.desc()),
+    "get_my_trades?since": select(models.Trade).where(models.Trade.user_id == 1, models.Trade.change_seq > 10),
+    "get_my_trades?since+archive": select(models.TradeArchive).where(models.TradeArchive.user_id == 1, models.TradeArchive.change_seq > 10),
+    "next_change_seq": select(models.NEXT_CHANGE_SEQ),
+    "get_open_trades": select(models.Trade).where(models.Trade.user_id == 1, models.Trade.status == "OPEN").order_by(models.Trade.open_time.desc()),
+    "get_closed_trades": select(models.Trade).where(
+        models.Trade.user_id == 1, models.Trade.status == "CLOSED",
+        or_(models.Trade.open_time < NOW, and_(models.Trade.open_time == NOW, models.Trade.id < 10)),
+    ).order_by(models.Trade.open_time.desc(), models.Trade.id.desc()).limit(100),
+    "get_trade_history": select(models.Trade).where(
+        models.Trade.user_id == 1,
+        or_(models.Trade.open_time < NOW, and_(models.Trade.open_time == NOW, models.Trade.id < 10)),
+    ).order_by(models.Trade.open_time.desc(), models.Trade.id.desc()).limit(100),
+    "read_all_trades": select(models.Trade).order_by(models.Trade.open_time.desc()).limit(100),
+    "open_positions": select(models.Trade).where(models.Trade.status == "OPEN").order_by(models.Trade.open_time),
+    "pending_orders_book": select(models.PendingOrder).where(models.PendingOrder.status == "PENDING"),
+    "get_my_orders": select(models.PendingOrder).where(models.PendingOrder.user_id == 1, models.PendingOrder.status == "PENDING").order_by(models.PendingOrder.created_at.desc()).limit(100),
+    "user_by_username": select(models.User).where(models.User.username == "sajid"),
+    "export_my_trades": export.trade_export_query(1, NOW, NOW),
+    "export_all_trades": export.trade_export_query(None, NOW, NOW),
+    "export_my_trades+archive": export.trade_export_query(1, archive.horizon() - timedelta(days=1), NOW),
+    "export_all_trades+archive": export.trade_export_query(None, None, NOW),
+    "trade_history+archive": archive.select_trades(
+        lambda m: encoding.trade_rows(m).where(m.user_id == 1, m.open_time < NOW), archive.newest_first
+    ).limit(100),
+    "get_my_trades+archive": archive.select_trades(lambda m: encoding.trade_rows(m).where(m.user_id == 1), lambda c: (c.open_time.desc(),)),
+    "archive_batch": archive.archive_batch(NOW),
+    "ledger_latest_snapshot": select(models.BalanceSnapshot).where(models.BalanceSnapshot.user_id == 1, models.BalanceSnapshot.taken_at <= NOW).order_by(models.BalanceSnapshot.taken_at.desc()).limit(1),
+    "ledger_tail_sum": ledger.tail_sum(1, 10, NOW),
+    "ledger_statement": select(models.LedgerEntry).where(models.LedgerEntry.user_id == 1, models.LedgerEntry.created_at > NOW, models.LedgerEntry.created_at <= NOW).order_by(models.LedgerEntry.created_at, models.LedgerEntry.id),
+}
+
+BAD_PLAN_MARKERS = ("USE TEMP B-TREE",)
+
+def is_full_scan(detail: str):
+    # "SCAN trades" is a full scan; "SCAN trades USING INDEX ..." walks an index in order,
+    # and "SCAN CONSTANT ROW" is a SELECT without a FROM
+    return detail.startswith("SCAN ") and "USING" not in detail and detail != "SCAN CONSTANT ROW"
+
+def explain(conn, stmt):
+    compiled = stmt.compile(dialect=engine.dialect)
+    params = tuple(compiled.params[name] for name in compiled.positiontup)
+    rows = conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {compiled}", params).fetchall()
+    return [row[-1] for row in rows]
+
+def bad_steps(plan):
+    return [d for d in plan if is_full_scan(d) or any(m in d for m in BAD_PLAN_MARKERS)]
+
+def check_query_plans():
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    failures = 0
+    with engine.connect() as conn:
+        for name, stmt in HOT_QUERIES.items():
+            plan = explain(conn, stmt)
+            bad = bad_steps(plan)
+            print(f"{'FAIL' if bad else 'ok  '} {name}")
+            for detail in plan:
+                print(f"       {detail}")
+            failures += bool(bad)
+    return failures
+
+if __name__ == "__main__":
+    raise SystemExit(1 if check_query_plans() else 0)
@@ -0,0 +1,103 @@
+import asyncio
+import os
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:  # Windows: one process, always the leader
+    fcntl = None
+
+from bus import BUS_DIR
+
+# How often a follower checks whether the leader has gone away
+ELECTION_INTERVAL = float(os.getenv("LEADER_ELECTION_INTERVAL", "2.0"))
+
+
+class Leadership:
+    # Exactly one worker per machine holds an exclusive flock on the leader
+    # file and runs the singleton jobs (price feed, SL/TP and pending order
+    # execution, equity flush, snapshots, trade archiving, candle
+    # persistence). The kernel drops the lock when that process dies, and a
+    # follower takes over on its next attempt.
+
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+
+    @property
+    def held(self):
+        return self.fd is not None or fcntl is None
+
+    def try_acquire(self):
+        if self.held:
+            return True
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self.fd = fd
+        return True
+
+    def release(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+    async def campaign(self, on_elected, interval=ELECTION_INTERVAL):
+        while not self.try_acquire():
+            await asyncio.sleep(interval)
+        await on_elected()
+
+
+@contextmanager
+def setup_lock():
+    # Serializes one-time startup work (schema setup) across workers
+    if fcntl is None:
+        yield
+        return
+    os.makedirs(BUS_DIR, exist_ok=True)
+    fd = os.open(os.path.join(BUS_DIR, "setup.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+
+class LockHeld(Exception):
+    pass
+
+
+_held = set()
+
+
+@contextmanager
+def exclusive(name):
+    # Non-blocking machine-wide lock for jobs that must not run twice at
+    # once; raises LockHeld if any process (this one included) holds it
+    if name in _held:
+        raise LockHeld(name)
+    fd = None
+    if fcntl is not None:
+        os.makedirs(BUS_DIR, exist_ok=True)
+        fd = os.open(os.path.join(BUS_DIR, name), os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+            raise LockHeld(name)
+    _held.add(name)
+    try:
+        yield
+    finally:
+        _held.discard(name)
+        if fd is not None:
+            os.close(fd)
+
+
+leadership = Leadership(os.path.join(BUS_DIR, "leader.lock"))
@@ -1,19 +1,91 @@
-from sqlalchemy import create_engine
+import os
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 
-SQL_ALCHEMY_DATABASE_URL = "sqlite:///./trading_app.db"
+SQL_ALCHEMY_DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./trading_app.db")
+
+# Request handlers use the async driver for the same database; scripts,
+# schema setup and background jobs keep using the sync engine.
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+}
+
+_url = make_url(SQL_ALCHEMY_DATABASE_URL)
+SYNC_DATABASE_URL = _url.set(drivername=_url.get_backend_name())
+ASYNC_DATABASE_URL = _url.set(drivername=ASYNC_DRIVERS.get(_url.get_backend_name(), _url.drivername))
+
+connect_args = {"check_same_thread": False} if _url.get_backend_name() == "sqlite" else {}
+
+# Connection pool per engine and per worker process; size it so that
+# workers x (pool size + overflow) stays within what the database allows
+POOL_OPTIONS = {
+    "pool_size": int(os.getenv("DB_POOL_SIZE", "5")),
+    "max_overflow": int(os.getenv("DB_MAX_OVERFLOW", "10")),
+    "pool_timeout": float(os.getenv("DB_POOL_TIMEOUT", "30")),
+    "pool_recycle": int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    "pool_pre_ping": os.getenv("DB_POOL_PRE_PING", "0") == "1",
+}
+if _url.get_backend_name() == "sqlite" and _url.database in (None, "", ":memory:"):
+    POOL_OPTIONS = {}  # in-memory SQLite uses a single shared connection
 
 engine = create_engine(
-    SQL_ALCHEMY_DATABASE_URL, connect_args={"check_same_thread": False}
+    SYNC_DATABASE_URL, connect_args=connect_args, **POOL_OPTIONS
 )
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL, connect_args=connect_args, **POOL_OPTIONS
+)
+# expire_on_commit=False: attributes stay readable after commit without an
+# implicit (and, under asyncio, illegal) lazy reload
+AsyncSessionLocal = async_sessionmaker(async_engine, class_=AsyncSession, autoflush=False, expire_on_commit=False)
+
+# SQLite connection profile, applied to every new connection. WAL lets
+# readers proceed while a trade commit is in progress; NORMAL sync is
+# durable across application crashes and only risks the last commits
+# on power loss.
+SQLITE_PRAGMAS = {
+    "journal_mode": os.getenv("SQLITE_JOURNAL_MODE", "WAL"),
+    "synchronous": os.getenv("SQLITE_SYNCHRONOUS", "NORMAL"),
+    "busy_timeout": int(os.getenv("SQLITE_BUSY_TIMEOUT_MS", "5000")),
+    "cache_size": int(os.getenv("SQLITE_CACHE_SIZE", "-65536")),  # negative = KiB, i.e. 64 MiB
+    "mmap_size": int(os.getenv("SQLITE_MMAP_SIZE", str(256 * 1024 * 1024))),
+    "temp_store": "MEMORY",
+}
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    for name, value in SQLITE_PRAGMAS.items():
+        cursor.execute(f"PRAGMA {name}={value}")
+    cursor.close()
+
+if _url.get_backend_name() == "sqlite":
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+    event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+
 Base = declarative_base()
 
-def get_db():
-    db = SessionLocal()
-    try:
+async def get_db():
+    # The one request-scoped session dependency shared by every router
+    async with AsyncSessionLocal() as db:
         yield db
-    finally:
-        db.close()
+
+def upgrade_schema(bind):
+    # create_all only creates missing tables; bring existing ones up to date
+    # by adding new (nullable) columns and any indexes that don't exist yet.
+    inspector = inspect(bind)
+    with bind.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {c["name"] for c in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing:
+                    col_type = column.type.compile(dialect=bind.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {col_type}'))
+            for index in table.indexes:
+                index.create(conn, checkfirst=True)
@@ -0,0 +1,79 @@
+import gzip
+
+import orjson
+from fastapi import Request, Response
+from sqlalchemy import select
+
+import models, schemas
+
+try:
+    import msgpack
+except ImportError:  # optional: without it clients simply get JSON
+    msgpack = None
+
+# Bodies smaller than this aren't worth compressing
+GZIP_MIN_SIZE = 1024
+GZIP_LEVEL = 5
+
+MSGPACK_TYPES = ("application/msgpack", "application/x-msgpack")
+# Accept only picks the encoding when MessagePack can be produced
+VARY = "Accept, Accept-Encoding" if msgpack is not None else "Accept-Encoding"
+
+# Output columns, in the field order of the response models, so the fast path
+# produces exactly the JSON the Pydantic models would
+TRADE_FIELDS = tuple(schemas.Trade.model_fields)
+USER_FIELDS = tuple(schemas.User.model_fields)
+
+
+def trade_rows(model=models.Trade):
+    # model: Trade or TradeArchive, which share their columns
+    return select(*(getattr(model, name) for name in TRADE_FIELDS))
+
+
+def user_rows():
+    return select(*(getattr(models.User, name) for name in USER_FIELDS))
+
+
+def _msgpack_default(value):
+    # Same string form as the JSON output
+    if hasattr(value, "isoformat"):
+        return value.isoformat()
+    raise TypeError(f"Cannot serialize {type(value).__name__}")
+
+
+def variant(request: Request):
+    # The negotiated encoding of a response: (msgpack, gzip)
+    return (
+        msgpack is not None and any(t in request.headers.get("accept", "") for t in MSGPACK_TYPES),
+        "gzip" in request.headers.get("accept-encoding", ""),
+    )
+
+
+def rows_response(request: Request, fields, rows, headers=None):
+    # Encode plain result rows as a list of objects, skipping ORM instances
+    # and per-row model validation
+    return encoded_response(request, [dict(zip(fields, row)) for row in rows], headers)
+
+
+def object_response(request: Request, fields, obj, headers=None):
+    # One object (ORM row or model) as a JSON object of the given fields
+    return encoded_response(request, {name: getattr(obj, name) for name in fields}, headers)
+
+
+def encoded_response(request: Request, content, headers=None):
+    # JSON by default; MessagePack when the client asks for it; gzip when the
+    # client accepts it and it pays off
+    use_msgpack, use_gzip = variant(request)
+    if use_msgpack:
+        body = msgpack.packb(content, default=_msgpack_default)
+        media_type = "application/msgpack"
+    else:
+        body = orjson.dumps(content)
+        media_type = "application/json"
+
+    headers = dict(headers or {})
+    headers["Vary"] = VARY
+    if len(body) >= GZIP_MIN_SIZE and use_gzip:
+        body = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type=media_type, headers=headers)
@@ -0,0 +1,175 @@
+import asyncio
+import os
+from contextlib import contextmanager
+from datetime import datetime
+from types import SimpleNamespace
+
+import mtm, triggers, orders, quotes, schemas, logs
+from bus import bus
+from cluster import leadership
+from database import AsyncSessionLocal
+from realtime import manager
+from response_cache import cache as response_cache, ALL_USERS
+from summary import summary
+from token_cache import cache as token_cache
+
+log = logs.get_logger("events")
+
+# Post-commit hooks for the write paths. Routers call these once their
+# transaction has committed; every in-memory view of trades and accounts
+# is kept in step from here, in this worker directly and in the other
+# workers through the bus (one message per commit, see batched()).
+#
+# The in-memory views are also rebuilt from the database: at startup, when
+# a worker becomes the leader, when the bus asks for a resync, and every
+# RECONCILE_INTERVAL seconds to correct any drift. Applying a change is
+# idempotent, so one that the database already reflects is harmless.
+
+RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "300"))
+
+_batch = None   # changes of the commit being reported, inside batched()
+_replay = None  # changes applied while reload() reads the database
+_reload_lock = asyncio.Lock()
+
+
+def account_changed(user):
+    _emit("account", schemas.User.model_validate(user).model_dump(mode="json"))
+
+def trade_opened(trade, user):
+    data = schemas.Trade.model_validate(trade).model_dump(mode="json")
+    _emit("trade_opened", {"trade": data, "balance": user.balance})
+
+def trade_closed(trade, user=None):
+    # Batch closes pass user=None and report each account once afterwards
+    with batched():
+        _emit("trade_closed", schemas.Trade.model_validate(trade).model_dump(mode="json"))
+        if user is not None:
+            account_changed(user)
+
+def trade_changed(trade):
+    # An open or closed trade edited in place (e.g. its forced outcome)
+    _emit("trade_changed", schemas.Trade.model_validate(trade).model_dump(mode="json"))
+
+def order_changed(order):
+    # Placed, cancelled, filled or expired pending order
+    _emit("order", schemas.PendingOrder.model_validate(order).model_dump(mode="json"))
+
+def quotes_ticked(quote_engine):
+    # Quote listener: the leader owns the price feed and mirrors every tick
+    # to the followers; a follower that is behind only needs the newest
+    if leadership.held:
+        bus.publish("quotes", quote_engine.state(), latest=True)
+
+@contextmanager
+def batched():
+    # Everything reported inside goes to the other workers as one message,
+    # e.g. all trades of a close-all and the accounts they credited
+    global _batch
+    if _batch is not None:
+        yield  # already inside a batch
+        return
+    _batch = []
+    try:
+        yield
+    finally:
+        changes, _batch = _batch, None
+        if changes:
+            bus.publish("changes", changes)
+
+def _emit(kind, data):
+    _apply(kind, data)
+    if _batch is not None:
+        _batch.append((kind, data))
+    else:
+        bus.publish("changes", [(kind, data)])
+
+def _apply(kind, data):
+    APPLY[kind](data)
+    if _replay is not None:
+        _replay.append((kind, data))
+
+# Local effects, shared by both paths
+
+def _account_changed(account):
+    token_cache.invalidate_user(account["id"])
+    response_cache.bump(account["id"], ALL_USERS)
+    mtm.engine.set_balance(account["id"], account["balance"])
+    summary.account_changed(account)
+    manager.publish(account["id"], {"type": "account", "account": account})
+
+def _trade_opened(message):
+    data = message["trade"]
+    trade = SimpleNamespace(**data)
+    mtm.engine.open_position(trade, message["balance"])
+    triggers.engine.add(trade)
+    summary.trade_opened(data)
+    response_cache.bump(data["user_id"])
+    manager.publish(data["user_id"], {"type": "trade", "trade": data})
+
+def _trade_closed(data):
+    mtm.engine.close_position(data["id"])
+    triggers.engine.remove(data["id"])
+    summary.trade_closed(data)
+    response_cache.bump(data["user_id"])
+    manager.publish(data["user_id"], {"type": "trade", "trade": data})
+
+def _trade_changed(data):
+    response_cache.bump(data["user_id"])
+    manager.publish(data["user_id"], {"type": "trade", "trade": data})
+
+def _order_changed(data):
+    if data["status"] == "PENDING":
+        expires_at = datetime.fromisoformat(data["expires_at"]) if data["expires_at"] else None
+        orders.engine.add(data["id"], data["symbol"], data["type"], data["price"], expires_at)
+    else:
+        orders.engine.remove(data["id"])
+    manager.publish(data["user_id"], {"type": "order", "order": data})
+
+APPLY = {
+    "account": _account_changed,
+    "trade_opened": _trade_opened,
+    "trade_closed": _trade_closed,
+    "trade_changed": _trade_changed,
+    "order": _order_changed,
+}
+
+# Rebuilding from the database
+
+async def reload():
+    # Each engine reads and then swaps in its new state; changes applied
+    # meanwhile may have hit the old state, so they are applied again on top
+    global _replay
+    async with _reload_lock:
+        _replay = seen = []
+        try:
+            async with AsyncSessionLocal() as db:
+                await mtm.engine.load(db)
+                await triggers.engine.load(db)
+                await orders.engine.load(db)
+                await summary.recount(db)
+        finally:
+            _replay = None
+        for kind, data in seen:
+            APPLY[kind](data)
+
+async def run_reconciles(interval=RECONCILE_INTERVAL):
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await reload()
+        except Exception:
+            log.exception("Reconcile from the database failed")
+
+# From other workers
+
+def _remote_changes(changes):
+    for kind, data in changes:
+        _apply(kind, data)
+
+async def _remote_quotes(state):
+    quotes.engine.load_state(state)
+    await quotes.engine.notify()
+
+bus.on("changes", _remote_changes)
+bus.on("quotes", _remote_quotes)
+bus.on("resync", lambda _: reload())
@@ -0,0 +1,79 @@
+import csv
+import io
+from datetime import datetime
+
+import orjson
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+
+import archive
+from database import AsyncSessionLocal
+from encoding import TRADE_FIELDS, trade_rows
+
+# Rows fetched from the server-side cursor per round trip; also the unit of
+# output, so memory stays at one batch however large the export is
+EXPORT_BATCH = 1000
+
+FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "ndjson": ("application/x-ndjson", "ndjson"),
+}
+
+
+def trade_export_query(user_id=None, start=None, end=None, symbol=None, status=None):
+    # Reads the archive too when the range reaches back past its horizon
+    def build(model):
+        stmt = trade_rows(model)
+        if user_id is not None:
+            stmt = stmt.where(model.user_id == user_id)
+        if start is not None:
+            stmt = stmt.where(model.open_time >= start)
+        if end is not None:
+            stmt = stmt.where(model.open_time < end)
+        if symbol is not None:
+            stmt = stmt.where(model.symbol == symbol.upper())
+        if status is not None:
+            stmt = stmt.where(model.status == status.upper())
+        return stmt
+    return archive.select_trades(build, lambda c: (c.open_time, c.id), start)
+
+
+def _csv_value(value):
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+
+async def _stream(stmt, fmt):
+    # Owns its session: the request's session is gone by the time a long
+    # export is still streaming
+    async with AsyncSessionLocal() as db:
+        result = await db.stream(stmt.execution_options(yield_per=EXPORT_BATCH))
+        if fmt == "csv":
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(TRADE_FIELDS)
+            async for batch in result.partitions():
+                writer.writerows([_csv_value(v) for v in row] for row in batch)
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+            if buffer.tell():
+                yield buffer.getvalue()
+        else:
+            async for batch in result.partitions():
+                yield b"".join(orjson.dumps(dict(zip(TRADE_FIELDS, row))) + b"\n" for row in batch)
+
+
+def export_response(stmt, fmt, name):
+    if fmt not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format, use one of: {', '.join(FORMATS)}")
+    media_type, extension = FORMATS[fmt]
+    filename = f"{name}-{datetime.utcnow():%Y%m%d-%H%M%S}.{extension}"
+    return StreamingResponse(
+        _stream(stmt, fmt),
+        media_type=media_type,
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
@@ -0,0 +1,17 @@
+from database import engine, Base, upgrade_schema
+import models, ledger
+
+# One-time schema setup: create missing tables, add missing columns and
+# indexes, backfill derived data. Run it once before starting the workers
+# (python init_db.py); with DB_SETUP_ON_START=1 (the default) the app also
+# runs it at startup, one worker at a time.
+
+def setup():
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    with engine.begin() as conn:
+        conn.execute(ledger.opening_entries())
+
+if __name__ == "__main__":
+    setup()
+    print("Database schema is up to date")
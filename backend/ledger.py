@@ -0,0 +1,146 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from sqlalchemy import exists, func, insert, literal, select
+
+import models, logs
+from database import AsyncSessionLocal
+
+log = logs.get_logger("ledger")
+
+# How often balances are snapshotted. A point-in-time balance is the latest
+# snapshot plus the entries after it, so this bounds how much ledger any
+# balance or statement query has to sum, however old the account is.
+LEDGER_SNAPSHOT_INTERVAL = float(os.getenv("LEDGER_SNAPSHOT_INTERVAL", "3600"))
+# Entries younger than this wait for the next snapshot, so a transaction that
+# took an id early but committed late isn't skipped
+SNAPSHOT_GRACE = timedelta(seconds=10)
+# Most entries returned by one statement request
+STATEMENT_MAX_ENTRIES = 5000
+
+# Writing. Always inside the caller's transaction, never committed here.
+
+def record(db, user_id, kind, amount=0.0, equity_delta=0.0, trade_id=None):
+    db.add(models.LedgerEntry(user_id=user_id, kind=kind, amount=amount, equity_delta=equity_delta, trade_id=trade_id))
+
+async def record_many(db, entries):
+    # entries: dicts of LedgerEntry columns; one executemany INSERT
+    if entries:
+        await db.execute(insert(models.LedgerEntry), entries)
+
+async def record_adjustment(db, user_id, balance=None, equity=None):
+    # Logs an admin "set balance/equity to X" as a delta against the current
+    # row. It must be the transaction's first statement: as a write, the
+    # INSERT ... SELECT takes SQLite's database write lock before it reads
+    # the row, and the lock is held through the UPDATE that follows until
+    # commit, so no close can commit in between and the delta is exact.
+    # (SQLite has no row locks; FOR UPDATE would be ignored.)
+    users = models.User.__table__
+    amount = literal(balance) - users.c.balance if balance is not None else literal(0.0)
+    equity_delta = literal(equity) - users.c.equity if equity is not None else literal(0.0)
+    source = select(users.c.id, literal("adjustment"), amount, equity_delta, literal(datetime.utcnow())).where(users.c.id == user_id)
+    stmt = insert(models.LedgerEntry).from_select(["user_id", "kind", "amount", "equity_delta", "created_at"], source)
+    await db.execute(stmt)
+
+# Reading
+
+def tail_sum(user_id, after_id, at):
+    # Walk (user_id, id) from the snapshot forward. Without the hint SQLite
+    # prefers the (user_id, created_at) index, which reads the whole history.
+    return (
+        select(func.coalesce(func.sum(models.LedgerEntry.amount), 0.0))
+        .with_hint(models.LedgerEntry, "INDEXED BY ix_ledger_user_id", "sqlite")
+        .where(models.LedgerEntry.user_id == user_id, models.LedgerEntry.id > after_id, models.LedgerEntry.created_at <= at)
+    )
+
+async def balance_at(db, user_id, at):
+    snapshot = await db.scalar(
+        select(models.BalanceSnapshot)
+        .where(models.BalanceSnapshot.user_id == user_id, models.BalanceSnapshot.taken_at <= at)
+        .order_by(models.BalanceSnapshot.taken_at.desc())
+        .limit(1)
+    )
+    after_id, balance = (snapshot.ledger_id, snapshot.balance) if snapshot else (0, 0.0)
+    tail = await db.scalar(tail_sum(user_id, after_id, at))
+    return balance + tail
+
+async def statement(db, user_id, start, end, limit):
+    # Opening/closing balances come from snapshots; only the entries in the
+    # period itself are read
+    entries = (await db.scalars(
+        select(models.LedgerEntry)
+        .where(models.LedgerEntry.user_id == user_id, models.LedgerEntry.created_at > start, models.LedgerEntry.created_at <= end)
+        .order_by(models.LedgerEntry.created_at, models.LedgerEntry.id)
+        .limit(limit)
+    )).all()
+    return {
+        "user_id": user_id,
+        "start": start,
+        "end": end,
+        "opening_balance": await balance_at(db, user_id, start),
+        "closing_balance": await balance_at(db, user_id, end),
+        "entries": entries,
+    }
+
+# Maintenance
+
+def opening_entries():
+    # Accounts created before the ledger existed get one 'opening' entry
+    # carrying their current balance, so sums over the ledger add up.
+    # Run once by schema setup (init_db.py).
+    users = models.User.__table__
+    entries = models.LedgerEntry.__table__
+    source = (
+        select(users.c.id, literal("opening"), users.c.balance, users.c.equity, literal(datetime.utcnow()))
+        .where(~exists().where(entries.c.user_id == users.c.id))
+    )
+    return insert(entries).from_select(["user_id", "kind", "amount", "equity_delta", "created_at"], source)
+
+async def take_snapshots(db):
+    # Snapshots every account with entries since the last run. Works from a
+    # global watermark (the newest ledger id already covered), so each run
+    # only reads the new tail of the ledger.
+    cutoff = datetime.utcnow() - SNAPSHOT_GRACE
+    watermark = await db.scalar(select(func.coalesce(func.max(models.BalanceSnapshot.ledger_id), 0)))
+    upper = await db.scalar(
+        select(func.max(models.LedgerEntry.id))
+        .where(models.LedgerEntry.id > watermark, models.LedgerEntry.created_at <= cutoff)
+    )
+    if upper is None:
+        return 0
+
+    tails = dict((await db.execute(
+        select(models.LedgerEntry.user_id, func.sum(models.LedgerEntry.amount))
+        .where(models.LedgerEntry.id > watermark, models.LedgerEntry.id <= upper)
+        .group_by(models.LedgerEntry.user_id)
+    )).all())
+
+    previous = {}
+    user_ids = list(tails)
+    for start in range(0, len(user_ids), 500):
+        chunk = user_ids[start:start + 500]
+        latest = (
+            select(func.max(models.BalanceSnapshot.id))
+            .where(models.BalanceSnapshot.user_id.in_(chunk))
+            .group_by(models.BalanceSnapshot.user_id)
+        )
+        rows = await db.execute(select(models.BalanceSnapshot.user_id, models.BalanceSnapshot.balance).where(models.BalanceSnapshot.id.in_(latest)))
+        previous.update(rows.all())
+
+    snapshots = [
+        {"user_id": user_id, "ledger_id": upper, "balance": previous.get(user_id, 0.0) + tail, "taken_at": cutoff}
+        for user_id, tail in tails.items()
+    ]
+    await db.execute(insert(models.BalanceSnapshot), snapshots)
+    await db.commit()
+    return len(snapshots)
+
+async def run_snapshots(interval=LEDGER_SNAPSHOT_INTERVAL):
+    while True:
+        try:
+            async with AsyncSessionLocal() as db:
+                await take_snapshots(db)
+        except Exception:
+            log.exception("Balance snapshot failed")
+        await asyncio.sleep(interval)
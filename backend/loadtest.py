@@ -0,0 +1,251 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import string
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+import httpx
+import numpy as np
+
+# Load test for the API hot paths. Simulates N concurrent users following the
+# real client pattern (login, /trades/ every 1s, /auth/me every 2s, placing and
+# closing trades) plus admins polling /admin/users and /admin/trades.
+#
+#   python loadtest.py --users 50 --duration 30                 # in-process
+#   python loadtest.py --url http://localhost:8000 --users 200  # against uvicorn
+#   python loadtest.py --save before.json
+#   python loadtest.py --baseline before.json --save after.json
+
+PASSWORD = "password123"
+SYMBOLS = ["EURUSD", "GBPUSD", "USDJPY", "XAUUSD", "BTCUSD"]
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.errors = {}
+
+    async def call(self, client, route, method, url, **kwargs):
+        started = time.perf_counter()
+        try:
+            res = await client.request(method, url, **kwargs)
+        except httpx.HTTPError:
+            res = None
+        elapsed = (time.perf_counter() - started) * 1000
+        self.samples.setdefault(route, []).append(elapsed)
+        if res is None or res.status_code >= 400:
+            self.errors[route] = self.errors.get(route, 0) + 1
+            return None
+        return res
+
+    def report(self, duration):
+        routes = {}
+        for route, samples in sorted(self.samples.items()):
+            ms = np.array(samples)
+            p50, p95, p99 = np.percentile(ms, [50, 95, 99])
+            routes[route] = {
+                "requests": len(ms),
+                "errors": self.errors.get(route, 0),
+                "rps": round(len(ms) / duration, 2),
+                "p50_ms": round(float(p50), 2),
+                "p95_ms": round(float(p95), 2),
+                "p99_ms": round(float(p99), 2),
+                "max_ms": round(float(ms.max()), 2),
+            }
+        total = sum(r["requests"] for r in routes.values())
+        return {
+            "requests": total,
+            "errors": sum(r["errors"] for r in routes.values()),
+            "rps": round(total / duration, 2),
+            "routes": routes,
+        }
+
+
+async def every(interval, deadline, action):
+    # Fire on a fixed schedule, like the client's setInterval polling
+    next_run = time.perf_counter() + random.uniform(0, interval)
+    while True:
+        await asyncio.sleep(max(0.0, next_run - time.perf_counter()))
+        if time.perf_counter() >= deadline:
+            return
+        await action()
+        next_run += interval
+
+
+async def trader(client, rec, username, deadline, trade_interval):
+    res = await rec.call(client, "POST /auth/token", "POST", "/auth/token", data={"username": username, "password": PASSWORD})
+    if res is None:
+        return
+    headers = {"Authorization": f"Bearer {res.json()['access_token']}"}
+    open_ids = []
+
+    async def poll_trades():
+        await rec.call(client, "GET /trades/", "GET", "/trades/", headers=headers)
+
+    async def poll_me():
+        await rec.call(client, "GET /auth/me", "GET", "/auth/me", headers=headers)
+
+    async def trade():
+        if open_ids and random.random() < 0.5:
+            trade_id = open_ids.pop(random.randrange(len(open_ids)))
+            await rec.call(client, "PUT /trades/{id}/close", "PUT", f"/trades/{trade_id}/close", headers=headers)
+            return
+        payload = {"symbol": random.choice(SYMBOLS), "type": random.choice(["buy", "sell"]), "volume": 0.01, "entry_price": 0}
+        res = await rec.call(client, "POST /trades/", "POST", "/trades/", json=payload, headers=headers)
+        if res is not None:
+            open_ids.append(res.json()["id"])
+
+    await asyncio.gather(
+        every(1.0, deadline, poll_trades),
+        every(2.0, deadline, poll_me),
+        every(trade_interval, deadline, trade),
+    )
+
+
+async def admin(client, rec, deadline, interval):
+    async def poll_users():
+        await rec.call(client, "GET /admin/users", "GET", "/admin/users")
+
+    async def poll_trades():
+        await rec.call(client, "GET /admin/trades", "GET", "/admin/trades")
+
+    await asyncio.gather(every(interval, deadline, poll_users), every(interval, deadline, poll_trades))
+
+
+async def provision(client, count):
+    # Fresh accounts per run so results don't depend on leftovers
+    run = "".join(random.choices(string.ascii_lowercase, k=6))
+    usernames = []
+    for i in range(count):
+        username = f"load_{run}_{i}"
+        payload = {
+            "full_name": f"Load {i}",
+            "username": username,
+            "password": PASSWORD,
+            "broker": "MetaQuotes-Demo",
+            "account_type": "demo",
+            "balance": 10000.0,
+        }
+        res = await client.post("/admin/users", json=payload)
+        res.raise_for_status()
+        usernames.append(username)
+    return usernames
+
+
+async def run(client, args):
+    usernames = await provision(client, args.users)
+    rec = Recorder()
+    started = time.perf_counter()
+    deadline = started + args.duration
+    await asyncio.gather(
+        *(trader(client, rec, username, deadline, args.trade_interval) for username in usernames),
+        *(admin(client, rec, deadline, args.admin_interval) for _ in range(args.admins)),
+    )
+    return rec.report(time.perf_counter() - started)
+
+
+async def run_in_process(args):
+    # Runs the app with its lifespan inside this process on a throwaway database
+    import main
+    limits = httpx.Limits(max_connections=None)
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://loadtest", limits=limits, timeout=30) as client:
+            return await run(client, args)
+
+
+async def run_remote(args):
+    limits = httpx.Limits(max_connections=args.users + args.admins * 2 + 10)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=30) as client:
+        return await run(client, args)
+
+
+def compare(result, baseline, tolerance):
+    # Prints per-route p95/throughput deltas; returns the routes that regressed
+    regressed = []
+    print(f"\n{'route':28} {'p95 base':>10} {'p95 now':>10} {'delta':>8} {'rps base':>10} {'rps now':>10}")
+    for route, now in result["routes"].items():
+        base = baseline["routes"].get(route)
+        if base is None:
+            print(f"{route:28} {'-':>10} {now['p95_ms']:>10.2f} {'new':>8}")
+            continue
+        delta = (now["p95_ms"] - base["p95_ms"]) / base["p95_ms"] * 100 if base["p95_ms"] else 0.0
+        flag = ""
+        if delta > tolerance:
+            regressed.append(route)
+            flag = "  REGRESSED"
+        print(f"{route:28} {base['p95_ms']:>10.2f} {now['p95_ms']:>10.2f} {delta:>+7.1f}% {base['rps']:>10.2f} {now['rps']:>10.2f}{flag}")
+    return regressed
+
+
+def print_report(result):
+    print(f"\n{'route':28} {'reqs':>7} {'err':>5} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'max':>8}")
+    for route, r in result["routes"].items():
+        print(f"{route:28} {r['requests']:>7} {r['errors']:>5} {r['rps']:>8.1f} {r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f} {r['max_ms']:>8.2f}")
+    print(f"{'total':28} {result['requests']:>7} {result['errors']:>5} {result['rps']:>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the trading API hot paths")
+    parser.add_argument("--url", help="Base URL of a running server; omit to run the app in-process")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--admins", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds")
+    parser.add_argument("--trade-interval", type=float, default=5.0, help="seconds between trade actions per user")
+    parser.add_argument("--admin-interval", type=float, default=2.0, help="seconds between admin polls")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--replay", help="in-process only: drive prices from this tick recording (see ticks.py)")
+    parser.add_argument("--replay-speed", type=float, default=1.0, help="replay speed factor, 0 = as fast as possible")
+    parser.add_argument("--save", help="write the JSON results here")
+    parser.add_argument("--baseline", help="JSON results of an earlier run to compare against")
+    parser.add_argument("--tolerance", type=float, default=10.0, help="allowed p95 increase over the baseline, in percent")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    if args.url:
+        result = asyncio.run(run_remote(args))
+    else:
+        # Must be set before the app (and its database module) is imported
+        os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "loadtest.db"))
+        os.environ.setdefault("CANDLE_DIR", "")
+        os.environ.setdefault("QUOTE_SEED", str(args.seed))
+        if args.replay:
+            os.environ["QUOTE_REPLAY_DIR"] = args.replay
+            os.environ["QUOTE_REPLAY_SPEED"] = str(args.replay_speed)
+        result = asyncio.run(run_in_process(args))
+
+    result["config"] = {
+        "target": args.url or "in-process",
+        "users": args.users,
+        "admins": args.admins,
+        "duration": args.duration,
+        "trade_interval": args.trade_interval,
+        "admin_interval": args.admin_interval,
+        "seed": args.seed,
+        "replay": args.replay,
+        "replay_speed": args.replay_speed if args.replay else None,
+        "at": datetime.utcnow().isoformat(timespec="seconds"),
+    }
+    print_report(result)
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressed = compare(result, baseline, args.tolerance)
+        if regressed:
+            print(f"\np95 regressed by more than {args.tolerance}% on: {', '.join(regressed)}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+import atexit
+import contextvars
+import logging
+import os
+import queue
+import random
+import sys
+import time
+from logging.handlers import QueueHandler, QueueListener
+
+import orjson
+
+# Structured, non-blocking logging. Request handlers and engines only put
+# records on an in-memory queue; a background thread formats them as one
+# JSON object per line and writes them out. Records can be sampled per
+# logger and filtered per route, both before they are queued.
+
+# Threshold for everything under the "trader" logger
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# "json" (one object per line) or "text"
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json")
+# Per-route thresholds by path prefix, e.g. "/auth/token=WARNING,/admin=DEBUG";
+# the longest matching prefix wins over LOG_LEVEL
+LOG_ROUTE_LEVELS = os.getenv("LOG_ROUTE_LEVELS", "")
+# Share of INFO/DEBUG records kept, per logger, e.g. "auth=0.01,*=1";
+# warnings and errors are never sampled away
+LOG_SAMPLE = os.getenv("LOG_SAMPLE", "")
+# Records held while the writer thread catches up; beyond it they are dropped
+LOG_QUEUE_SIZE = int(os.getenv("LOG_QUEUE_SIZE", "10000"))
+
+ROOT = "trader"
+
+# Path of the request being served, set by RequestContextMiddleware
+request_path = contextvars.ContextVar("request_path", default=None)
+
+
+def _pairs(spec):
+    pairs = []
+    for item in spec.split(","):
+        name, _, value = item.strip().partition("=")
+        if name and value:
+            pairs.append((name.strip(), value.strip()))
+    return pairs
+
+
+def get_logger(name):
+    return logging.getLogger(f"{ROOT}.{name}")
+
+
+class RequestFilter(logging.Filter):
+    # Runs on the caller's thread, before the record is queued: route
+    # thresholds and sampling drop records without any formatting cost.
+
+    def __init__(self, level=LOG_LEVEL, route_levels=LOG_ROUTE_LEVELS, sample=LOG_SAMPLE):
+        super().__init__()
+        self.level = logging.getLevelName(level)
+        self.route_levels = sorted(
+            ((prefix, logging.getLevelName(level.upper())) for prefix, level in _pairs(route_levels)),
+            key=lambda pair: len(pair[0]), reverse=True,
+        )
+        self.sample = {name: float(rate) for name, rate in _pairs(sample)}
+        self.sampled_out = 0
+
+    def lowest_level(self):
+        return min([self.level] + [level for _, level in self.route_levels])
+
+    def filter(self, record):
+        path = request_path.get()
+        record.path = path
+        threshold = self.level
+        if path is not None:
+            for prefix, level in self.route_levels:
+                if path.startswith(prefix):
+                    threshold = level
+                    break
+        if record.levelno < threshold:
+            return False
+        if record.levelno < logging.WARNING and self.sample:
+            rate = self.sample.get(record.name[len(ROOT) + 1:], self.sample.get("*", 1.0))
+            if rate < 1.0 and random.random() >= rate:
+                self.sampled_out += 1
+                return False
+        return True
+
+
+class Enqueue(QueueHandler):
+    # Never blocks the caller: a full queue drops the record and counts it
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # Formatting happens on the writer thread; only make the record
+        # safe to hand over (the message and traceback rendered to text)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": round(record.created, 6),
+            "level": record.levelname,
+            "logger": record.name,
+            "msg": record.msg,
+        }
+        path = getattr(record, "path", None)
+        if path is not None:
+            entry["path"] = path
+        fields = getattr(record, "fields", None)
+        if fields:
+            entry.update(fields)
+        if record.exc_text:
+            entry["exc"] = record.exc_text
+        return orjson.dumps(entry, default=str).decode()
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created))} {record.levelname:<7} {record.name} {record.msg}"
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{k}={v}" for k, v in fields.items())
+        if record.exc_text:
+            line += "\n" + record.exc_text
+        return line
+
+
+class Pipeline:
+    def __init__(self):
+        self.queue = queue.Queue(LOG_QUEUE_SIZE)
+        self.filter = RequestFilter()
+        self.handler = Enqueue(self.queue)
+        self.handler.addFilter(self.filter)
+        self.listener = None
+
+    def start(self, stream=None):
+        if self.listener is not None:
+            return
+        logger = logging.getLogger(ROOT)
+        # The logger lets through what any route wants; the filter narrows it
+        logger.setLevel(self.filter.lowest_level())
+        logger.propagate = False
+        logger.handlers = [self.handler]
+        output = logging.StreamHandler(stream or sys.stdout)
+        output.setFormatter(TextFormatter() if LOG_FORMAT == "text" else JsonFormatter())
+        self.listener = QueueListener(self.queue, output)
+        self.listener.start()
+        atexit.register(self.stop)
+
+    def stop(self):
+        # Flushes what is queued, then joins the writer thread
+        if self.listener is not None:
+            self.listener.stop()
+            self.listener = None
+
+    def stats(self):
+        return {
+            "queued": self.queue.qsize(),
+            "dropped": self.handler.dropped,
+            "sampled_out": self.filter.sampled_out,
+        }
+
+
+pipeline = Pipeline()
+
+
+class RequestContextMiddleware:
+    # Raw ASGI: makes the request path visible to the log filter
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+        token = request_path.set(scope["path"])
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            request_path.reset(token)
@@ -1,12 +1,85 @@
-from fastapi import FastAPI
+import asyncio
+import os
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, WebSocket, status
+from fastapi.responses import PlainTextResponse
 from fastapi.middleware.cors import CORSMiddleware
-from routers import auth, admin, trade
-from database import engine, Base
+from routers import auth, admin, trade, order, market, charts
+from sqlalchemy import select
+from database import engine, async_engine, AsyncSessionLocal
+from realtime import Connection, manager
+from token_cache import cache as token_cache
+from response_cache import cache as response_cache
+from bus import bus
+from cluster import leadership, setup_lock
+import models, schemas, quotes, mtm, triggers, orders, candles, auth_utils, metrics, ledger, events, init_db, archive, ticks, logs, profiling
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# Schema setup is not done at import. Run `python init_db.py` once before
+# starting the workers, or leave DB_SETUP_ON_START=1 to have each worker run
+# it (serialized, and a no-op once the schema is current) at startup.
+DB_SETUP_ON_START = os.getenv("DB_SETUP_ON_START", "1") == "1"
 
-app = FastAPI(title="Private Practice Trading App")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Every worker serves requests and keeps in-memory state in step through
+    # the bus; the one holding the leader lock also runs the singleton jobs.
+    logs.pipeline.start()
+    if DB_SETUP_ON_START:
+        with setup_lock():
+            init_db.setup()
+    # Join the bus first: from then on the other workers' changes queue up
+    # for us, so the state loaded next misses none of them
+    await bus.start()
+    await events.reload()
+    candles.store.load_recent()
+    quotes.engine.add_listener(events.quotes_ticked)
+    quotes.engine.add_listener(candles.store.on_tick)
+    quotes.engine.add_listener(mtm.engine.on_tick)
+    quotes.engine.add_listener(triggers.engine.on_tick)
+    quotes.engine.add_listener(orders.engine.on_tick)
+    quotes.engine.add_listener(manager.on_tick)
+    mtm.engine.add_listener(manager.on_accounts)
+
+    triggers.engine.active = False
+    orders.engine.active = False
+    candles.store.persist = False
+    tasks = [asyncio.create_task(bus.run()), asyncio.create_task(events.run_reconciles())]
+
+    async def lead():
+        # Start from the database, not from what this follower heard: the
+        # flusher writes its equity and only the leader fires SL/TP and fills
+        await events.reload()
+        triggers.engine.active = True
+        orders.engine.active = True
+        candles.store.persist = True
+        if ticks.QUOTE_REPLAY_DIR:
+            feed = ticks.TickReplay(ticks.QUOTE_REPLAY_DIR).run(quotes.engine)
+        else:
+            feed = quotes.engine.run()
+            if ticks.recorder is not None:
+                quotes.engine.add_listener(ticks.recorder.on_tick)
+        tasks.extend([
+            asyncio.create_task(feed),
+            asyncio.create_task(mtm.engine.run_flusher()),
+            asyncio.create_task(ledger.run_snapshots()),
+            asyncio.create_task(archive.run_archiver()),
+        ])
+
+    tasks.append(asyncio.create_task(leadership.campaign(lead)))
+    yield
+    for task in tasks:
+        task.cancel()
+    if leadership.held:
+        await mtm.engine.flush()
+    if ticks.recorder is not None:
+        ticks.recorder.close()
+    leadership.release()
+    await bus.stop()
+    auth_utils.hash_pool.shutdown()
+    await async_engine.dispose()
+    logs.pipeline.stop()
+
+app = FastAPI(title="Private Practice Trading App", lifespan=lifespan)
 
 # CORS
 origins = [
@@ -21,10 +94,62 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(logs.RequestContextMiddleware)
+app.add_middleware(profiling.ProfilingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+metrics.instrument({"sync": engine, "async": async_engine.sync_engine})
+metrics.registry.add_gauge("token_cache", "Token cache counters", lambda: {(("stat", k),): v for k, v in token_cache.stats().items()})
+metrics.registry.add_gauge("response_cache", "Response cache counters", lambda: {(("stat", k),): v for k, v in response_cache.stats().items()})
+metrics.registry.add_gauge("password_hash_pool", "Password hashing pool counters", lambda: {(("stat", k),): v for k, v in auth_utils.hash_pool.stats().items() if isinstance(v, (int, float))})
+metrics.registry.add_gauge("bus", "Inter-worker bus counters", lambda: {(("stat", k),): v for k, v in bus.stats().items()})
+metrics.registry.add_gauge("logging", "Log pipeline counters", lambda: {(("stat", k),): v for k, v in logs.pipeline.stats().items()})
+metrics.registry.add_gauge("profiling", "Request profiler counters", lambda: {(("stat", k),): v for k, v in profiling.profiler.stats().items()})
+metrics.registry.add_gauge("leader", "1 if this worker runs the singleton jobs", lambda: {(): int(leadership.held)})
+metrics.registry.add_gauge("websocket_connections", "Open WebSocket connections", lambda: {(): sum(len(c) for c in list(manager.by_user.values()))})
+
 app.include_router(auth.router, prefix="/auth")
 app.include_router(admin.router)
 app.include_router(trade.router)
+app.include_router(order.router)
+app.include_router(market.router)
+app.include_router(charts.router)
 
 @app.get("/")
 def read_root():
     return {"message": "Private Practice Trading API is running"}
+
+# async: the gauges read loop-owned state (connections, engines, bus)
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def read_metrics():
+    return PlainTextResponse(metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+async def load_user(token: str):
+    async with AsyncSessionLocal() as db:
+        return await auth.user_from_token(token, db)
+
+async def load_snapshot(user_id: int):
+    # Read only once the connection is registered (see ConnectionManager.serve)
+    async with AsyncSessionLocal() as db:
+        user = await db.get(models.User, user_id)
+        if user is None:
+            return None
+        trades = (await db.scalars(select(models.Trade).where(models.Trade.user_id == user_id).order_by(models.Trade.open_time.desc()))).all()
+        return {
+            "type": "snapshot",
+            "account": schemas.User.model_validate(user).model_dump(mode="json"),
+            "trades": [schemas.Trade.model_validate(t).model_dump(mode="json") for t in trades],
+            "quotes": quotes.engine.all(),
+            "quotes_seq": quotes.engine.seq,
+        }
+
+@app.websocket("/ws")
+async def websocket_endpoint(websocket: WebSocket, token: str):
+    # Initial snapshot, then only diffs: trade/account events and batched quote ticks
+    user = await load_user(token)
+    if user is None:
+        await websocket.close(code=status.WS_1008_POLICY_VIOLATION)
+        return
+    await websocket.accept()
+    conn = Connection(websocket, user.id, user.role == "admin")
+    await manager.serve(conn, lambda: load_snapshot(user.id))
@@ -0,0 +1,260 @@
+import contextvars
+import os
+import threading
+import time
+from bisect import bisect_left
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+import logs
+
+log = logs.get_logger("metrics")
+
+# Latency bucket upper bounds in seconds (Prometheus "le" labels)
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+# Requests slower than this are logged with the SQL they ran; 0 disables it
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", "0"))
+# At most this many statements are kept per request for the slow log
+SLOW_REQUEST_MAX_STATEMENTS = 50
+
+
+class Histogram:
+    __slots__ = ("counts", "total", "count")
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(LATENCY_BUCKETS, value)] += 1
+        self.total += value
+        self.count += 1
+
+
+class RequestStats:
+    # Per-request accumulator, reachable from SQLAlchemy hooks via a context var
+    __slots__ = ("queries", "db_time", "statements")
+
+    def __init__(self, keep_statements):
+        self.queries = 0
+        self.db_time = 0.0
+        self.statements = [] if keep_statements else None
+
+
+current = contextvars.ContextVar("request_stats", default=None)
+
+
+class Registry:
+    # Plain counters behind one lock; scraping renders them as Prometheus text.
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = {}        # (method, route, status) -> count
+        self.latency = {}         # (method, route) -> Histogram
+        self.db_queries = {}      # (method, route) -> count
+        self.db_seconds = {}      # (method, route) -> seconds
+        self.query_latency = Histogram()
+        self.sessions_open = 0
+        self.gauges = {}          # name -> (help, callable returning {labels: value})
+
+    def add_gauge(self, name, help, collect):
+        self.gauges[name] = (help, collect)
+
+    # Recording
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def request_finished(self, method, route, status, elapsed, stats):
+        key = (method, route)
+        with self._lock:
+            self.in_flight -= 1
+            self.requests[key + (status,)] = self.requests.get(key + (status,), 0) + 1
+            histogram = self.latency.get(key)
+            if histogram is None:
+                histogram = self.latency[key] = Histogram()
+            histogram.observe(elapsed)
+            self.db_queries[key] = self.db_queries.get(key, 0) + stats.queries
+            self.db_seconds[key] = self.db_seconds.get(key, 0.0) + stats.db_time
+
+    def query_finished(self, elapsed):
+        with self._lock:
+            self.query_latency.observe(elapsed)
+
+    def session_opened(self):
+        with self._lock:
+            self.sessions_open += 1
+
+    def session_closed(self):
+        with self._lock:
+            self.sessions_open -= 1
+
+    # Exposition
+
+    def render(self):
+        lines = []
+        with self._lock:
+            lines += _header("http_requests_in_flight", "gauge", "Requests currently being served")
+            lines.append(f"http_requests_in_flight {self.in_flight}")
+
+            lines += _header("http_requests_total", "counter", "Requests by route and status")
+            for (method, route, status), count in sorted(self.requests.items()):
+                lines.append(f'http_requests_total{{method="{method}",route="{route}",status="{status}"}} {count}')
+
+            lines += _header("http_request_duration_seconds", "histogram", "Request latency by route")
+            for (method, route), histogram in sorted(self.latency.items()):
+                lines += _histogram("http_request_duration_seconds", f'method="{method}",route="{route}"', histogram)
+
+            lines += _header("db_queries_total", "counter", "SQL statements executed, by the route that ran them")
+            for (method, route), count in sorted(self.db_queries.items()):
+                lines.append(f'db_queries_total{{method="{method}",route="{route}"}} {count}')
+
+            lines += _header("db_query_seconds_total", "counter", "Time spent in SQL, by the route that ran it")
+            for (method, route), seconds in sorted(self.db_seconds.items()):
+                lines.append(f'db_query_seconds_total{{method="{method}",route="{route}"}} {seconds:.6f}')
+
+            lines += _header("db_query_duration_seconds", "histogram", "Latency of individual SQL statements")
+            lines += _histogram("db_query_duration_seconds", "", self.query_latency)
+
+            lines += _header("db_sessions_open", "gauge", "ORM sessions with an open transaction")
+            lines.append(f"db_sessions_open {self.sessions_open}")
+
+        for name, (help, collect) in self.gauges.items():
+            lines += _header(name, "gauge", help)
+            for labels, value in collect().items():
+                label_text = ",".join(f'{k}="{v}"' for k, v in labels)
+                lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _header(name, kind, help):
+    return [f"# HELP {name} {help}", f"# TYPE {name} {kind}"]
+
+
+def _histogram(name, labels, histogram):
+    prefix = labels + "," if labels else ""
+    lines = []
+    cumulative = 0
+    for bound, count in zip(LATENCY_BUCKETS, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{prefix}le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{prefix}le="+Inf"}} {histogram.count}')
+    suffix = f"{{{labels}}}" if labels else ""
+    lines.append(f"{name}_sum{suffix} {histogram.total:.6f}")
+    lines.append(f"{name}_count{suffix} {histogram.count}")
+    return lines
+
+
+registry = Registry()
+
+
+class MetricsMiddleware:
+    # Raw ASGI middleware: no request/response wrapping, just two clock reads
+    # and a few dict updates per request.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        status = 500
+        stats = RequestStats(SLOW_REQUEST_MS > 0)
+        token = current.set(stats)
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        registry.request_started()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            current.reset(token)
+            registry.request_finished(scope["method"], route_template(scope), status, elapsed, stats)
+            if SLOW_REQUEST_MS and elapsed * 1000 >= SLOW_REQUEST_MS:
+                log_slow_request(scope["method"], scope["path"], status, elapsed, stats)
+
+
+def route_template(scope):
+    # Label by template so /trades/12/close and /trades/13/close share one
+    # series: put the matched path parameters back in place of their values.
+    if "route" not in scope:
+        return "unmatched"
+    params = {str(value): name for name, value in scope.get("path_params", {}).items()}
+    if not params:
+        return scope["path"]
+    return "/".join(f"{{{params[part]}}}" if part in params else part for part in scope["path"].split("/"))
+
+
+def log_slow_request(method, path, status, elapsed, stats):
+    log.warning("Slow request", extra={"fields": {
+        "method": method, "path": path, "status": status, "ms": round(elapsed * 1000, 1),
+        "queries": stats.queries, "db_ms": round(stats.db_time * 1000, 1),
+        "statements": [{"ms": round(seconds * 1000, 2), "sql": statement} for statement, seconds in stats.statements],
+    }})
+
+
+# SQLAlchemy hooks
+
+# The start time lives on the statement's execution context, which is
+# discarded with it: a statement that raises (no after_cursor_execute)
+# leaves nothing behind on the pooled connection.
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    context._metrics_start = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - context._metrics_start
+    registry.query_finished(elapsed)
+    stats = current.get()
+    if stats is None:
+        return
+    stats.queries += 1
+    stats.db_time += elapsed
+    if stats.statements is not None and len(stats.statements) < SLOW_REQUEST_MAX_STATEMENTS:
+        stats.statements.append((" ".join(statement.split()), elapsed))
+
+
+def _after_begin(session, transaction, connection):
+    if not session.info.get("metrics_open"):
+        session.info["metrics_open"] = True
+        registry.session_opened()
+
+
+def _after_transaction_end(session, transaction):
+    if transaction.parent is None and session.info.pop("metrics_open", False):
+        registry.session_closed()
+
+
+def _pool_gauge(engines):
+    def collect():
+        values = {}
+        for name, engine in engines.items():
+            pool = engine.pool
+            # Not every pool class (e.g. StaticPool, NullPool) keeps these counters
+            for state, reader in (("checked_out", "checkedout"), ("idle", "checkedin"), ("overflow", "overflow")):
+                if hasattr(pool, reader):
+                    values[(("engine", name), ("state", state))] = getattr(pool, reader)()
+        return values
+    return collect
+
+
+def instrument(engines):
+    # engines: {"label": sync Engine}; for an AsyncEngine pass .sync_engine
+    for engine in engines.values():
+        event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Session, "after_begin", _after_begin)
+    event.listen(Session, "after_transaction_end", _after_transaction_end)
+    registry.add_gauge("db_pool_connections", "Pooled database connections by state", _pool_gauge(engines))
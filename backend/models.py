@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime
+from sqlalchemy import Column, Integer, String, Float, Boolean, ForeignKey, DateTime, Index, text
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from database import Base
@@ -22,9 +22,18 @@ class User(Base):
 
     trades = relationship("Trade", back_populates="user")
 
-class Trade(Base):
-    __tablename__ = "trades"
+# Delta sync cursor: one past the highest change_seq in either trades table.
+# It is evaluated inside the writing statement, i.e. while holding SQLite's
+# single write lock, so every commit gets a higher value than anything a
+# reader could already have seen (unlike a timestamp taken before the lock).
+NEXT_CHANGE_SEQ = text(
+    "(SELECT coalesce(max(seq), 0) + 1 FROM ("
+    "SELECT max(change_seq) AS seq FROM trades "
+    "UNION ALL SELECT max(change_seq) FROM trades_archive) AS seqs)"
+)
 
+class TradeColumns:
+    # Shared by the live trades table and its archive
     id = Column(Integer, primary_key=True, index=True)
     user_id = Column(Integer, ForeignKey("users.id"))
     symbol = Column(String, index=True)
@@ -41,9 +50,67 @@ class Trade(Base):
     forced_outcome = Column(String, default="NONE")  # 'NONE', 'WIN', 'LOSS'
     open_time = Column(DateTime, default=datetime.utcnow)
     close_time = Column(DateTime, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    change_seq = Column(Integer, default=NEXT_CHANGE_SEQ, onupdate=NEXT_CHANGE_SEQ)  # delta sync cursor
+
+class Trade(TradeColumns, Base):
+    # Open positions and recent history only; closed trades older than the
+    # archive age move to trades_archive (see archive.py)
+    __tablename__ = "trades"
 
     user = relationship("User", back_populates="trades")
 
+    # Hot paths: a user's trades by status/time, the admin list by time,
+    # open-position scans by status, delta sync by change_seq, and the
+    # archive job's scan of closed trades by close time.
+    __table_args__ = (
+        Index("ix_trades_user_status_open", "user_id", "status", "open_time"),
+        Index("ix_trades_user_open", "user_id", "open_time"),
+        Index("ix_trades_status_open", "status", "open_time"),
+        Index("ix_trades_open_time", "open_time"),
+        Index("ix_trades_user_change", "user_id", "change_seq"),
+        Index("ix_trades_change_seq", "change_seq"),
+        Index("ix_trades_status_close", "status", "close_time"),
+    )
+
+class TradeArchive(TradeColumns, Base):
+    # Closed trades moved out of the live table; rows keep their trade ids
+    __tablename__ = "trades_archive"
+
+    id = Column(Integer, primary_key=True, autoincrement=False)
+
+    __table_args__ = (
+        Index("ix_trades_archive_user_open", "user_id", "open_time"),
+        Index("ix_trades_archive_open_time", "open_time"),
+        Index("ix_trades_archive_user_change", "user_id", "change_seq"),
+        Index("ix_trades_archive_change_seq", "change_seq"),
+    )
+
+class PendingOrder(Base):
+    # Limit/stop entry orders resting until the market reaches their price
+    # (see orders.py); a fill opens a Trade and records its id here
+    __tablename__ = "pending_orders"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    symbol = Column(String, nullable=False)
+    type = Column(String, nullable=False)  # 'buy_limit', 'buy_stop', 'sell_limit', 'sell_stop'
+    volume = Column(Float, nullable=False)
+    price = Column(Float, nullable=False)  # trigger level
+    sl = Column(Float, nullable=True)
+    tp = Column(Float, nullable=True)
+    status = Column(String, default="PENDING")  # 'PENDING', 'FILLED', 'CANCELLED', 'EXPIRED'
+    expires_at = Column(DateTime, nullable=True)
+    trade_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+    # A user's orders by status/time, and the resting book loaded at startup
+    __table_args__ = (
+        Index("ix_orders_user_status_created", "user_id", "status", "created_at"),
+        Index("ix_orders_status", "status"),
+    )
+
 class AppSettings(Base):
     __tablename__ = "app_settings"
 
@@ -52,3 +119,35 @@ class AppSettings(Base):
     logo_url = Column(String, nullable=True)
     theme_primary = Column(String, default="#007bff")
     theme_secondary = Column(String, default="#1a1a1a")
+
+class LedgerEntry(Base):
+    # Append-only: one row per balance/equity delta, written in the same
+    # transaction as the change itself. Never updated or deleted.
+    __tablename__ = "ledger_entries"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    kind = Column(String, nullable=False)  # 'opening', 'deposit', 'trade_close', 'settlement', 'adjustment'
+    amount = Column(Float, default=0.0)  # balance delta
+    equity_delta = Column(Float, default=0.0)
+    trade_id = Column(Integer, nullable=True)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        Index("ix_ledger_user_id", "user_id", "id"),
+        Index("ix_ledger_user_created", "user_id", "created_at"),
+    )
+
+class BalanceSnapshot(Base):
+    # Balance including every ledger entry of the user with id <= ledger_id
+    __tablename__ = "balance_snapshots"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    ledger_id = Column(Integer, nullable=False)
+    balance = Column(Float, nullable=False)
+    taken_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_snapshots_user_taken", "user_id", "taken_at"),
+    )
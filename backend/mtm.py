@@ -0,0 +1,266 @@
+import asyncio
+import os
+
+import numpy as np
+from sqlalchemy import bindparam, select, update
+
+import models, quotes, logs
+from database import async_engine
+
+log = logs.get_logger("mtm")
+
+LEVERAGE = float(os.getenv("ACCOUNT_LEVERAGE", "100"))
+# How often live equity/margin are written back to the users table
+MTM_FLUSH_INTERVAL = float(os.getenv("MTM_FLUSH_INTERVAL", "5.0"))
+# Changes smaller than this (account currency) are not worth a write
+FLUSH_EPSILON = 0.005
+# ... or a push to connected clients
+PUSH_EPSILON = 0.005
+
+
+class MarkToMarketEngine:
+    # OPEN positions are held column-wise (one NumPy array per field) and
+    # accounts in a parallel table, so a price update revalues every position
+    # and re-aggregates every account with a few vector operations.
+
+    POSITION_COLUMNS = {
+        "trade_id": np.int64, "acct": np.int64, "sym": np.int64,
+        "side": np.float64, "volume": np.float64, "entry": np.float64,
+        "contract": np.float64, "pnl": np.float64,
+    }
+    ACCOUNT_COLUMNS = {
+        "user_id": np.int64, "balance": np.float64, "floating": np.float64,
+        "equity": np.float64, "margin": np.float64, "margin_level": np.float64,
+        "flushed_equity": np.float64, "flushed_margin": np.float64,
+        "pushed_equity": np.float64, "pushed_margin": np.float64,
+    }
+
+    def __init__(self, quote_engine, leverage=LEVERAGE, capacity=1024):
+        self.quotes = quote_engine
+        self.leverage = leverage
+
+        self.n_positions = 0
+        self.position_rows = {}
+        self.positions = {name: np.zeros(capacity, dtype) for name, dtype in self.POSITION_COLUMNS.items()}
+
+        self.n_accounts = 0
+        self.account_rows = {}
+        self.accounts = {name: np.zeros(capacity, dtype) for name, dtype in self.ACCOUNT_COLUMNS.items()}
+        self.listeners = []
+
+    # Loading and bookkeeping
+
+    async def load(self, db):
+        # Replaces the whole table (startup and events.reload): both reads
+        # happen before anything is touched, then it is rebuilt in one step
+        users = (await db.execute(select(models.User.id, models.User.balance, models.User.equity, models.User.margin))).all()
+        trades = (await db.scalars(select(models.Trade).where(models.Trade.status == "OPEN"))).all()
+        self.n_positions = 0
+        self.position_rows = {}
+        self.n_accounts = 0
+        self.account_rows = {}
+        for user_id, balance, equity, margin in users:
+            row = self._account_row(user_id, balance)
+            self.accounts["flushed_equity"][row] = equity or 0.0
+            self.accounts["flushed_margin"][row] = margin or 0.0
+        for trade in trades:
+            self._insert_position(trade)
+        self.recompute()
+
+    def set_balance(self, user_id, balance):
+        row = self._account_row(user_id, balance)
+        self.accounts["balance"][row] = balance
+        self._revalue_account(row)
+
+    def open_position(self, trade, balance=None):
+        acct = self._insert_position(trade, balance)
+        if acct is not None:
+            self._revalue_account(acct)
+
+    def _insert_position(self, trade, balance=None):
+        # -> the account row, or None if the position wasn't added
+        sym = self.quotes.row(trade.symbol)
+        if sym is None or trade.id in self.position_rows:
+            return None  # symbols without a feed can't be marked
+        acct = self._account_row(trade.user_id, balance)
+        n = self._append(self.positions, self.n_positions)
+        self.n_positions += 1
+        p = self.positions
+        p["trade_id"][n] = trade.id
+        p["acct"][n] = acct
+        p["sym"][n] = sym
+        p["side"][n] = 1.0 if trade.type == "buy" else -1.0
+        p["volume"][n] = trade.volume
+        p["entry"][n] = trade.entry_price
+        p["contract"][n] = self.quotes.contract_size[sym]
+        p["pnl"][n] = 0.0
+        self.position_rows[trade.id] = n
+        return acct
+
+    def close_position(self, trade_id):
+        row = self.position_rows.pop(trade_id, None)
+        if row is None:
+            return
+        acct = int(self.positions["acct"][row])
+        last = self.n_positions - 1
+        if row != last:
+            # Keep the columns dense: move the last position into the hole
+            for column in self.positions.values():
+                column[row] = column[last]
+            self.position_rows[int(self.positions["trade_id"][row])] = row
+        self.n_positions = last
+        self._revalue_account(acct)
+
+    def _account_row(self, user_id, balance=None):
+        row = self.account_rows.get(user_id)
+        if row is None:
+            row = self._append(self.accounts, self.n_accounts)
+            self.n_accounts += 1
+            for column in self.accounts.values():
+                column[row] = 0
+            self.accounts["user_id"][row] = user_id
+            self.accounts["balance"][row] = balance or 0.0
+            self.accounts["equity"][row] = balance or 0.0
+            self.account_rows[user_id] = row
+        return row
+
+    @staticmethod
+    def _append(table, used):
+        capacity = len(next(iter(table.values())))
+        if used == capacity:
+            for name, column in table.items():
+                grown = np.zeros(capacity * 2, column.dtype)
+                grown[:capacity] = column
+                table[name] = grown
+        return used
+
+    # Valuation
+
+    def recompute(self):
+        n, m = self.n_positions, self.n_accounts
+        p, a = self.positions, self.accounts
+        if n:
+            sym = p["sym"][:n]
+            side = p["side"][:n]
+            # Longs are marked at the bid, shorts at the ask
+            price = np.where(side > 0, self.quotes.bid[sym], self.quotes.ask[sym])
+            notional = p["volume"][:n] * p["contract"][:n]
+            np.multiply((price - p["entry"][:n]) * side, notional, out=p["pnl"][:n])
+            acct = p["acct"][:n]
+            a["floating"][:m] = np.bincount(acct, weights=p["pnl"][:n], minlength=m)
+            a["margin"][:m] = np.bincount(acct, weights=notional * price / self.leverage, minlength=m)
+        else:
+            a["floating"][:m] = 0.0
+            a["margin"][:m] = 0.0
+        np.add(a["balance"][:m], a["floating"][:m], out=a["equity"][:m])
+        self._margin_level(slice(0, m))
+
+    def _revalue_account(self, row):
+        # Re-aggregate one account after a position or balance change
+        n = self.n_positions
+        p, a = self.positions, self.accounts
+        mine = np.nonzero(p["acct"][:n] == row)[0]
+        if len(mine):
+            sym = p["sym"][mine]
+            side = p["side"][mine]
+            price = np.where(side > 0, self.quotes.bid[sym], self.quotes.ask[sym])
+            notional = p["volume"][mine] * p["contract"][mine]
+            p["pnl"][mine] = (price - p["entry"][mine]) * side * notional
+            a["floating"][row] = p["pnl"][mine].sum()
+            a["margin"][row] = (notional * price).sum() / self.leverage
+        else:
+            a["floating"][row] = 0.0
+            a["margin"][row] = 0.0
+        a["equity"][row] = a["balance"][row] + a["floating"][row]
+        self._margin_level(slice(row, row + 1))
+
+    def _margin_level(self, rows):
+        a = self.accounts
+        level = a["margin_level"][rows]
+        level[:] = 0.0
+        np.divide(a["equity"][rows], a["margin"][rows], out=level, where=a["margin"][rows] > 0)
+        level *= 100.0
+
+    def add_listener(self, listener):
+        # listener(user_ids, engine) after every tick, with the ids of the
+        # accounts whose equity or margin moved since the last call
+        self.listeners.append(listener)
+
+    def on_tick(self, quote_engine):
+        self.recompute()
+        if not self.listeners:
+            return
+        m = self.n_accounts
+        a = self.accounts
+        changed = np.nonzero(
+            (np.abs(a["equity"][:m] - a["pushed_equity"][:m]) > PUSH_EPSILON)
+            | (np.abs(a["margin"][:m] - a["pushed_margin"][:m]) > PUSH_EPSILON)
+        )[0]
+        if not len(changed):
+            return
+        a["pushed_equity"][changed] = a["equity"][changed]
+        a["pushed_margin"][changed] = a["margin"][changed]
+        user_ids = a["user_id"][changed]
+        for listener in self.listeners:
+            listener(user_ids, self)
+
+    # Reads
+
+    def account(self, user_id):
+        row = self.account_rows.get(user_id)
+        if row is None:
+            return None
+        a = self.accounts
+        equity = float(a["equity"][row])
+        margin = float(a["margin"][row])
+        return {
+            "user_id": user_id,
+            "balance": round(float(a["balance"][row]), 2),
+            "floating": round(float(a["floating"][row]), 2),
+            "equity": round(equity, 2),
+            "margin": round(margin, 2),
+            "free_margin": round(equity - margin, 2),
+            "margin_level": round(float(a["margin_level"][row]), 2),
+        }
+
+    def position_profit(self, trade_id):
+        row = self.position_rows.get(trade_id)
+        if row is None:
+            return None
+        return float(self.positions["pnl"][row])
+
+    # Write-back
+
+    async def flush(self):
+        m = self.n_accounts
+        a = self.accounts
+        changed = np.nonzero(
+            (np.abs(a["equity"][:m] - a["flushed_equity"][:m]) > FLUSH_EPSILON)
+            | (np.abs(a["margin"][:m] - a["flushed_margin"][:m]) > FLUSH_EPSILON)
+        )[0]
+        if not len(changed):
+            return 0
+        equity = a["equity"][changed].copy()
+        margin = a["margin"][changed].copy()
+        params = [
+            {"b_id": int(uid), "b_equity": float(eq), "b_margin": float(mg)}
+            for uid, eq, mg in zip(a["user_id"][changed], equity, margin)
+        ]
+        users = models.User.__table__
+        stmt = update(users).where(users.c.id == bindparam("b_id")).values(equity=bindparam("b_equity"), margin=bindparam("b_margin"))
+        async with async_engine.begin() as conn:
+            await conn.execute(stmt, params)
+        a["flushed_equity"][changed] = equity
+        a["flushed_margin"][changed] = margin
+        return len(params)
+
+    async def run_flusher(self, interval=MTM_FLUSH_INTERVAL):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                await self.flush()
+            except Exception:
+                log.exception("Equity flush failed")
+
+
+engine = MarkToMarketEngine(quotes.engine)
@@ -0,0 +1,175 @@
+import heapq
+from datetime import datetime
+
+from sqlalchemy import insert, select, update
+
+import models, quotes, events, logs
+from database import AsyncSessionLocal
+from triggers import LevelBook, COMPACT_MIN, BUY_BELOW, BUY_ABOVE, SELL_BELOW, SELL_ABOVE
+
+log = logs.get_logger("orders")
+
+# The same four book shapes as the SL/TP engine, keyed by the quote side an
+# order is matched against. Buys fill at the ask and sells at the bid:
+#   buy limit  fills when ask <= price (ASK_BELOW)   buy stop  when ask >= price (ASK_ABOVE)
+#   sell limit fills when bid >= price (BID_ABOVE)   sell stop when bid <= price (BID_BELOW)
+ASK_BELOW, ASK_ABOVE, BID_BELOW, BID_ABOVE = BUY_BELOW, BUY_ABOVE, SELL_BELOW, SELL_ABOVE
+
+# order type -> (trade side, book side)
+ORDER_TYPES = {
+    "buy_limit": ("buy", ASK_BELOW),
+    "buy_stop": ("buy", ASK_ABOVE),
+    "sell_limit": ("sell", BID_ABOVE),
+    "sell_stop": ("sell", BID_BELOW),
+}
+
+# Rows per UPDATE, keeping each statement well under SQLite's variable limit
+FILL_CHUNK = 500
+
+
+def valid_price(order_type, price, market):
+    # A new order must rest: limits below (buy) / above (sell) the market,
+    # stops the other way round. Anything else would fill on the next tick.
+    if order_type in ("buy_limit", "sell_stop"):
+        return price < market
+    return price > market
+
+
+class OrderEngine:
+    # Resting pending orders in per-symbol price-ordered books. Each tick
+    # finds the crossed symbols with one array comparison per book side and
+    # pops only the orders that fill, so the cost follows fills per tick,
+    # not the number of resting orders. Expiries sit in a heap by time.
+
+    def __init__(self, quote_engine):
+        self.quotes = quote_engine
+        self.book = LevelBook(len(quote_engine.symbols))
+        self.live = {}        # order_id -> (sym, book side, price, expires_at)
+        self.expiries = []    # heap of (expires_at, order_id)
+        # Only the leader worker executes; followers just keep the book current
+        self.active = True
+
+    async def load(self, db):
+        pending = (await db.scalars(select(models.PendingOrder).where(models.PendingOrder.status == "PENDING"))).all()
+        # Rebuilt from scratch, after the read (startup and events.reload)
+        self.book = LevelBook(len(self.quotes.symbols))
+        self.live = {}
+        self.expiries = []
+        for order in pending:
+            self.add(order.id, order.symbol, order.type, order.price, order.expires_at)
+
+    def add(self, order_id, symbol, order_type, price, expires_at=None):
+        sym = self.quotes.row(symbol)
+        if sym is None or order_type not in ORDER_TYPES or order_id in self.live:
+            return
+        side = ORDER_TYPES[order_type][1]
+        self.live[order_id] = (sym, side, price, expires_at)
+        self.book.push(side, sym, price, order_id)
+        if expires_at is not None:
+            heapq.heappush(self.expiries, (expires_at, order_id))
+
+    def remove(self, order_id):
+        # Book and expiry entries are left in place and dropped when they
+        # surface (on the leader) or by the next compaction
+        if self.live.pop(order_id, None) is None:
+            return
+        limit = max(2 * len(self.live), COMPACT_MIN)
+        if self.book.size > limit:
+            self.book.compact(self._is_live)
+        if len(self.expiries) > limit:
+            self.expiries = [(at, i) for at, i in self.expiries if i in self.live and self.live[i][3] == at]
+            heapq.heapify(self.expiries)
+
+    def _is_live(self, order_id, level):
+        entry = self.live.get(order_id)
+        return entry is not None and entry[2] == level
+
+    def collect(self):
+        # Order ids whose price has been reached by the current quotes
+        fired = set()
+        for side, prices in ((ASK_BELOW, self.quotes.ask), (ASK_ABOVE, self.quotes.ask),
+                             (BID_BELOW, self.quotes.bid), (BID_ABOVE, self.quotes.bid)):
+            for sym in self.book.crossed_symbols(side, prices):
+                fired.update(self.book.pop_crossed(side, sym, prices[sym], self._is_live))
+        return fired
+
+    def collect_expired(self, now):
+        expired = set()
+        while self.expiries and self.expiries[0][0] <= now:
+            expires_at, order_id = heapq.heappop(self.expiries)
+            entry = self.live.get(order_id)
+            if entry is not None and entry[3] == expires_at:
+                expired.add(order_id)
+        return expired
+
+    async def on_tick(self, quote_engine):
+        # Expiry is checked on ticks, so an order expires within one tick
+        # interval (QUOTE_TICK_INTERVAL, 1s by default) of its expires_at
+        if not self.active:
+            return
+        fills = self.collect()
+        expirations = self.collect_expired(datetime.utcnow()) - fills
+        if not fills and not expirations:
+            return
+        removed = {order_id: self.live.pop(order_id) for order_id in fills | expirations if order_id in self.live}
+        try:
+            await self.execute([i for i in fills if i in removed], [i for i in expirations if i in removed])
+        except Exception:
+            # Put them back so the next tick retries. Not re-raised: the
+            # listeners after this one must still see the tick.
+            log.exception("Pending order execution failed", extra={"fields": {"orders": len(removed)}})
+            for order_id, (sym, side, price, expires_at) in removed.items():
+                self.live[order_id] = (sym, side, price, expires_at)
+                self.book.push(side, sym, price, order_id)
+                if expires_at is not None:
+                    heapq.heappush(self.expiries, (expires_at, order_id))
+
+    async def execute(self, fills, expirations):
+        # Fills and expiries of one tick in one transaction. Orders are moved
+        # out of PENDING with conditional UPDATEs, so an order cancelled
+        # concurrently is neither filled nor expired; the filled ones become
+        # OPEN trades in one multi-row INSERT.
+        now = datetime.utcnow()
+        async with AsyncSessionLocal() as db:
+            filled = await _finish(db, fills, "FILLED")
+            expired = await _finish(db, expirations, "EXPIRED")
+            trades = []
+            if filled:
+                rows = []
+                for order in filled:
+                    side = ORDER_TYPES[order.type][0]
+                    rows.append({
+                        "user_id": order.user_id, "symbol": order.symbol, "type": side, "volume": order.volume,
+                        "entry_price": self.quotes.entry_price(order.symbol, side),
+                        "sl": order.sl, "tp": order.tp, "status": "OPEN", "open_time": now, "updated_at": now,
+                    })
+                trades = (await db.scalars(insert(models.Trade).returning(models.Trade, sort_by_parameter_order=True), rows)).all()
+                for order, trade in zip(filled, trades):
+                    order.trade_id = trade.id
+                user_ids = {order.user_id for order in filled}
+                users = {user.id: user for user in (await db.scalars(select(models.User).where(models.User.id.in_(user_ids)))).all()}
+            await db.commit()
+        with events.batched():
+            for order in filled + expired:
+                events.order_changed(order)
+            for trade in trades:
+                events.trade_opened(trade, users[trade.user_id])
+        return trades
+
+
+async def _finish(db, order_ids, status):
+    finished = []
+    for start in range(0, len(order_ids), FILL_CHUNK):
+        chunk = order_ids[start:start + FILL_CHUNK]
+        stmt = (
+            update(models.PendingOrder)
+            .where(models.PendingOrder.id.in_(chunk), models.PendingOrder.status == "PENDING")
+            .values(status=status)
+            .returning(models.PendingOrder)
+            .execution_options(populate_existing=True)
+        )
+        finished.extend((await db.scalars(stmt)).all())
+    return finished
+
+
+engine = OrderEngine(quotes.engine)
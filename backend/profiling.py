@@ -0,0 +1,249 @@
+import asyncio
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+import orjson
+
+import logs, metrics
+from bus import bus, BUS_DIR
+
+log = logs.get_logger("profiling")
+
+# On-demand request profiling. A profiled request gets a sampler thread that
+# reads the event-loop thread's stack every PROFILE_INTERVAL_MS and counts
+# identical stacks; when the request ends they are saved as collapsed-stack
+# text ("frame;frame;frame count" per line), which flamegraph.pl, speedscope
+# and inferno all read. A request is profiled when it carries
+# "X-Profile: <PROFILE_TOKEN>", or when an admin has turned on sampling of a
+# fraction of requests. Nothing runs for requests that aren't profiled.
+#
+# The loop thread serves every request of the worker, so samples taken
+# while other requests were in flight include their work too ("concurrent"
+# in a profile's metadata says how many there were at the start).
+
+# Shared by the workers of one machine, so any of them serves a download
+PROFILE_DIR = os.getenv("PROFILE_DIR") or os.path.join(BUS_DIR, "profiles")
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "5")) / 1000
+# Secret for the X-Profile header; the header is ignored while unset
+PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")
+# Profiles kept on disk, newest first
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "200"))
+# Requests profiled at once per worker; more are served unprofiled
+PROFILE_MAX_CONCURRENT = 2
+# Sampling stops after this long (streamed exports, stuck requests)
+PROFILE_MAX_SECONDS = 30.0
+
+PROFILE_ID = re.compile(r"^[0-9]{8}-[0-9]{6}-[0-9]+-[0-9]+$")
+
+
+def _where(filename):
+    # Short, stable file names: "routers/trade.py", "sqlalchemy/orm/session.py"
+    marker = "site-packages" + os.sep
+    if marker in filename:
+        return filename.split(marker, 1)[1]
+    here = os.path.dirname(os.path.abspath(__file__)) + os.sep
+    if filename.startswith(here):
+        return filename[len(here):]
+    return os.path.basename(filename)
+
+
+class Sampler(threading.Thread):
+    def __init__(self, thread_id, interval=PROFILE_INTERVAL, max_seconds=PROFILE_MAX_SECONDS):
+        super().__init__(name="profile-sampler", daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.max_seconds = max_seconds
+        self.stacks = Counter()
+        self.samples = 0
+        self.truncated = False
+        self.done = threading.Event()
+        self._labels = {}
+
+    def run(self):
+        deadline = time.monotonic() + self.max_seconds
+        while not self.done.wait(self.interval):
+            if time.monotonic() > deadline:
+                self.truncated = True
+                return
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                stack.append(self._label(frame.f_code))
+                frame = frame.f_back
+            stack.reverse()
+            self.stacks[";".join(stack)] += 1
+            self.samples += 1
+
+    def _label(self, code):
+        label = self._labels.get(code)
+        if label is None:
+            label = self._labels[code] = f"{code.co_name} ({_where(code.co_filename)}:{code.co_firstlineno})"
+        return label
+
+    async def stop(self):
+        # The sampler may be mid-sample; wait for it off the loop thread
+        self.done.set()
+        await asyncio.to_thread(self.join)
+
+    def collapsed(self):
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class Profiler:
+    def __init__(self, directory=PROFILE_DIR, token=PROFILE_TOKEN):
+        self.directory = directory
+        self.token = token.encode()
+        # Admin-set sampling; limit counts down per profile taken, in each worker
+        self.sample_rate = 0.0
+        self.path_prefix = None
+        self.limit = 0
+        self.running = 0
+        self.taken = 0
+        self.busy = 0
+        self._seq = 0
+
+    def settings(self):
+        return {"sample_rate": self.sample_rate, "path_prefix": self.path_prefix, "limit": self.limit}
+
+    def configure(self, settings):
+        self.sample_rate = settings["sample_rate"]
+        self.path_prefix = settings["path_prefix"]
+        self.limit = settings["limit"]
+
+    def wants(self, scope):
+        if self.token:
+            for name, value in scope["headers"]:
+                if name == b"x-profile":
+                    return value == self.token
+        if self.sample_rate > 0 and self.limit > 0:
+            if self.path_prefix and not scope["path"].startswith(self.path_prefix):
+                return False
+            if random.random() < self.sample_rate:
+                self.limit -= 1
+                return True
+        return False
+
+    def start(self):
+        # -> (profile id, running Sampler), or None when at the concurrency cap
+        if self.running >= PROFILE_MAX_CONCURRENT:
+            self.busy += 1
+            return None
+        self.running += 1
+        self._seq += 1
+        sampler = Sampler(threading.get_ident())
+        sampler.start()
+        return f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{self._seq}", sampler
+
+    async def finish(self, sampler):
+        await sampler.stop()
+        self.running -= 1
+        self.taken += 1
+
+    def save(self, profile_id, sampler, meta):
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, profile_id)
+        with open(base + ".collapsed", "w") as f:
+            f.write(sampler.collapsed())
+        meta = dict(meta, id=profile_id, samples=sampler.samples, truncated=sampler.truncated,
+                    interval_ms=sampler.interval * 1000, pid=os.getpid())
+        with open(base + ".json", "wb") as f:
+            f.write(orjson.dumps(meta))
+        self._prune()
+
+    def _prune(self):
+        paths = sorted(
+            (os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".json")),
+            key=os.path.getmtime,
+        )
+        for path in paths[:max(len(paths) - PROFILE_KEEP, 0)]:
+            for stale in (path, path[:-len(".json")] + ".collapsed"):
+                try:
+                    os.unlink(stale)
+                except FileNotFoundError:
+                    pass
+
+    def list(self):
+        if not os.path.isdir(self.directory):
+            return []
+        profiles = []
+        for name in os.listdir(self.directory):
+            if name.endswith(".json"):
+                try:
+                    with open(os.path.join(self.directory, name), "rb") as f:
+                        profiles.append(orjson.loads(f.read()))
+                except (OSError, orjson.JSONDecodeError):
+                    continue  # pruned or half-written
+        profiles.sort(key=lambda meta: meta["at"], reverse=True)
+        return profiles
+
+    def read(self, profile_id):
+        # Collapsed stacks of a saved profile, or None
+        if not PROFILE_ID.match(profile_id):
+            return None
+        try:
+            with open(os.path.join(self.directory, profile_id + ".collapsed")) as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def stats(self):
+        return {"running": self.running, "taken": self.taken, "busy": self.busy, "sample_rate": self.sample_rate, "limit": self.limit}
+
+
+profiler = Profiler()
+
+
+def configure(settings):
+    # Admin toggle: applied here and, through the bus, in the other workers
+    profiler.configure(settings)
+    bus.publish("profiling", settings)
+    log.info("Profiling settings changed", extra={"fields": settings})
+
+
+bus.on("profiling", profiler.configure)
+
+
+class ProfilingMiddleware:
+    # Raw ASGI like MetricsMiddleware: requests that aren't profiled cost
+    # one header scan (only with PROFILE_TOKEN set) and a float compare.
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not profiler.wants(scope):
+            return await self.app(scope, receive, send)
+        started = profiler.start()
+        if started is None:
+            return await self.app(scope, receive, send)
+        profile_id, sampler = started
+
+        status = 500
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [(b"x-profile-id", profile_id.encode())]
+            await send(message)
+
+        meta = {"at": time.time(), "method": scope["method"], "path": scope["path"], "concurrent": metrics.registry.in_flight - 1}
+        began = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            meta["ms"] = round((time.perf_counter() - began) * 1000, 2)
+            await profiler.finish(sampler)
+            meta["status"] = status
+            meta["route"] = metrics.route_template(scope)
+            try:
+                await asyncio.to_thread(profiler.save, profile_id, sampler, meta)
+            except OSError:
+                log.exception("Saving profile failed", extra={"fields": {"id": profile_id}})
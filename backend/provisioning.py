@@ -0,0 +1,231 @@
+import asyncio
+import csv
+import io
+import multiprocessing
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import orjson
+from pydantic import ValidationError
+from sqlalchemy import insert, select
+from sqlalchemy.exc import IntegrityError
+
+import models, schemas, auth_utils, ledger, events
+from cluster import exclusive, LockHeld
+
+# Bulk account import: rows are validated up front, passwords hashed across
+# a process pool, logins allocated collision-free before any insert, and
+# accounts written with one executemany INSERT (plus their ledger deposits)
+# per batch, each batch its own short transaction. One import runs at a
+# time per machine, so its pool can't multiply across requests and workers.
+
+# Processes hashing passwords during an import (PBKDF2 is CPU-bound); half
+# the cores by default, leaving the rest to logins and the price feed
+PROVISION_HASH_WORKERS = int(os.getenv("PROVISION_HASH_WORKERS", str(max(1, (os.cpu_count() or 2) // 2))))
+# Passwords per task sent to a hashing process
+HASH_CHUNK = 64
+# Accounts per INSERT transaction
+PROVISION_BATCH = int(os.getenv("PROVISION_BATCH", "1000"))
+# Largest import accepted in one request/run
+PROVISION_MAX_ROWS = int(os.getenv("PROVISION_MAX_ROWS", "100000"))
+# Candidate logins checked against the table per query
+LOGIN_LOOKUP_CHUNK = 500
+
+FORMATS = ("csv", "json")
+
+
+def parse(content, fmt):
+    # Raw CSV (header row) or JSON (list of objects) -> list of dicts
+    if fmt == "json":
+        rows = orjson.loads(content)
+        if not isinstance(rows, list):
+            raise ValueError("Expected a JSON list of users")
+        return rows
+    text = content.decode("utf-8-sig") if isinstance(content, bytes) else content
+    # Empty cells mean "use the default", not an empty value
+    return [{k: v for k, v in row.items() if v not in ("", None)} for row in csv.DictReader(io.StringIO(text))]
+
+
+def validate(rows):
+    # -> ([(row number, UserCreate)], [error]); duplicates within the file
+    # keep their first occurrence
+    valid = []
+    errors = []
+    seen = set()
+    for number, row in enumerate(rows, start=1):
+        try:
+            user = schemas.UserCreate.model_validate(row)
+        except ValidationError as exc:
+            first = exc.errors()[0]
+            field = ".".join(str(part) for part in first["loc"])
+            errors.append(_error(number, row.get("username") if isinstance(row, dict) else None, f"{field}: {first['msg']}"))
+            continue
+        if user.username in seen:
+            errors.append(_error(number, user.username, "Duplicate username in import"))
+            continue
+        seen.add(user.username)
+        valid.append((number, user))
+    return valid, errors
+
+
+def _error(row, username, message):
+    return {"row": row, "username": username, "error": message}
+
+
+async def hash_passwords(passwords, workers=PROVISION_HASH_WORKERS):
+    # Chunks of passwords fanned out over a process pool that lives for one
+    # import. Spawned, not forked: the server process has threads running.
+    if not passwords:
+        return []
+    loop = asyncio.get_running_loop()
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as pool:
+        chunks = [passwords[i:i + HASH_CHUNK] for i in range(0, len(passwords), HASH_CHUNK)]
+        hashed = await asyncio.gather(*(loop.run_in_executor(pool, auth_utils.get_password_hashes, chunk) for chunk in chunks))
+    return [h for chunk in hashed for h in chunk]
+
+
+async def allocate_logins(db, count):
+    # Random 9-digit account logins, unique among themselves and checked
+    # against the table (through its unique index) before use
+    logins = []
+    taken = set()
+    while len(logins) < count:
+        candidates = set()
+        while len(candidates) < min(count - len(logins), LOGIN_LOOKUP_CHUNK):
+            candidate = "".join(random.choices("0123456789", k=9))
+            if candidate not in taken:
+                candidates.add(candidate)
+        existing = set((await db.scalars(select(models.User.account_login).where(models.User.account_login.in_(candidates)))).all())
+        fresh = candidates - existing
+        logins.extend(fresh)
+        taken |= candidates
+    return logins
+
+
+async def existing_usernames(db, usernames):
+    found = set()
+    for start in range(0, len(usernames), LOGIN_LOOKUP_CHUNK):
+        chunk = usernames[start:start + LOGIN_LOOKUP_CHUNK]
+        found.update((await db.scalars(select(models.User.username).where(models.User.username.in_(chunk)))).all())
+    return found
+
+
+async def provision(session_factory, rows, batch=PROVISION_BATCH):
+    # Imports parsed rows; returns the report (see schemas.ProvisionReport).
+    # Raises cluster.LockHeld while another import is running.
+    if len(rows) > PROVISION_MAX_ROWS:
+        raise ValueError(f"At most {PROVISION_MAX_ROWS} users per import")
+    with exclusive("provision.lock"):
+        return await _provision(session_factory, rows, batch)
+
+
+async def _provision(session_factory, rows, batch):
+    started = time.perf_counter()
+    valid, errors = validate(rows)
+
+    async with session_factory() as db:
+        taken = await existing_usernames(db, [user.username for _, user in valid])
+    fresh = []
+    for number, user in valid:
+        if user.username in taken:
+            errors.append(_error(number, user.username, "Username already registered"))
+        else:
+            fresh.append((number, user))
+
+    hashed = await hash_passwords([user.password for _, user in fresh])
+    accounts = []
+    for start in range(0, len(fresh), batch):
+        part = fresh[start:start + batch]
+        async with session_factory() as db:
+            logins = await allocate_logins(db, len(part))
+            values = [
+                {
+                    "username": user.username, "hashed_password": password, "full_name": user.full_name,
+                    "broker": user.broker, "account_type": user.account_type, "account_login": login,
+                    "balance": user.balance, "equity": user.balance,
+                }
+                for (_, user), password, login in zip(part, hashed[start:start + batch], logins)
+            ]
+            created = await _insert_batch(db, part, values, errors)
+        with events.batched():
+            for number, user in created:
+                events.account_changed(user)
+                accounts.append({"row": number, "id": user.id, "username": user.username, "account_login": user.account_login})
+
+    errors.sort(key=lambda e: e["row"])
+    return {
+        "created": len(accounts),
+        "failed": len(errors),
+        "seconds": round(time.perf_counter() - started, 3),
+        "accounts": accounts,
+        "errors": errors,
+    }
+
+
+async def _insert_batch(db, part, values, errors):
+    # One executemany INSERT ... RETURNING plus the deposit ledger entries.
+    # If anything in the batch conflicts (a username or login taken since it
+    # was checked), the batch is retried row by row to pinpoint the rows.
+    try:
+        users = (await db.scalars(insert(models.User).returning(models.User, sort_by_parameter_order=True), values)).all()
+        await ledger.record_many(db, [
+            {"user_id": user.id, "kind": "deposit", "amount": user.balance, "equity_delta": user.balance}
+            for user in users
+        ])
+        await db.commit()
+        return [(number, user) for (number, _), user in zip(part, users)]
+    except IntegrityError:
+        await db.rollback()
+
+    created = []
+    for (number, user), row in zip(part, values):
+        try:
+            new_user = await db.scalar(insert(models.User).returning(models.User), row)
+            ledger.record(db, new_user.id, "deposit", new_user.balance, new_user.balance)
+            await db.commit()
+            created.append((number, new_user))
+        except IntegrityError as exc:
+            await db.rollback()
+            message = "Username already registered" if "username" in str(exc.orig) else "Account login collision, retry the row"
+            errors.append(_error(number, user.username, message))
+    return created
+
+
+if __name__ == "__main__":
+    import argparse
+    import json
+
+    from bus import bus
+    from database import AsyncSessionLocal
+
+    parser = argparse.ArgumentParser(description="Bulk-create user accounts from CSV or JSON")
+    parser.add_argument("file", help="CSV with a header row (username,password,full_name,broker[,account_type,balance]) or a JSON list")
+    parser.add_argument("--format", choices=FORMATS, help="default: from the file extension")
+    parser.add_argument("--report", help="write the JSON report (created logins and errors) here")
+    args = parser.parse_args()
+
+    fmt = args.format or ("json" if args.file.lower().endswith(".json") else "csv")
+    with open(args.file, "rb") as f:
+        content = f.read()
+
+    async def main():
+        # Running servers hear about the new accounts through the bus
+        await bus.start(listen=False)
+        try:
+            return await provision(AsyncSessionLocal, parse(content, fmt))
+        finally:
+            await bus.stop()
+
+    try:
+        report = asyncio.run(main())
+    except LockHeld:
+        raise SystemExit("Another import is running, retry when it has finished")
+    print(f"Created {report['created']} accounts, {report['failed']} failed, in {report['seconds']}s")
+    for error in report["errors"][:20]:
+        print(f"  row {error['row']} ({error['username']}): {error['error']}")
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {args.report}")
@@ -0,0 +1,150 @@
+import asyncio
+import inspect
+import os
+import time
+
+import numpy as np
+
+import logs
+from symbols import INSTRUMENTS
+
+log = logs.get_logger("quotes")
+
+# Seconds between ticks and per-tick relative volatility of the random walk
+TICK_INTERVAL = float(os.getenv("QUOTE_TICK_INTERVAL", "1.0"))
+VOLATILITY = float(os.getenv("QUOTE_VOLATILITY", "0.0001"))
+# Seeds the random walk so synthetic sessions can be reproduced
+QUOTE_SEED = os.getenv("QUOTE_SEED")
+
+
+class QuoteEngine:
+    # Every instrument lives in one row of a set of parallel NumPy columns,
+    # so a tick is a handful of array operations no matter how many symbols.
+
+    def __init__(self, instruments, seed=None):
+        self.symbols = [i["symbol"] for i in instruments]
+        self.index = {symbol: n for n, symbol in enumerate(self.symbols)}
+
+        self.digits = np.array([i["digits"] for i in instruments], dtype=np.int64)
+        self.point = 10.0 ** -self.digits
+        self.contract_size = np.array([i["contract_size"] for i in instruments], dtype=np.float64)
+
+        self.bid = np.array([i["bid"] for i in instruments], dtype=np.float64)
+        self.ask = np.array([i["ask"] for i in instruments], dtype=np.float64)
+        self.spread = self.ask - self.bid
+        self.high = self.bid.copy()
+        self.low = self.bid.copy()
+        self.open = self.bid.copy()
+        self.time = np.full(len(self.symbols), time.time())
+
+        self.rng = np.random.default_rng(seed)
+        self.seq = 0
+        self.listeners = []
+
+    def add_listener(self, listener):
+        # listener(engine) is called after every tick; it may be a coroutine
+        self.listeners.append(listener)
+
+    def tick(self, now=None):
+        mid = (self.bid + self.ask) * 0.5
+        mid *= 1.0 + self.rng.normal(0.0, VOLATILITY, len(mid))
+        bid = np.round((mid - self.spread * 0.5) / self.point) * self.point
+        self.apply(bid, bid + self.spread, now)
+
+    def apply(self, bid, ask, now=None, rows=None):
+        # rows=None updates every instrument; otherwise only the given rows
+        if rows is None:
+            rows = slice(None)
+        self.bid[rows] = bid
+        self.ask[rows] = ask
+        self.spread[rows] = self.ask[rows] - self.bid[rows]
+        np.maximum(self.high, self.bid, out=self.high)
+        np.minimum(self.low, self.bid, out=self.low)
+        self.time[rows] = time.time() if now is None else now
+        self.seq += 1
+
+    def state(self):
+        # Everything a follower worker needs to mirror this engine's quotes
+        return {
+            "bid": self.bid.tolist(), "ask": self.ask.tolist(),
+            "high": self.high.tolist(), "low": self.low.tolist(),
+            "time": self.time.tolist(),
+        }
+
+    def load_state(self, state):
+        self.bid[:] = state["bid"]
+        self.ask[:] = state["ask"]
+        self.spread = self.ask - self.bid
+        self.high[:] = state["high"]
+        self.low[:] = state["low"]
+        self.time[:] = state["time"]
+        self.seq += 1
+
+    def row(self, symbol):
+        return self.index.get(symbol)
+
+    def get(self, symbol):
+        n = self.index.get(symbol)
+        if n is None:
+            return None
+        return self._quote(n)
+
+    def all(self):
+        return [self._quote(n) for n in range(len(self.symbols))]
+
+    def contract_size_of(self, symbol, default=100000.0):
+        # Units per 1.0 lot; unknown symbols keep the standard FX lot
+        n = self.index.get(symbol)
+        return default if n is None else float(self.contract_size[n])
+
+    def entry_price(self, symbol, side):
+        # Buys open at the ask and sells at the bid
+        n = self.index.get(symbol)
+        if n is None:
+            return None
+        digits = int(self.digits[n])
+        return round(float(self.ask[n] if side == "buy" else self.bid[n]), digits)
+
+    def close_price(self, symbol, side):
+        # Buys close at the bid and sells at the ask
+        n = self.index.get(symbol)
+        if n is None:
+            return None
+        digits = int(self.digits[n])
+        return round(float(self.bid[n] if side == "buy" else self.ask[n]), digits)
+
+    def _quote(self, n):
+        digits = int(self.digits[n])
+        bid = float(self.bid[n])
+        change = bid - float(self.open[n])
+        return {
+            "symbol": self.symbols[n],
+            "bid": round(bid, digits),
+            "ask": round(float(self.ask[n]), digits),
+            "high": round(float(self.high[n]), digits),
+            "low": round(float(self.low[n]), digits),
+            "spread": int(round(float(self.spread[n]) / float(self.point[n]))),
+            "digits": digits,
+            "change_points": int(round(change / float(self.point[n]))),
+            "change_percent": round(change / float(self.open[n]) * 100, 2),
+            "time": float(self.time[n]),
+        }
+
+    async def notify(self):
+        for listener in self.listeners:
+            result = listener(self)
+            if inspect.isawaitable(result):
+                await result
+
+    async def run(self, interval=TICK_INTERVAL):
+        while True:
+            self.tick()
+            try:
+                await self.notify()
+            except Exception:
+                # A broken listener must not stop the price feed
+                log.exception("Quote listener failed")
+            await asyncio.sleep(interval)
+
+
+engine = QuoteEngine(INSTRUMENTS, seed=int(QUOTE_SEED) if QUOTE_SEED else None)
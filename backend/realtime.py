@@ -0,0 +1,161 @@
+import asyncio
+import os
+from collections import deque
+
+import numpy as np
+from fastapi import WebSocket, WebSocketDisconnect
+
+# Events a client may fall behind by before it is dropped and has to resync
+MAX_PENDING_EVENTS = int(os.getenv("WS_MAX_PENDING_EVENTS", "500"))
+
+
+class Connection:
+    def __init__(self, websocket: WebSocket, user_id: int, is_admin: bool):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.is_admin = is_admin
+        self.events = deque()
+        self.quotes_seq = 0  # quote engine seq this client is up to date with
+        self.wakeup = asyncio.Event()
+        self.overflowed = False
+
+    def push(self, event):
+        if len(self.events) >= MAX_PENDING_EVENTS:
+            # Too slow to keep up: stop queueing and let the sender close it
+            self.overflowed = True
+        else:
+            self.events.append(event)
+        self.wakeup.set()
+
+
+class ConnectionManager:
+    # Batch frames carry the queued events plus, as "quotes", only the
+    # instruments whose price moved since the client's last frame; clients
+    # merge them by symbol into the table from the snapshot.
+
+    def __init__(self):
+        self.by_user = {}
+        self.admins = set()
+        self.quotes_seq = 0
+        self.quote_rows = []      # row -> serialized quote
+        self.changed_seq = None   # row -> quote engine seq of its last change
+        self.last_bid = None
+        self.last_ask = None
+
+    def connect(self, conn: Connection):
+        self.by_user.setdefault(conn.user_id, set()).add(conn)
+        if conn.is_admin:
+            self.admins.add(conn)
+
+    def disconnect(self, conn: Connection):
+        conns = self.by_user.get(conn.user_id)
+        if conns is not None:
+            conns.discard(conn)
+            if not conns:
+                del self.by_user[conn.user_id]
+        self.admins.discard(conn)
+
+    # Publishing. Handlers, bus messages and engine listeners all run on the
+    # event loop, so events are queued directly.
+
+    def publish(self, user_id: int, event: dict, admins=True):
+        targets = set(self.by_user.get(user_id, ()))
+        if admins:
+            targets |= self.admins
+        for conn in targets:
+            conn.push(event)
+
+    def on_tick(self, quote_engine):
+        # Re-serialize only the instruments that moved and stamp them with the
+        # tick's seq; each sender picks the rows newer than its client has.
+        q = quote_engine
+        if self.changed_seq is None:
+            rows = np.arange(len(q.symbols))
+            self.changed_seq = np.zeros(len(q.symbols), np.int64)
+            self.quote_rows = [None] * len(q.symbols)
+        else:
+            rows = np.nonzero((q.bid != self.last_bid) | (q.ask != self.last_ask))[0]
+        self.last_bid = q.bid.copy()
+        self.last_ask = q.ask.copy()
+        for n in rows.tolist():
+            self.quote_rows[n] = q.get(q.symbols[n])
+        self.changed_seq[rows] = q.seq
+        self.quotes_seq = q.seq
+        if not len(rows):
+            return
+        for conns in self.by_user.values():
+            for conn in conns:
+                conn.wakeup.set()
+
+    def on_accounts(self, user_ids, mtm_engine):
+        # Mark-to-market listener: equity/margin of accounts that moved this
+        # tick, sent to their owners' connections (not fanned out to admins)
+        if not self.by_user:
+            return
+        connected = np.fromiter(self.by_user, np.int64, len(self.by_user))
+        for user_id in np.intersect1d(user_ids, connected).tolist():
+            self.publish(user_id, {"type": "equity", "account": mtm_engine.account(user_id)}, admins=False)
+
+    def _quotes_since(self, seq):
+        rows = np.nonzero(self.changed_seq > seq)[0]
+        return [self.quote_rows[n] for n in rows.tolist()]
+
+    # Per-connection pump
+
+    async def sender(self, conn: Connection):
+        try:
+            while True:
+                await conn.wakeup.wait()
+                conn.wakeup.clear()
+                if conn.overflowed:
+                    await conn.websocket.close(code=1013, reason="Client too slow, resync required")
+                    return
+
+                frame = {"type": "batch"}
+                if conn.events:
+                    frame["events"] = list(conn.events)
+                    conn.events.clear()
+                if self.quotes_seq > conn.quotes_seq:
+                    changed = self._quotes_since(conn.quotes_seq)
+                    conn.quotes_seq = self.quotes_seq
+                    if changed:
+                        frame["quotes"] = changed
+                if len(frame) > 1:
+                    await conn.websocket.send_json(frame)
+        except (WebSocketDisconnect, RuntimeError):
+            return
+
+    async def receiver(self, conn: Connection):
+        # Nothing is expected from the client; reading just detects disconnects
+        try:
+            while True:
+                await conn.websocket.receive_text()
+        except (WebSocketDisconnect, RuntimeError):
+            return
+
+    async def serve(self, conn: Connection, load_snapshot):
+        # Registered before the snapshot is read, so nothing committed in
+        # between is lost: events published meanwhile queue on the connection
+        # and go out right after the snapshot. Events are upserts by id, so
+        # one the snapshot already reflects is harmless to apply again.
+        self.connect(conn)
+        try:
+            snapshot = await load_snapshot()
+            if snapshot is None:
+                await conn.websocket.close(code=1008, reason="Account not found")
+                return
+            conn.quotes_seq = snapshot["quotes_seq"]
+            await conn.websocket.send_json(snapshot)
+            tasks = {asyncio.create_task(self.sender(conn)), asyncio.create_task(self.receiver(conn))}
+            try:
+                await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            finally:
+                for task in tasks:
+                    task.cancel()
+        except (WebSocketDisconnect, RuntimeError):
+            return
+        finally:
+            self.disconnect(conn)
+
+
+manager = ConnectionManager()
@@ -0,0 +1,137 @@
+import asyncio
+import hashlib
+import os
+import time
+from collections import OrderedDict
+
+from fastapi import Request, Response
+
+import encoding
+
+RESPONSE_CACHE_SIZE = int(os.getenv("RESPONSE_CACHE_SIZE", "10000"))
+# Upper bound on staleness if an invalidation from another worker is lost
+# (the bus drops messages under backpressure)
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "5"))
+
+# Version scope shared by every account, for admin lists of users
+ALL_USERS = "users"
+
+
+class FillAbandoned(Exception):
+    pass
+
+
+class Entry:
+    __slots__ = ("version", "expires_at", "body", "status_code", "media_type", "headers", "etag")
+
+    def __init__(self, version, expires_at, response):
+        self.version = version
+        self.expires_at = expires_at
+        self.body = response.body
+        self.status_code = response.status_code
+        self.media_type = response.media_type
+        # Only our own headers; content-length/type are set again on replay
+        self.headers = {k: v for k, v in response.headers.items() if k not in ("content-length", "content-type")}
+        self.etag = '"' + hashlib.blake2b(response.body, digest_size=12).hexdigest() + '"'
+        self.headers["etag"] = self.etag
+
+
+class ResponseCache:
+    # Encoded responses of hot read endpoints, keyed by route, caller and
+    # negotiated encoding. Each entry records the version of the account (or
+    # of ALL_USERS) it was built from; events.py bumps the version after every
+    # write, here and, through the bus, in the other workers, so a lookup with
+    # a stale version misses. Concurrent misses for one key share a single
+    # computation. ETags hash the body, so they agree across workers.
+
+    def __init__(self, maxsize=RESPONSE_CACHE_SIZE, ttl=RESPONSE_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._inflight = {}
+        self._versions = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.not_modified = 0
+
+    def version(self, scope):
+        return self._versions.get(scope, 0)
+
+    def bump(self, *scopes):
+        for scope in scopes:
+            self._versions[scope] = self._versions.get(scope, 0) + 1
+
+    async def respond(self, request: Request, key, version, compute):
+        # compute() builds the Response on a miss; version is anything
+        # comparable that changes whenever the response would
+        key = (key, encoding.variant(request))
+        entry = self._entries.get(key)
+        if entry is not None and entry.version == version and entry.expires_at > time.monotonic():
+            self._entries.move_to_end(key)
+            self.hits += 1
+        else:
+            entry = await self._fill(key, version, compute)
+        return self._replay(request, entry)
+
+    async def _fill(self, key, version, compute):
+        while True:
+            flight = self._inflight.get((key, version))
+            if flight is None:
+                break
+            self.coalesced += 1
+            try:
+                return await asyncio.shield(flight)
+            except FillAbandoned:
+                # The request filling it was cancelled (e.g. the client went
+                # away); compute() is bound to this request, so fill it here
+                continue
+        self.misses += 1
+        flight = asyncio.get_running_loop().create_future()
+        self._inflight[(key, version)] = flight
+        try:
+            entry = Entry(version, time.monotonic() + self.ttl, await compute())
+        except asyncio.CancelledError:
+            # Not flight.cancel(): waiters must tell this apart from their
+            # own cancellation
+            flight.set_exception(FillAbandoned())
+            flight.exception()
+            raise
+        except Exception as exc:
+            flight.set_exception(exc)
+            flight.exception()  # waiters re-raise it; don't warn if there are none
+            raise
+        finally:
+            del self._inflight[(key, version)]
+        flight.set_result(entry)
+        if entry.status_code == 200:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return entry
+
+    def _replay(self, request, entry):
+        if entry.etag in request.headers.get("if-none-match", ""):
+            self.not_modified += 1
+            return Response(status_code=304, headers={k: v for k, v in entry.headers.items() if k in ("etag", "vary")})
+        return Response(content=entry.body, status_code=entry.status_code, media_type=entry.media_type, headers=entry.headers)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses + self.coalesced
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "ttl": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "not_modified": self.not_modified,
+            "hit_ratio": round((self.hits + self.coalesced) / lookups, 4) if lookups else 0.0,
+        }
+
+
+cache = ResponseCache()
@@ -1,29 +1,39 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
-import database, models, schemas, auth_utils
-from .auth import get_current_admin_user, get_db
+import asyncio
+import csv
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import PlainTextResponse
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
+from datetime import datetime
+import database, models, schemas, auth_utils, events, encoding, trading, ledger, export, archive, provisioning, profiling, logs
+from token_cache import cache as token_cache
+from response_cache import cache as response_cache, ALL_USERS
+from summary import summary
+from cluster import LockHeld
+from database import get_db
+from .auth import get_current_admin_user, hashing_busy
 
 router = APIRouter(
     prefix="/admin",
     tags=["admin"]
 )
 
-import random
-import string
-
 # ... existing imports ...
 
 @router.post("/users", response_model=schemas.User)
-def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+async def create_user(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await db.scalar(select(models.User).where(models.User.username == user.username))
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    hashed_password = auth_utils.get_password_hash(user.password)
+    try:
+        hashed_password = await auth_utils.get_password_hash_async(user.password)
+    except auth_utils.HashPoolBusy:
+        raise hashing_busy()
     
-    # Generate 9 digit random number
-    account_login = "".join(random.choices(string.digits, k=9))
+    # 9 digit random number, checked against existing logins
+    account_login = (await provisioning.allocate_logins(db, 1))[0]
     
     new_user = models.User(
         username=user.username, 
@@ -35,57 +45,129 @@ def create_user(user: schemas.UserCreate, db: Session = Depends(get_db)):
         balance=user.balance
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.flush()
+    ledger.record(db, new_user.id, "deposit", new_user.balance, new_user.balance)
+    await db.commit()
+    await db.refresh(new_user)
+    events.account_changed(new_user)
     return new_user
 
+@router.post("/users/import", response_model=schemas.ProvisionReport, dependencies=[Depends(get_current_admin_user)])
+async def import_users(request: Request, format: Optional[str] = None):
+    # Bulk create from a CSV (header row) or JSON list body; rows that fail
+    # are reported individually and don't stop the others
+    fmt = format or ("json" if "json" in request.headers.get("content-type", "") else "csv")
+    if fmt not in provisioning.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unsupported format, use one of: {', '.join(provisioning.FORMATS)}")
+    try:
+        rows = provisioning.parse(await request.body(), fmt)
+        return await provisioning.provision(database.AsyncSessionLocal, rows)
+    except (ValueError, csv.Error) as exc:
+        raise HTTPException(status_code=400, detail=f"Invalid import: {exc}")
+    except LockHeld:
+        raise HTTPException(status_code=409, detail="Another import is running, retry when it has finished")
+
 @router.get("/users", response_model=List[schemas.User])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    users = db.query(models.User).offset(skip).limit(limit).all()
-    return users
+async def read_users(request: Request, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    async def compute():
+        users = await db.execute(encoding.user_rows().offset(skip).limit(limit))
+        return encoding.rows_response(request, encoding.USER_FIELDS, users.all())
+
+    key = ("users", skip, limit)
+    return await response_cache.respond(request, key, response_cache.version(ALL_USERS), compute)
 
 @router.put("/users/{user_id}", response_model=schemas.User)
-def update_user(user_id: int, user_update: schemas.UserUpdate, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.id == user_id).first()
+async def update_user(user_id: int, user_update: schemas.UserUpdate, db: AsyncSession = Depends(get_db)):
+    # One UPDATE of just the supplied columns, so it can't clobber a balance
+    # change committed by a concurrent close between a read and a write.
+    # Balance/equity edits are logged to the ledger as deltas first.
+    changes = user_update.model_dump(include={"balance", "equity", "margin", "account_type"}, exclude_none=True)
+    if "balance" in changes or "equity" in changes:
+        await ledger.record_adjustment(db, user_id, changes.get("balance"), changes.get("equity"))
+    if changes:
+        stmt = update(models.User).where(models.User.id == user_id).values(**changes).returning(models.User).execution_options(populate_existing=True)
+        user = await db.scalar(stmt)
+    else:
+        user = await db.get(models.User, user_id)
     if not user:
         raise HTTPException(status_code=404, detail="User not found")
     
-    if user_update.balance is not None:
-        user.balance = user_update.balance
-    if user_update.equity is not None:
-        user.equity = user_update.equity
-    if user_update.margin is not None:
-        user.margin = user_update.margin
-    if user_update.account_type is not None:
-        user.account_type = user_update.account_type
-    
-    db.commit()
-    db.refresh(user)
+    await db.commit()
+    events.account_changed(user)
     return user
 
+@router.get("/users/{user_id}/statement", response_model=schemas.Statement, dependencies=[Depends(get_current_admin_user)])
+async def read_user_statement(user_id: int, start: datetime = Query(..., alias="from"), end: Optional[datetime] = Query(None, alias="to"), limit: int = Query(1000, ge=1, le=ledger.STATEMENT_MAX_ENTRIES), db: AsyncSession = Depends(get_db)):
+    if await db.get(models.User, user_id) is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return await ledger.statement(db, user_id, start, end or datetime.utcnow(), limit)
+
+@router.get("/summary", response_model=schemas.AdminSummary, dependencies=[Depends(get_current_admin_user)])
+async def read_summary(top: int = Query(10, ge=1, le=100)):
+    # Served from counters maintained by the write paths; no table scans
+    return summary.snapshot(top)
+
+@router.get("/cache-stats", dependencies=[Depends(get_current_admin_user)])
+async def read_cache_stats():
+    return {"token_cache": token_cache.stats(), "response_cache": response_cache.stats()}
+
+@router.get("/hash-stats", dependencies=[Depends(get_current_admin_user)])
+async def read_hash_stats():
+    return {"password_hashing": auth_utils.hash_pool.stats()}
+
+@router.get("/log-stats", dependencies=[Depends(get_current_admin_user)])
+async def read_log_stats():
+    return {"logging": logs.pipeline.stats()}
+
+@router.get("/profiling", response_model=schemas.Profiling, dependencies=[Depends(get_current_admin_user)])
+async def read_profiling(limit: int = Query(50, ge=1, le=profiling.PROFILE_KEEP)):
+    profiles = await asyncio.to_thread(profiling.profiler.list)
+    return {"settings": profiling.profiler.settings(), "profiles": profiles[:limit]}
+
+@router.put("/profiling", response_model=schemas.ProfilingSettings, dependencies=[Depends(get_current_admin_user)])
+async def update_profiling(settings: schemas.ProfilingSettings):
+    # e.g. {"sample_rate": 1, "path_prefix": "/trades/", "limit": 1} profiles
+    # the next /trades/ request each worker serves
+    if not 0 <= settings.sample_rate <= 1 or settings.limit < 0:
+        raise HTTPException(status_code=400, detail="sample_rate must be within 0..1 and limit not negative")
+    profiling.configure(settings.model_dump())
+    return settings
+
+@router.get("/profiling/{profile_id}", dependencies=[Depends(get_current_admin_user)])
+async def download_profile(profile_id: str):
+    # Collapsed stacks: flamegraph.pl, speedscope or inferno render them
+    collapsed = await asyncio.to_thread(profiling.profiler.read, profile_id)
+    if collapsed is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return PlainTextResponse(collapsed, headers={"Content-Disposition": f'attachment; filename="{profile_id}.collapsed"'})
+
 @router.get("/trades", response_model=List[schemas.Trade])
-def read_all_trades(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
-    trades = db.query(models.Trade).order_by(models.Trade.open_time.desc()).offset(skip).limit(limit).all()
-    return trades
+async def read_all_trades(request: Request, skip: int = 0, limit: int = 100, db: AsyncSession = Depends(get_db)):
+    trades = await archive.newest_page(db, encoding.trade_rows, limit, skip)
+    return encoding.rows_response(request, encoding.TRADE_FIELDS, trades)
+
+@router.get("/trades/export", dependencies=[Depends(get_current_admin_user)])
+async def export_all_trades(format: str = "csv", start: Optional[datetime] = Query(None, alias="from"), end: Optional[datetime] = Query(None, alias="to"), symbol: Optional[str] = None, status: Optional[str] = None, user_id: Optional[int] = None):
+    stmt = export.trade_export_query(user_id, start, end, symbol, status)
+    return export.export_response(stmt, format, "all-trades")
 
 @router.put("/trades/{trade_id}/outcome")
-def force_trade_outcome(trade_id: int, outcome: str, db: Session = Depends(get_db)):
+async def force_trade_outcome(trade_id: int, outcome: str, db: AsyncSession = Depends(get_db)):
     if outcome not in ["WIN", "LOSS", "NONE"]:
         raise HTTPException(status_code=400, detail="Invalid outcome")
-    trade = db.query(models.Trade).filter(models.Trade.id == trade_id).first()
+    trade = await db.get(models.Trade, trade_id)
     if not trade:
         raise HTTPException(status_code=404, detail="Trade not found")
     
     trade.forced_outcome = outcome
-    db.commit()
-    trade.forced_outcome = outcome
-    db.commit()
+    await db.commit()
+    events.trade_changed(trade)
     return {"message": f"Trade {trade_id} forced to {outcome}"}
 
 @router.post("/trades/{trade_id}/settle")
-def settle_trade(trade_id: int, settlement: schemas.TradeSettle, db: Session = Depends(get_db)):
+async def settle_trade(trade_id: int, settlement: schemas.TradeSettle, db: AsyncSession = Depends(get_db)):
     # 1. Fetch Trade
-    trade = db.query(models.Trade).filter(models.Trade.id == trade_id).first()
+    trade = await db.get(models.Trade, trade_id)
     if not trade:
         raise HTTPException(status_code=404, detail="Trade not found")
     
@@ -96,32 +178,16 @@ def settle_trade(trade_id: int, settlement: schemas.TradeSettle, db: Session = D
     # If WIN, profit is +amount. If LOSS, profit is -amount.
     final_profit = settlement.amount if settlement.outcome == "WIN" else -settlement.amount
     
-    # 3. Update Trade
-    trade.profit = final_profit
-    trade.status = "CLOSED"
-    trade.forced_outcome = settlement.outcome
-    trade.close_time = auth_utils.datetime.utcnow()
-    # For forced settlement, close_price might not be relevant or can be set to simulated price, 
-    # but we just keep it as is or entry_price for simplicity, as profit is forced.
-    trade.close_price = trade.entry_price 
-
-    # 4. Update User Balance
-    user = db.query(models.User).filter(models.User.id == trade.user_id).first()
-    if user:
-        user.balance += final_profit
-        # Equity typically equals Balance + Floating Profit. Since this trade is closed, 
-        # its floating profit is 0 (or realized). 
-        # We should strictly recalculate equity based on other open trades, 
-        # but a simple approach for now is to just add the profit to equity as well, 
-        # assuming equity was tracking balance + open trades.
-        user.equity += final_profit
-    
-    db.commit()
-    return {"message": f"Trade {trade_id} settled as {settlement.outcome} with profit {final_profit}", "new_balance": user.balance}
+    # 3. Close the trade at its entry price (profit is forced) and credit the
+    # account, both as conditional/incremental UPDATEs
+    trade, user = await trading.settle_trade(db, trade_id, settlement.outcome, final_profit)
+    if trade is None:
+        raise HTTPException(status_code=400, detail="Trade already closed")
+    return {"message": f"Trade {trade_id} settled as {settlement.outcome} with profit {final_profit}", "new_balance": user.balance if user else None}
 
 @router.post("/app-settings", response_model=schemas.AppSettings)
-def update_settings(settings: schemas.AppSettingsCreate, db: Session = Depends(get_db)):
-    db_settings = db.query(models.AppSettings).first()
+async def update_settings(settings: schemas.AppSettingsCreate, db: AsyncSession = Depends(get_db)):
+    db_settings = await db.scalar(select(models.AppSettings))
     if not db_settings:
         db_settings = models.AppSettings(**settings.dict())
         db.add(db_settings)
@@ -131,6 +197,6 @@ def update_settings(settings: schemas.AppSettingsCreate, db: Session = Depends(g
         db_settings.theme_primary = settings.theme_primary
         db_settings.theme_secondary = settings.theme_secondary
     
-    db.commit()
-    db.refresh(db_settings)
+    await db.commit()
+    await db.refresh(db_settings)
     return db_settings
@@ -1,34 +1,42 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, status
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
-import database, models, schemas, auth_utils
-from datetime import timedelta
-import random
-import string
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+import database, models, schemas, auth_utils, events, mtm, ledger, encoding, provisioning, logs
+from database import get_db
+from token_cache import cache as token_cache
+from response_cache import cache as response_cache
+from datetime import datetime, timedelta
+from typing import Optional
 
 router = APIRouter(
     tags=["authentication"]
 )
 
+log = logs.get_logger("auth")
+
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def get_db():
-    db = database.SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+def hashing_busy():
+    return HTTPException(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        detail="Server busy, please retry",
+        headers={"Retry-After": "1"},
+    )
 
 @router.post("/register", response_model=schemas.User)
-def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
-    db_user = db.query(models.User).filter(models.User.username == user.username).first()
+async def register(user: schemas.UserCreate, db: AsyncSession = Depends(get_db)):
+    db_user = await db.scalar(select(models.User).where(models.User.username == user.username))
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
     
-    hashed_password = auth_utils.get_password_hash(user.password)
+    try:
+        hashed_password = await auth_utils.get_password_hash_async(user.password)
+    except auth_utils.HashPoolBusy:
+        raise hashing_busy()
     
-    # Generate 9 digit random number
-    account_login = "".join(random.choices(string.digits, k=9))
+    # 9 digit random number, checked against existing logins
+    account_login = (await provisioning.allocate_logins(db, 1))[0]
     
     new_user = models.User(
         username=user.username,
@@ -40,60 +48,105 @@ def register(user: schemas.UserCreate, db: Session = Depends(get_db)):
         balance=user.balance
     )
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.flush()
+    ledger.record(db, new_user.id, "deposit", new_user.balance, new_user.balance)
+    await db.commit()
+    await db.refresh(new_user)
+    events.account_changed(new_user)
     return new_user
 
 @router.post("/token", response_model=schemas.Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    print(f"Login attempt for user: {form_data.username}")
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(get_db)):
+    # One queued record per attempt (sample with LOG_SAMPLE=auth=...)
+    user = await db.scalar(select(models.User).where(models.User.username == form_data.username))
     if not user:
-        print("User not found in DB")
+        log.info("Login failed", extra={"fields": {"username": form_data.username, "reason": "unknown_user"}})
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
-    if not auth_utils.verify_password(form_data.password, user.hashed_password):
-        print(f"Password verification failed for user: {form_data.username}")
-        # print(f"Hash in DB: {user.hashed_password}") # Be careful not to log secrets in prod, but for debug ok
+    try:
+        verified, new_hash = await auth_utils.verify_and_update_async(form_data.password, user.hashed_password)
+    except auth_utils.HashPoolBusy:
+        raise hashing_busy()
+    if not verified:
+        log.info("Login failed", extra={"fields": {"username": form_data.username, "reason": "bad_password"}})
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    print("Login successful")
+    if new_hash:
+        # Stored with an outdated cost: upgrade it while we have the plaintext
+        user.hashed_password = new_hash
+        await db.commit()
+    log.info("Login succeeded", extra={"fields": {"username": user.username, "user_id": user.id, "rehashed": bool(new_hash)}})
     access_token_expires = timedelta(minutes=auth_utils.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = auth_utils.create_access_token(
         data={"sub": user.username}, expires_delta=access_token_expires
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(get_db)):
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+async def user_from_token(token: str, db: AsyncSession):
+    # Returns a schemas.User snapshot, or None for an invalid token or unknown user.
+    # Resolved tokens are cached until the account is written or the entry expires.
+    user = token_cache.get(token)
+    if user is not None:
+        return user
     try:
         payload = auth_utils.jwt.decode(token, auth_utils.SECRET_KEY, algorithms=[auth_utils.ALGORITHM])
         username: str = payload.get("sub")
         if username is None:
-            raise credentials_exception
+            return None
         token_data = schemas.TokenData(username=username)
     except auth_utils.JWTError:
-        raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == token_data.username).first()
+        return None
+    db_user = await db.scalar(select(models.User).where(models.User.username == token_data.username))
+    if db_user is None:
+        return None
+    user = schemas.User.model_validate(db_user)
+    token_cache.put(token, payload, user)
+    return user
+
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)):
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Could not validate credentials",
+        headers={"WWW-Authenticate": "Bearer"},
+    )
+    user = await user_from_token(token, db)
     if user is None:
         raise credentials_exception
     return user
 
 
 @router.get("/me", response_model=schemas.User)
-async def read_users_me(current_user: models.User = Depends(get_current_user)):
-    return current_user
+async def read_users_me(request: Request, current_user: schemas.User = Depends(get_current_user)):
+    # Equity and margin come from the live mark-to-market table when available,
+    # so they are part of the cache version along with the account's writes
+    live = mtm.engine.account(current_user.id)
+    if live is not None:
+        current_user = current_user.model_copy(update={"balance": live["balance"], "equity": live["equity"], "margin": live["margin"]})
+    version = (response_cache.version(current_user.id), current_user.balance, current_user.equity, current_user.margin)
+
+    async def compute():
+        return encoding.object_response(request, encoding.USER_FIELDS, current_user)
+
+    return await response_cache.respond(request, ("me", current_user.id), version, compute)
+
+@router.get("/me/account", response_model=schemas.AccountState)
+async def read_account_state(current_user: models.User = Depends(get_current_user)):
+    live = mtm.engine.account(current_user.id)
+    if live is None:
+        raise HTTPException(status_code=404, detail="Account not loaded")
+    return live
+
+@router.get("/me/statement", response_model=schemas.Statement)
+async def read_statement(start: datetime = Query(..., alias="from"), end: Optional[datetime] = Query(None, alias="to"), limit: int = Query(1000, ge=1, le=ledger.STATEMENT_MAX_ENTRIES), current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # Opening/closing balance plus every ledger entry in (from, to]
+    return await ledger.statement(db, current_user.id, start, end or datetime.utcnow(), limit)
 
 async def get_current_admin_user(current_user: models.User = Depends(get_current_user)):
     if current_user.role != "admin":
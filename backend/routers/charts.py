@@ -0,0 +1,20 @@
+from fastapi import APIRouter, HTTPException, Query
+from typing import List, Optional
+import schemas, candles
+
+router = APIRouter(
+    prefix="/candles",
+    tags=["candles"]
+)
+
+MAX_BARS = 5000
+
+@router.get("/{symbol}", response_model=List[schemas.Candle])
+async def read_candles(symbol: str, tf: str = "M1", start: Optional[float] = Query(None, alias="from"), end: Optional[float] = Query(None, alias="to"), limit: int = Query(1000, ge=1, le=MAX_BARS)):
+    # from/to are unix timestamps (seconds); bars are keyed by their open time
+    if tf not in candles.TIMEFRAMES:
+        raise HTTPException(status_code=400, detail=f"tf must be one of {', '.join(candles.TIMEFRAMES)}")
+    bars = candles.store.history(symbol.upper(), tf, start, end, limit)
+    if bars is None:
+        raise HTTPException(status_code=404, detail="Unknown symbol")
+    return bars
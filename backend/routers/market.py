@@ -0,0 +1,19 @@
+from fastapi import APIRouter, HTTPException
+from typing import List
+import schemas, quotes
+
+router = APIRouter(
+    prefix="/quotes",
+    tags=["quotes"]
+)
+
+@router.get("/", response_model=List[schemas.Quote])
+async def read_quotes():
+    return quotes.engine.all()
+
+@router.get("/{symbol}", response_model=schemas.Quote)
+async def read_quote(symbol: str):
+    quote = quotes.engine.get(symbol.upper())
+    if quote is None:
+        raise HTTPException(status_code=404, detail="Unknown symbol")
+    return quote
@@ -0,0 +1,79 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List
+from datetime import datetime, timezone
+import models, schemas, quotes, events, orders
+from database import get_db
+from .auth import get_current_user
+
+router = APIRouter(
+    prefix="/orders",
+    tags=["orders"]
+)
+
+ORDER_LIST_MAX = 500
+
+@router.post("/", response_model=schemas.PendingOrder)
+async def place_order(order: schemas.PendingOrderCreate, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # Limit/stop entry; the leader's order engine opens the trade when the price is reached
+    if order.type not in orders.ORDER_TYPES or order.volume <= 0:
+        raise HTTPException(status_code=400, detail="Invalid order type or volume")
+    side = orders.ORDER_TYPES[order.type][0]
+    market = quotes.engine.entry_price(order.symbol, side)
+    if market is None:
+        raise HTTPException(status_code=400, detail="Unknown symbol")
+    if not orders.valid_price(order.type, order.price, market):
+        raise HTTPException(status_code=400, detail=f"Invalid price for {order.type} at market {market}")
+    expires_at = order.expires_at
+    if expires_at is not None and expires_at.tzinfo is not None:
+        expires_at = expires_at.astimezone(timezone.utc).replace(tzinfo=None)
+    if expires_at is not None and expires_at <= datetime.utcnow():
+        raise HTTPException(status_code=400, detail="Expiry must be in the future")
+
+    new_order = models.PendingOrder(
+        user_id=current_user.id,
+        symbol=order.symbol,
+        type=order.type,
+        volume=order.volume,
+        price=order.price,
+        sl=order.sl,
+        tp=order.tp,
+        expires_at=expires_at,
+        status="PENDING"
+    )
+    db.add(new_order)
+    await db.commit()
+    await db.refresh(new_order)
+    events.order_changed(new_order)
+    return new_order
+
+@router.get("/", response_model=List[schemas.PendingOrder])
+async def get_my_orders(status: str = "PENDING", limit: int = Query(100, ge=1, le=ORDER_LIST_MAX), current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    result = await db.scalars(
+        select(models.PendingOrder)
+        .where(models.PendingOrder.user_id == current_user.id, models.PendingOrder.status == status.upper())
+        .order_by(models.PendingOrder.created_at.desc())
+        .limit(limit)
+    )
+    return result.all()
+
+@router.delete("/{order_id}", response_model=schemas.PendingOrder)
+async def cancel_order(order_id: int, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # Conditional UPDATE: loses cleanly against a fill or expiry in progress
+    cancelled = await db.scalar(
+        update(models.PendingOrder)
+        .where(models.PendingOrder.id == order_id, models.PendingOrder.user_id == current_user.id, models.PendingOrder.status == "PENDING")
+        .values(status="CANCELLED")
+        .returning(models.PendingOrder)
+        .execution_options(populate_existing=True)
+    )
+    if cancelled is None:
+        await db.rollback()
+        existing = await db.get(models.PendingOrder, order_id)
+        if existing is None or existing.user_id != current_user.id:
+            raise HTTPException(status_code=404, detail="Order not found")
+        raise HTTPException(status_code=400, detail=f"Order already {existing.status.lower()}")
+    await db.commit()
+    events.order_changed(cancelled)
+    return cancelled
@@ -1,9 +1,12 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
-from typing import List
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from sqlalchemy import and_, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 from datetime import datetime
-import database, models, schemas
-from .auth import get_current_user, get_db
+import database, models, schemas, quotes, events, trading, encoding, export, archive
+from response_cache import cache as response_cache
+from database import get_db
+from .auth import get_current_user
 
 router = APIRouter(
     prefix="/trades",
@@ -11,55 +14,205 @@ router = APIRouter(
 )
 
 @router.post("/", response_model=schemas.Trade)
-def place_trade(trade: schemas.TradeCreate, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
+async def place_trade(trade: schemas.TradeCreate, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
     # Basic check for margin/balance can be added here
+    # Known symbols fill at the server quote; the client price is only a fallback
+    entry_price = quotes.engine.entry_price(trade.symbol, trade.type)
+    if entry_price is None:
+        entry_price = trade.entry_price
+
     new_trade = models.Trade(
         user_id=current_user.id,
         symbol=trade.symbol,
         type=trade.type,
         volume=trade.volume,
-        entry_price=trade.entry_price,
+        entry_price=entry_price,
         sl=trade.sl,
         tp=trade.tp,
         status="OPEN"
     )
     db.add(new_trade)
-    db.commit()
-    db.refresh(new_trade)
+    await db.commit()
+    await db.refresh(new_trade)
+    events.trade_opened(new_trade, current_user)
     return new_trade
 
+HISTORY_PAGE_MAX = 500
+
+async def _keyset_page(db: AsyncSession, build, before_time: Optional[datetime], before_id: Optional[int], limit: int):
+    # Keyset pagination on (open_time, id), newest first: no OFFSET scan, cost tracks page size.
+    # build(model) is applied to the live table, and to the archive for pages reaching back that far.
+    if (before_time is None) != (before_id is None):
+        raise HTTPException(status_code=422, detail="before_time and before_id must be given together")
+    def page(model):
+        stmt = build(model)
+        if before_time is not None:
+            stmt = stmt.where(or_(
+                model.open_time < before_time,
+                and_(model.open_time == before_time, model.id < before_id),
+            ))
+        return stmt
+    return await archive.newest_page(db, page, limit)
+
+# List endpoints select plain column tuples and encode them directly (see
+# encoding.py); response_model still documents the shape.
+
 @router.get("/", response_model=List[schemas.Trade])
-def get_my_trades(current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    return db.query(models.Trade).filter(models.Trade.user_id == current_user.id).order_by(models.Trade.open_time.desc()).all()
+async def get_my_trades(request: Request, since: Optional[int] = None, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # With ?since=<cursor> only rows created or changed after the cursor are returned;
+    # clients merge them by id. X-Sync-Cursor carries the value to send next time.
+    # The cursor is a trade's change_seq (see models.NEXT_CHANGE_SEQ), which a
+    # later commit can never undercut, so the boundary is exclusive.
+    # Served from the response cache until the account's next write.
+    def build(model):
+        # change_seq rides along last for the cursor; the encoder stops at TRADE_FIELDS
+        stmt = encoding.trade_rows(model).add_columns(model.change_seq).where(model.user_id == current_user.id)
+        if since is not None:
+            stmt = stmt.where(model.change_seq > since)
+        return stmt
+
+    async def compute():
+        # Archived rows keep their change_seq, so the delta reads both tables
+        stmt = archive.select_trades(build, lambda c: (c.open_time.desc(),))
+        rows = (await db.execute(stmt)).all()
+        seqs = [row.change_seq for row in rows if row.change_seq is not None]
+        cursor = max(seqs) if seqs else since
+        headers = {"X-Sync-Cursor": str(cursor)} if cursor is not None else None
+        return encoding.rows_response(request, encoding.TRADE_FIELDS, rows, headers)
+
+    key = ("trades", current_user.id, since)
+    return await response_cache.respond(request, key, response_cache.version(current_user.id), compute)
+
+@router.get("/open", response_model=List[schemas.Trade])
+async def get_open_trades(request: Request, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    result = await db.execute(encoding.trade_rows().where(models.Trade.user_id == current_user.id, models.Trade.status == "OPEN").order_by(models.Trade.open_time.desc()))
+    return encoding.rows_response(request, encoding.TRADE_FIELDS, result.all())
+
+@router.get("/closed", response_model=List[schemas.Trade])
+async def get_closed_trades(request: Request, before_time: Optional[datetime] = None, before_id: Optional[int] = None, limit: int = Query(100, ge=1, le=HISTORY_PAGE_MAX), current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    build = lambda m: encoding.trade_rows(m).where(m.user_id == current_user.id, m.status == "CLOSED")
+    return encoding.rows_response(request, encoding.TRADE_FIELDS, await _keyset_page(db, build, before_time, before_id, limit))
+
+@router.get("/history", response_model=List[schemas.Trade])
+async def get_trade_history(request: Request, before_time: Optional[datetime] = None, before_id: Optional[int] = None, limit: int = Query(100, ge=1, le=HISTORY_PAGE_MAX), current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    # Pass the open_time and id of the last row received to get the next page
+    build = lambda m: encoding.trade_rows(m).where(m.user_id == current_user.id)
+    return encoding.rows_response(request, encoding.TRADE_FIELDS, await _keyset_page(db, build, before_time, before_id, limit))
+
+@router.get("/export")
+async def export_my_trades(format: str = "csv", start: Optional[datetime] = Query(None, alias="from"), end: Optional[datetime] = Query(None, alias="to"), symbol: Optional[str] = None, status: Optional[str] = None, current_user: models.User = Depends(get_current_user)):
+    # Streams the whole filtered history as CSV or NDJSON, oldest first
+    stmt = export.trade_export_query(current_user.id, start, end, symbol, status)
+    return export.export_response(stmt, format, "trades")
 
 @router.put("/{trade_id}/close", response_model=schemas.Trade)
-def close_trade(trade_id: int, close_price: float, current_user: models.User = Depends(get_current_user), db: Session = Depends(get_db)):
-    trade = db.query(models.Trade).filter(models.Trade.id == trade_id, models.Trade.user_id == current_user.id).first()
+async def close_trade(trade_id: int, close_price: Optional[float] = None, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    trade = await db.scalar(select(models.Trade).where(models.Trade.id == trade_id, models.Trade.user_id == current_user.id))
     if not trade:
         raise HTTPException(status_code=404, detail="Trade not found")
     
     if trade.status == "CLOSED":
         raise HTTPException(status_code=400, detail="Trade already closed")
 
-    # Calculate P/L
-    multiplier = 1 if trade.type == 'buy' else -1
-    raw_profit = (close_price - trade.entry_price) * trade.volume * multiplier * 100000 # Standard Lot (100k units)
-    
-    # Apply forced outcome if any
-    if trade.forced_outcome == "WIN":
-        raw_profit = abs(raw_profit) if raw_profit != 0 else 100
-    elif trade.forced_outcome == "LOSS":
-        raw_profit = -abs(raw_profit) if raw_profit != 0 else -100
-
-    trade.close_price = close_price
-    trade.profit = raw_profit
-    trade.status = "CLOSED"
-    trade.close_time = datetime.utcnow()
-    
-    # Update user balance
-    current_user.balance += raw_profit
-    current_user.equity += raw_profit # Simplify for now
-    
-    db.commit()
-    db.refresh(trade)
-    return trade
+    # Close at the server quote; a client price is only accepted for symbols the feed doesn't carry
+    server_price = quotes.engine.close_price(trade.symbol, trade.type)
+    if server_price is not None:
+        close_price = server_price
+    elif close_price is None:
+        raise HTTPException(status_code=400, detail="No quote available for symbol")
+
+    # Calculate P/L, update the trade and credit the account. The UPDATE only
+    # matches an OPEN row, so if a concurrent close got there first we lose
+    # cleanly instead of crediting twice.
+    closed, _ = await trading.close_trades(db, [trade], [close_price])
+    if not closed:
+        raise HTTPException(status_code=400, detail="Trade already closed")
+    return closed[0]
+
+# Batch operations: one transaction per request, set-based UPDATEs and a
+# single balance delta per account (see trading.close_trades).
+
+BATCH_MAX = 500
+
+async def _close_open(db: AsyncSession, trades):
+    prices = [quotes.engine.close_price(t.symbol, t.type) for t in trades]
+    priced = [(t, p) for t, p in zip(trades, prices) if p is not None]
+    closed, _ = await trading.close_trades(db, [t for t, _ in priced], [p for _, p in priced])
+    closed_by_id = {t.id: t for t in closed}
+    results = []
+    for trade, price in zip(trades, prices):
+        done = closed_by_id.get(trade.id)
+        if done is not None:
+            results.append(schemas.BatchItemResult(id=trade.id, ok=True, status="CLOSED", price=done.close_price, profit=done.profit))
+        elif price is None:
+            results.append(schemas.BatchItemResult(id=trade.id, ok=False, status="OPEN", error="No quote available for symbol"))
+        else:
+            results.append(schemas.BatchItemResult(id=trade.id, ok=False, status="CLOSED", error="Trade already closed"))
+    return results
+
+@router.post("/close-all", response_model=List[schemas.BatchItemResult], response_model_exclude_none=True)
+async def close_all_trades(current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    trades = (await db.scalars(select(models.Trade).where(models.Trade.user_id == current_user.id, models.Trade.status == "OPEN"))).all()
+    return await _close_open(db, trades)
+
+@router.post("/close-by-symbol", response_model=List[schemas.BatchItemResult], response_model_exclude_none=True)
+async def close_trades_by_symbol(selection: schemas.TradeCloseBySymbol, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    stmt = select(models.Trade).where(models.Trade.user_id == current_user.id, models.Trade.status == "OPEN", models.Trade.symbol == selection.symbol)
+    if selection.type is not None:
+        stmt = stmt.where(models.Trade.type == selection.type)
+    trades = (await db.scalars(stmt)).all()
+    return await _close_open(db, trades)
+
+@router.post("/close-batch", response_model=List[schemas.BatchItemResult], response_model_exclude_none=True)
+async def close_trades_batch(batch: schemas.TradeCloseBatch, current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    if len(batch.ids) > BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX} trades per batch")
+    found = (await db.scalars(select(models.Trade).where(models.Trade.id.in_(batch.ids), models.Trade.user_id == current_user.id))).all()
+    by_id = {t.id: t for t in found}
+    open_trades = [t for t in found if t.status == "OPEN"]
+    results = {r.id: r for r in await _close_open(db, open_trades)}
+
+    ordered = []
+    for trade_id in dict.fromkeys(batch.ids):
+        if trade_id in results:
+            ordered.append(results[trade_id])
+        elif trade_id in by_id:
+            ordered.append(schemas.BatchItemResult(id=trade_id, ok=False, status="CLOSED", error="Trade already closed"))
+        else:
+            ordered.append(schemas.BatchItemResult(id=trade_id, ok=False, error="Trade not found"))
+    return ordered
+
+@router.post("/batch", response_model=List[schemas.BatchItemResult], response_model_exclude_none=True)
+async def place_trades_batch(orders: List[schemas.TradeCreate], current_user: models.User = Depends(get_current_user), db: AsyncSession = Depends(get_db)):
+    if len(orders) > BATCH_MAX:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX} orders per batch")
+    results = []
+    new_trades = []
+    for order in orders:
+        if order.type not in ("buy", "sell") or order.volume <= 0:
+            results.append(schemas.BatchItemResult(ok=False, error="Invalid order type or volume"))
+            continue
+        entry_price = quotes.engine.entry_price(order.symbol, order.type)
+        trade = models.Trade(
+            user_id=current_user.id,
+            symbol=order.symbol,
+            type=order.type,
+            volume=order.volume,
+            entry_price=entry_price if entry_price is not None else order.entry_price,
+            sl=order.sl,
+            tp=order.tp,
+            status="OPEN"
+        )
+        new_trades.append(trade)
+        results.append(trade)
+
+    db.add_all(new_trades)
+    await db.commit()
+    with events.batched():
+        for trade in new_trades:
+            events.trade_opened(trade, current_user)
+    return [
+        r if isinstance(r, schemas.BatchItemResult)
+        else schemas.BatchItemResult(id=r.id, ok=True, status="OPEN", price=r.entry_price)
+        for r in results
+    ]
@@ -44,6 +44,95 @@ class User(UserBase):
     class Config:
         from_attributes = True
 
+class ProvisionedAccount(BaseModel):
+    row: int
+    id: int
+    username: str
+    account_login: str
+
+class ProvisionError(BaseModel):
+    row: int
+    username: Optional[str] = None
+    error: str
+
+class ProvisionReport(BaseModel):
+    created: int
+    failed: int
+    seconds: float
+    accounts: List[ProvisionedAccount]
+    errors: List[ProvisionError]
+
+class ProfilingSettings(BaseModel):
+    sample_rate: float = 0.0  # share of matching requests profiled; 0 turns sampling off
+    path_prefix: Optional[str] = None  # only requests under this path
+    limit: int = 10  # profiles per worker before sampling stops by itself
+
+class ProfileInfo(BaseModel):
+    id: str
+    at: float
+    method: str
+    path: str
+    route: str
+    status: int
+    ms: float
+    samples: int
+    interval_ms: float
+    concurrent: int
+    truncated: bool
+    pid: int
+
+class Profiling(BaseModel):
+    settings: ProfilingSettings
+    profiles: List[ProfileInfo]
+
+class AccountState(BaseModel):
+    user_id: int
+    balance: float
+    floating: float
+    equity: float
+    margin: float
+    free_margin: float
+    margin_level: float
+
+class LedgerEntry(BaseModel):
+    id: int
+    kind: str
+    amount: float
+    equity_delta: float
+    trade_id: Optional[int] = None
+    created_at: datetime
+
+    class Config:
+        from_attributes = True
+
+class Statement(BaseModel):
+    user_id: int
+    start: datetime
+    end: datetime
+    opening_balance: float
+    closing_balance: float
+    entries: List[LedgerEntry]
+
+class SymbolExposure(BaseModel):
+    symbol: str
+    positions: int
+    long_volume: float
+    short_volume: float
+    net_exposure: Optional[float] = None
+    gross_exposure: Optional[float] = None
+
+class TopAccount(AccountState):
+    username: Optional[str] = None
+
+class AdminSummary(BaseModel):
+    accounts: int
+    open_positions: int
+    realized_today: float
+    closed_today: int
+    symbols: List[SymbolExposure]
+    top_accounts: List[TopAccount]
+    recounted_at: Optional[datetime] = None
+
 # Trade Schemas
 class TradeBase(BaseModel):
     symbol: str
@@ -66,10 +155,46 @@ class Trade(TradeBase):
     forced_outcome: str
     open_time: datetime
     close_time: Optional[datetime] = None
+    updated_at: Optional[datetime] = None
+
+    class Config:
+        from_attributes = True
+
+class PendingOrderCreate(BaseModel):
+    symbol: str
+    type: str  # 'buy_limit', 'buy_stop', 'sell_limit' or 'sell_stop'
+    volume: float
+    price: float
+    sl: Optional[float] = None
+    tp: Optional[float] = None
+    expires_at: Optional[datetime] = None  # UTC; good till cancelled when omitted
+
+class PendingOrder(PendingOrderCreate):
+    id: int
+    user_id: int
+    status: str
+    trade_id: Optional[int] = None
+    created_at: datetime
+    updated_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
+class TradeCloseBatch(BaseModel):
+    ids: List[int]
+
+class TradeCloseBySymbol(BaseModel):
+    symbol: str
+    type: Optional[str] = None  # 'buy', 'sell' or both when omitted
+
+class BatchItemResult(BaseModel):
+    id: Optional[int] = None
+    ok: bool
+    status: Optional[str] = None
+    price: Optional[float] = None
+    profit: Optional[float] = None
+    error: Optional[str] = None
+
 class TradeSettle(BaseModel):
     outcome: str # "WIN" or "LOSS"
     amount: float
@@ -89,3 +214,24 @@ class AppSettings(AppSettingsBase):
 
     class Config:
         from_attributes = True
+
+# Quote Schemas
+class Quote(BaseModel):
+    symbol: str
+    bid: float
+    ask: float
+    high: float
+    low: float
+    spread: int
+    digits: int
+    change_points: int
+    change_percent: float
+    time: float
+
+class Candle(BaseModel):
+    time: float
+    open: float
+    high: float
+    low: float
+    close: float
+    volume: float
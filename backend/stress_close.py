@@ -0,0 +1,165 @@
+import argparse
+import asyncio
+import os
+import random
+import string
+import sys
+import tempfile
+
+import httpx
+
+# Concurrency stress test for closing trades. Opens a batch of trades on one
+# account, then fires duplicate closes, admin settlements and close-all calls
+# at them all at once, and checks that
+#   - every trade was closed exactly once, and
+#   - the final balance is the starting balance plus the recorded profits.
+#
+#   python stress_close.py                                      # in-process
+#   python stress_close.py --url http://localhost:8000          # e.g. uvicorn --workers 4
+
+PASSWORD = "password123"
+SYMBOLS = ["EURUSD", "GBPUSD", "XAUUSD", "BTCUSD"]
+START_BALANCE = 100000.0
+
+
+async def setup(client, trades):
+    username = "stress_" + "".join(random.choices(string.ascii_lowercase, k=6))
+    res = await client.post("/admin/users", json={
+        "full_name": "Stress", "username": username, "password": PASSWORD,
+        "broker": "MetaQuotes-Demo", "account_type": "demo", "balance": START_BALANCE,
+    })
+    res.raise_for_status()
+    user_id = res.json()["id"]
+    res = await client.post("/auth/token", data={"username": username, "password": PASSWORD})
+    res.raise_for_status()
+    headers = {"Authorization": f"Bearer {res.json()['access_token']}"}
+    orders = [
+        {"symbol": random.choice(SYMBOLS), "type": random.choice(["buy", "sell"]), "volume": 0.1, "entry_price": 0}
+        for _ in range(trades)
+    ]
+    res = await client.post("/trades/batch", json=orders, headers=headers)
+    res.raise_for_status()
+    ids = [item["id"] for item in res.json() if item["ok"]]
+    return user_id, headers, ids
+
+
+async def attack(client, headers, ids, closers, settlers, close_alls, concurrency):
+    closes = {trade_id: 0 for trade_id in ids}
+    jobs = []
+    for trade_id in ids:
+        jobs += [("close", trade_id)] * closers
+        jobs += [("settle", trade_id)] * settlers
+    jobs += [("close-all", None)] * close_alls
+    random.shuffle(jobs)
+
+    gate = asyncio.Semaphore(concurrency)
+
+    async def run(kind, trade_id):
+        async with gate:
+            if kind == "close":
+                res = await client.put(f"/trades/{trade_id}/close", headers=headers)
+                if res.status_code == 200:
+                    closes[trade_id] += 1
+            elif kind == "settle":
+                res = await client.post(f"/admin/trades/{trade_id}/settle", json={"outcome": random.choice(["WIN", "LOSS"]), "amount": 25.0})
+                if res.status_code == 200:
+                    closes[trade_id] += 1
+            else:
+                res = await client.post("/trades/close-all", headers=headers)
+                if res.status_code == 200:
+                    for item in res.json():
+                        if item["ok"]:
+                            closes[item["id"]] += 1
+            if res.status_code >= 500:
+                raise RuntimeError(f"{kind} {trade_id}: HTTP {res.status_code} {res.text}")
+
+    await asyncio.gather(*(run(kind, trade_id) for kind, trade_id in jobs))
+    return closes, len(jobs)
+
+
+async def verify(client, user_id, headers, closes):
+    failures = []
+    twice = [trade_id for trade_id, n in closes.items() if n > 1]
+    never = [trade_id for trade_id, n in closes.items() if n == 0]
+    if twice:
+        failures.append(f"{len(twice)} trades closed more than once: {twice[:10]}")
+    if never:
+        failures.append(f"{len(never)} trades never closed: {never[:10]}")
+
+    trades = (await client.get("/trades/", headers=headers)).json()
+    still_open = [t["id"] for t in trades if t["status"] != "CLOSED"]
+    if still_open:
+        failures.append(f"{len(still_open)} trades still OPEN: {still_open[:10]}")
+
+    realized = sum(t["profit"] for t in trades)
+    users = (await client.get("/admin/users", params={"limit": 100000})).json()
+    balance = next(u["balance"] for u in users if u["id"] == user_id)
+    expected = START_BALANCE + realized
+    print(f"trades={len(trades)} realized={realized:.2f} balance={balance:.2f} expected={expected:.2f}")
+    if abs(balance - expected) > 1e-6 * max(1.0, abs(expected)):
+        failures.append(f"lost P/L: balance {balance:.6f} != {expected:.6f}")
+    return failures
+
+
+async def run(client, trades=200, closers=4, settlers=1, close_alls=5, concurrency=64, rounds=3):
+    # -> list of failure messages; empty when every invariant held
+    failures = []
+    for round_no in range(rounds):
+        user_id, headers, ids = await setup(client, trades)
+        closes, requests = await attack(client, headers, ids, closers, settlers, close_alls, concurrency)
+        print(f"round {round_no + 1}: {requests} concurrent close requests against {len(ids)} trades")
+        failures += await verify(client, user_id, headers, closes)
+    return failures
+
+
+async def run_in_process(concurrency=64, **options):
+    # The app with its lifespan (engines, bus, leader jobs) in this process
+    import main
+    limits = httpx.Limits(max_connections=concurrency + 10)
+    async with main.app.router.lifespan_context(main.app):
+        transport = httpx.ASGITransport(app=main.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://stress", limits=limits, timeout=60) as client:
+            return await run(client, concurrency=concurrency, **options)
+
+
+async def main_async(args):
+    options = {
+        "trades": args.trades, "closers": args.closers, "settlers": args.settlers,
+        "close_alls": args.close_alls, "rounds": args.rounds,
+    }
+    if args.url:
+        limits = httpx.Limits(max_connections=args.concurrency + 10)
+        async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+            return await run(client, concurrency=args.concurrency, **options)
+    return await run_in_process(concurrency=args.concurrency, **options)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent close/settle stress test")
+    parser.add_argument("--url", help="Base URL of a running server; omit to run the app in-process")
+    parser.add_argument("--trades", type=int, default=200)
+    parser.add_argument("--closers", type=int, default=4, help="close requests per trade")
+    parser.add_argument("--settlers", type=int, default=1, help="admin settle requests per trade")
+    parser.add_argument("--close-alls", type=int, default=5, help="close-all requests per round")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--rounds", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    if not args.url:
+        # Must be set before the app (and its database module) is imported
+        os.environ.setdefault("DATABASE_URL", "sqlite:///" + os.path.join(tempfile.mkdtemp(), "stress.db"))
+        os.environ.setdefault("CANDLE_DIR", "")
+
+    failures = asyncio.run(main_async(args))
+    if failures:
+        print("FAILED")
+        for failure in failures:
+            print("  " + failure)
+        sys.exit(1)
+    print("OK: every trade closed exactly once, no P/L lost")
+
+
+if __name__ == "__main__":
+    main()
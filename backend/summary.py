@@ -0,0 +1,158 @@
+from datetime import datetime
+
+import numpy as np
+from sqlalchemy import func, select
+
+import models, mtm, quotes
+
+TOP_ACCOUNTS = 10
+
+
+class SymbolBook:
+    __slots__ = ("positions", "long_lots", "short_lots")
+
+    def __init__(self):
+        self.positions = 0
+        self.long_lots = 0.0
+        self.short_lots = 0.0
+
+
+class Summary:
+    # Dashboard totals kept up to date by the write paths (through events.py,
+    # in every worker), so reading them costs the same for 10 or 10M trades.
+
+    def __init__(self):
+        self.accounts = {}        # user_id -> username
+        self.open = {}            # open trade id -> (symbol, type, volume)
+        self.open_positions = 0
+        self.symbols = {}         # symbol -> SymbolBook
+        self.day = datetime.utcnow().date()
+        self.realized_today = 0.0
+        self.closed_today = 0
+        self.recounted_at = None
+
+    # Incremental updates; take the JSON form of trades/accounts as published.
+    # Opens and closes are keyed by trade id, so one applied twice (replayed
+    # after a reload) or already counted by a recount changes nothing.
+
+    def account_changed(self, account):
+        self.accounts[account["id"]] = account["username"]
+
+    def trade_opened(self, trade):
+        if trade["id"] in self.open:
+            return
+        position = self.open[trade["id"]] = (trade["symbol"], trade["type"], trade["volume"])
+        self._position(position, 1)
+
+    def trade_closed(self, trade):
+        position = self.open.pop(trade["id"], None)
+        if position is None:
+            return
+        self._position(position, -1)
+        closed_at = trade.get("close_time")
+        if closed_at is not None:
+            self._roll_day()
+            if datetime.fromisoformat(closed_at).date() == self.day:
+                self.realized_today += trade["profit"]
+                self.closed_today += 1
+
+    def _position(self, position, sign):
+        symbol, side, volume = position
+        book = self.symbols.get(symbol)
+        if book is None:
+            book = self.symbols[symbol] = SymbolBook()
+        book.positions += sign
+        if side == "buy":
+            book.long_lots += sign * volume
+        else:
+            book.short_lots += sign * volume
+        self.open_positions += sign
+
+    def _roll_day(self):
+        today = datetime.utcnow().date()
+        if today != self.day:
+            self.day = today
+            self.realized_today = 0.0
+            self.closed_today = 0
+
+    # Full recount (at startup and by events.reload)
+
+    async def recount(self, db):
+        day_start = datetime.combine(datetime.utcnow().date(), datetime.min.time())
+        users = (await db.execute(select(models.User.id, models.User.username))).all()
+        open_trades = (await db.execute(
+            select(models.Trade.id, models.Trade.symbol, models.Trade.type, models.Trade.volume)
+            .where(models.Trade.status == "OPEN")
+        )).all()
+        realized, closed = (await db.execute(
+            select(func.coalesce(func.sum(models.Trade.profit), 0.0), func.count())
+            .where(models.Trade.status == "CLOSED", models.Trade.close_time >= day_start)
+        )).one()
+
+        self.accounts = dict(users)
+        self.open = {}
+        self.symbols = {}
+        self.open_positions = 0
+        for trade_id, symbol, side, volume in open_trades:
+            position = self.open[trade_id] = (symbol, side, volume or 0.0)
+            self._position(position, 1)
+        self.day = day_start.date()
+        self.realized_today = realized
+        self.closed_today = closed
+        self.recounted_at = datetime.utcnow()
+
+    # Reads
+
+    def snapshot(self, top=TOP_ACCOUNTS):
+        self._roll_day()
+        q = quotes.engine
+        symbols = []
+        for symbol, book in sorted(self.symbols.items()):
+            if book.positions == 0:
+                continue
+            row = q.row(symbol)
+            entry = {
+                "symbol": symbol,
+                "positions": book.positions,
+                "long_volume": round(book.long_lots, 2),
+                "short_volume": round(book.short_lots, 2),
+                "net_exposure": None,
+                "gross_exposure": None,
+            }
+            if row is not None:
+                # Notional in account currency at the current mid price
+                unit = float(q.contract_size[row]) * float(q.bid[row] + q.ask[row]) * 0.5
+                entry["net_exposure"] = round((book.long_lots - book.short_lots) * unit, 2)
+                entry["gross_exposure"] = round((book.long_lots + book.short_lots) * unit, 2)
+            symbols.append(entry)
+
+        return {
+            "accounts": len(self.accounts),
+            "open_positions": self.open_positions,
+            "realized_today": round(self.realized_today, 2),
+            "closed_today": self.closed_today,
+            "symbols": symbols,
+            "top_accounts": self._top_accounts(top),
+            "recounted_at": self.recounted_at,
+        }
+
+    def _top_accounts(self, top):
+        # The live equity column of the mark-to-market table; argpartition
+        # picks the top rows without sorting every account
+        engine = mtm.engine
+        m = engine.n_accounts
+        if not m:
+            return []
+        equity = engine.accounts["equity"][:m]
+        rows = np.argpartition(-equity, min(top, m) - 1)[:top] if m > top else np.arange(m)
+        rows = rows[np.argsort(-equity[rows])]
+        result = []
+        for row in rows:
+            user_id = int(engine.accounts["user_id"][row])
+            account = engine.account(user_id)
+            account["username"] = self.accounts.get(user_id)
+            result.append(account)
+        return result
+
+
+summary = Summary()
@@ -0,0 +1,44 @@
+# Instrument specs for the server-side quote engine.
+# Mirrors frontend/src/data/symbols.js; contract_size is units per 1.0 lot.
+
+INSTRUMENTS = [
+    {"symbol": "EURUSD", "description": "Euro vs US Dollar", "group": "Forex", "bid": 1.16367, "ask": 1.16369, "digits": 5, "contract_size": 100000},
+    {"symbol": "GBPUSD", "description": "Great Britain Pound vs US Dollar", "group": "Forex", "bid": 1.33991, "ask": 1.34042, "digits": 5, "contract_size": 100000},
+    {"symbol": "USDJPY", "description": "US Dollar vs Japanese Yen", "group": "Forex", "bid": 149.501, "ask": 149.532, "digits": 3, "contract_size": 100000},
+    {"symbol": "USDCHF", "description": "US Dollar vs Swiss Franc", "group": "Forex", "bid": 0.89098, "ask": 0.89159, "digits": 5, "contract_size": 100000},
+    {"symbol": "AUDUSD", "description": "Australian Dollar vs US Dollar", "group": "Forex", "bid": 0.66683, "ask": 0.66916, "digits": 5, "contract_size": 100000},
+    {"symbol": "USDCAD", "description": "US Dollar vs Canadian Dollar", "group": "Forex", "bid": 1.36500, "ask": 1.36530, "digits": 5, "contract_size": 100000},
+    {"symbol": "NZDUSD", "description": "New Zealand Dollar vs US Dollar", "group": "Forex", "bid": 0.57269, "ask": 0.57359, "digits": 5, "contract_size": 100000},
+    {"symbol": "EURGBP", "description": "Euro vs Great Britain Pound", "group": "Forex", "bid": 0.86540, "ask": 0.86560, "digits": 5, "contract_size": 100000},
+    {"symbol": "EURJPY", "description": "Euro vs Japanese Yen", "group": "Forex", "bid": 158.200, "ask": 158.250, "digits": 3, "contract_size": 100000},
+    {"symbol": "GBPJPY", "description": "Great Britain Pound vs Japanese Yen", "group": "Forex", "bid": 182.500, "ask": 182.600, "digits": 3, "contract_size": 100000},
+    {"symbol": "AUDJPY", "description": "Australian Dollar vs Japanese Yen", "group": "Forex", "bid": 95.400, "ask": 95.450, "digits": 3, "contract_size": 100000},
+    {"symbol": "CADJPY", "description": "Canadian Dollar vs Japanese Yen", "group": "Forex", "bid": 109.100, "ask": 109.150, "digits": 3, "contract_size": 100000},
+    {"symbol": "CHFJPY", "description": "Swiss Franc vs Japanese Yen", "group": "Forex", "bid": 165.300, "ask": 165.400, "digits": 3, "contract_size": 100000},
+    {"symbol": "USDCNH", "description": "US Dollar vs Chinese Yuan", "group": "Exotics", "bid": 7.27298, "ask": 7.27943, "digits": 5, "contract_size": 100000},
+    {"symbol": "USDRUB", "description": "US Dollar vs Russian Ruble", "group": "Exotics", "bid": 92.505, "ask": 95.645, "digits": 3, "contract_size": 100000},
+    {"symbol": "USDTRY", "description": "US Dollar vs Turkish Lira", "group": "Exotics", "bid": 27.500, "ask": 27.800, "digits": 3, "contract_size": 100000},
+    {"symbol": "USDZAR", "description": "US Dollar vs South African Rand", "group": "Exotics", "bid": 18.900, "ask": 18.950, "digits": 3, "contract_size": 100000},
+    {"symbol": "USDMXN", "description": "US Dollar vs Mexican Peso", "group": "Exotics", "bid": 17.500, "ask": 17.550, "digits": 3, "contract_size": 100000},
+    {"symbol": "XAUUSD", "description": "Gold vs US Dollar", "group": "Metals", "bid": 1980.50, "ask": 1981.10, "digits": 2, "contract_size": 100},
+    {"symbol": "XAGUSD", "description": "Silver vs US Dollar", "group": "Metals", "bid": 23.450, "ask": 23.480, "digits": 3, "contract_size": 5000},
+    {"symbol": "US500", "description": "S&P 500 Index", "group": "Indices", "bid": 4350.50, "ask": 4351.00, "digits": 2, "contract_size": 1},
+    {"symbol": "US30", "description": "Wall Street 30 Index", "group": "Indices", "bid": 33800.0, "ask": 33805.0, "digits": 1, "contract_size": 1},
+    {"symbol": "DE40", "description": "Germany 40 Index", "group": "Indices", "bid": 15400.0, "ask": 15405.0, "digits": 1, "contract_size": 1},
+    {"symbol": "BTCUSD", "description": "Bitcoin vs US Dollar", "group": "Crypto", "bid": 34500.0, "ask": 34510.0, "digits": 1, "contract_size": 1},
+    {"symbol": "ETHUSD", "description": "Ethereum vs US Dollar", "group": "Crypto", "bid": 1850.50, "ask": 1851.50, "digits": 2, "contract_size": 1},
+    {"symbol": "LTCUSD", "description": "Litecoin vs US Dollar", "group": "Crypto", "bid": 65.40, "ask": 65.50, "digits": 2, "contract_size": 1},
+    {"symbol": "XRPUSD", "description": "Ripple vs US Dollar", "group": "Crypto", "bid": 0.55040, "ask": 0.55090, "digits": 5, "contract_size": 1},
+    {"symbol": "AUDCAD", "description": "Australian Dollar vs Canadian Dollar", "group": "Forex", "bid": 0.8750, "ask": 0.8753, "digits": 5, "contract_size": 100000},
+    {"symbol": "AUDCHF", "description": "Australian Dollar vs Swiss Franc", "group": "Forex", "bid": 0.5850, "ask": 0.5855, "digits": 5, "contract_size": 100000},
+    {"symbol": "AUDDKK", "description": "Australian Dollar vs Danish Krone", "group": "Forex", "bid": 4.5000, "ask": 4.5050, "digits": 4, "contract_size": 100000},
+    {"symbol": "AUDHKD", "description": "Australian Dollar vs Hong Kong Dollar", "group": "Forex", "bid": 5.1000, "ask": 5.1050, "digits": 4, "contract_size": 100000},
+    {"symbol": "AUDHUF", "description": "Australian Dollar vs Hungarian Forint", "group": "Exotics", "bid": 230.00, "ask": 231.00, "digits": 2, "contract_size": 100000},
+    {"symbol": "AUDNOK", "description": "Australian Dollar vs Norwegian Krone", "group": "Forex", "bid": 7.1000, "ask": 7.1050, "digits": 4, "contract_size": 100000},
+    {"symbol": "AUDNZD", "description": "Australian Dollar vs New Zealand Dollar", "group": "Forex", "bid": 1.0800, "ask": 1.0805, "digits": 5, "contract_size": 100000},
+    {"symbol": "AUDPLN", "description": "Australian Dollar vs Polish Zloty", "group": "Exotics", "bid": 2.7500, "ask": 2.7550, "digits": 4, "contract_size": 100000},
+    {"symbol": "AUDSEK", "description": "Australian Dollar vs Swedish Krona", "group": "Forex", "bid": 7.1500, "ask": 7.1550, "digits": 4, "contract_size": 100000},
+    {"symbol": "AUDSGD", "description": "Australian Dollar vs Singapore Dollar", "group": "Forex", "bid": 0.8900, "ask": 0.8905, "digits": 5, "contract_size": 100000},
+]
+
+INSTRUMENTS_BY_SYMBOL = {i["symbol"]: i for i in INSTRUMENTS}
@@ -0,0 +1,11 @@
+import os
+import tempfile
+
+# The app reads its configuration at import: point it at a scratch database
+# and bus directory before any test module imports it, so a test run never
+# touches trading_app.db or talks to locally running workers.
+_scratch = tempfile.mkdtemp(prefix="trader-tests-")
+os.environ["DATABASE_URL"] = "sqlite:///" + os.path.join(_scratch, "test.db")
+os.environ["BUS_DIR"] = os.path.join(_scratch, "bus")
+os.environ["CANDLE_DIR"] = ""
+os.environ.setdefault("LOG_LEVEL", "WARNING")
@@ -0,0 +1,18 @@
+import pytest
+
+from database import engine, Base, upgrade_schema
+import check_query_plans
+
+
+@pytest.fixture(scope="module")
+def conn():
+    Base.metadata.create_all(bind=engine)
+    upgrade_schema(engine)
+    with engine.connect() as conn:
+        yield conn
+
+
+@pytest.mark.parametrize("name", list(check_query_plans.HOT_QUERIES))
+def test_hot_query_uses_an_index(conn, name):
+    plan = check_query_plans.explain(conn, check_query_plans.HOT_QUERIES[name])
+    assert not check_query_plans.bad_steps(plan), "\n".join(plan)
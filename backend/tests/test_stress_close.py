@@ -0,0 +1,13 @@
+import asyncio
+import random
+
+import stress_close
+
+
+def test_concurrent_closes_close_each_trade_once_without_losing_pl():
+    # Duplicate closes, admin settlements and close-alls racing on the same
+    # trades: each trade is closed exactly once and the balance equals the
+    # starting balance plus the recorded profits
+    random.seed(1)
+    failures = asyncio.run(stress_close.run_in_process(trades=60, closers=3, close_alls=3, concurrency=32, rounds=2))
+    assert failures == []
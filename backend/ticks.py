@@ -0,0 +1,207 @@
+import asyncio
+import glob
+import json
+import os
+import time
+
+import numpy as np
+
+import logs
+
+log = logs.get_logger("ticks")
+
+# Tick recording and replay. Recorded ticks are fixed-width records in
+# append-only segment files; a replay reads them back through memory maps
+# and feeds them through the same QuoteEngine.apply/notify pipeline as the
+# live feed, so every listener (candles, mark-to-market, SL/TP, pending
+# orders, WebSocket fan-out) sees the session exactly as recorded.
+
+TICK_DTYPE = np.dtype([("time", "<f8"), ("symbol", "<u2"), ("bid", "<f8"), ("ask", "<f8")])
+
+# Leader records every tick here when set
+TICK_RECORD_DIR = os.getenv("TICK_RECORD_DIR", "")
+# Records per segment file (26 bytes each, so ~26 MB)
+TICK_SEGMENT_RECORDS = int(os.getenv("TICK_SEGMENT_RECORDS", "1000000"))
+# When set, the leader replays this directory instead of running the random walk
+QUOTE_REPLAY_DIR = os.getenv("QUOTE_REPLAY_DIR", "")
+# 1 = real time, 1000 = a thousand times faster, 0 = as fast as the listeners allow
+QUOTE_REPLAY_SPEED = float(os.getenv("QUOTE_REPLAY_SPEED", "1"))
+QUOTE_REPLAY_LOOP = os.getenv("QUOTE_REPLAY_LOOP", "0") == "1"
+
+
+def segments(directory):
+    return sorted(glob.glob(os.path.join(directory, "ticks-*.bin")))
+
+
+def open_segment(path):
+    # Zero-copy view of a segment; a record cut short by a crash is ignored
+    records = os.path.getsize(path) // TICK_DTYPE.itemsize
+    if not records:
+        return np.empty(0, TICK_DTYPE), []
+    with open(path[:-len(".bin")] + ".json") as f:
+        symbols = json.load(f)["symbols"]
+    return np.memmap(path, dtype=TICK_DTYPE, mode="r", shape=(records,)), symbols
+
+
+class TickRecorder:
+    # Quote listener appending the rows that changed in each tick. Segments
+    # roll over every TICK_SEGMENT_RECORDS records; each has a small JSON
+    # sidecar naming the symbols its ids refer to.
+
+    def __init__(self, directory, segment_records=TICK_SEGMENT_RECORDS):
+        self.directory = directory
+        self.segment_records = segment_records
+        self.file = None
+        self.count = 0
+        self.recorded = 0
+        self.last_bid = None
+        self.last_ask = None
+
+    def on_tick(self, quote_engine):
+        q = quote_engine
+        if self.last_bid is None:
+            rows = np.arange(len(q.symbols))
+        else:
+            rows = np.nonzero((q.bid != self.last_bid) | (q.ask != self.last_ask))[0]
+        self.last_bid = q.bid.copy()
+        self.last_ask = q.ask.copy()
+        if not len(rows):
+            return
+        records = np.empty(len(rows), TICK_DTYPE)
+        records["time"] = q.time[rows]
+        records["symbol"] = rows
+        records["bid"] = q.bid[rows]
+        records["ask"] = q.ask[rows]
+        if self.file is None or self.count >= self.segment_records:
+            self._rotate(q.symbols)
+        self.file.write(records.tobytes())
+        self.count += len(records)
+        self.recorded += len(records)
+
+    def _rotate(self, symbols):
+        self.close()
+        os.makedirs(self.directory, exist_ok=True)
+        base = os.path.join(self.directory, f"ticks-{time.time_ns()}")
+        with open(base + ".json", "w") as f:
+            json.dump({"symbols": symbols, "dtype": TICK_DTYPE.descr}, f)
+        self.file = open(base + ".bin", "ab", buffering=1024 * 1024)
+        self.count = 0
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class TickReplay:
+    # Plays recorded segments through a QuoteEngine. Records sharing a
+    # timestamp form one tick. Tick times are rebased onto the wall clock
+    # (compressed by the speed factor), so candles and quote times look live.
+    # The price sequence depends only on the recording, never on timing, so
+    # two runs over the same directory drive the same fills and closes.
+
+    def __init__(self, directory, speed=QUOTE_REPLAY_SPEED, loop=QUOTE_REPLAY_LOOP):
+        self.directory = directory
+        self.speed = speed
+        self.loop = loop
+        self.ticks = 0
+
+    async def run(self, quote_engine):
+        paths = segments(self.directory)
+        if not paths:
+            log.warning("No tick segments to replay", extra={"fields": {"directory": self.directory}})
+            return
+        while True:
+            await self.play(quote_engine, paths)
+            log.info("Tick replay finished", extra={"fields": {"ticks": self.ticks}})
+            if not self.loop:
+                return
+
+    async def play(self, quote_engine, paths):
+        q = quote_engine
+        start = time.time()
+        first = None
+        for path in paths:
+            records, symbols = open_segment(path)
+            if not len(records):
+                continue
+            # Recorded symbol id -> row in this engine (-1: no longer listed)
+            rows = np.array([q.index.get(symbol, -1) for symbol in symbols], dtype=np.int64)
+            times = records["time"]
+            bounds = np.concatenate(([0], np.nonzero(np.diff(times))[0] + 1, [len(records)]))
+            if first is None:
+                first = float(times[0])
+            for lo, hi in zip(bounds[:-1], bounds[1:]):
+                tick = records[lo:hi]
+                offset = float(times[lo]) - first
+                if self.speed > 0:
+                    delay = start + offset / self.speed - time.time()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                    now = start + offset / self.speed
+                else:
+                    now = time.time()
+                target = rows[tick["symbol"]]
+                known = target >= 0
+                q.apply(tick["bid"][known], tick["ask"][known], now=now, rows=target[known])
+                self.ticks += 1
+                try:
+                    await q.notify()
+                except Exception:
+                    log.exception("Quote listener failed")
+                if self.speed <= 0:
+                    await asyncio.sleep(0)  # let requests in between ticks
+
+
+recorder = TickRecorder(TICK_RECORD_DIR) if TICK_RECORD_DIR else None
+
+
+def generate(directory, ticks, interval=1.0, seed=0):
+    # Writes a synthetic session from the seeded random walk, for capacity
+    # tests without a production recording. Same seed, same session.
+    import quotes
+    from symbols import INSTRUMENTS
+
+    engine = quotes.QuoteEngine(INSTRUMENTS, seed=seed)
+    writer = TickRecorder(directory)
+    t = 1_700_000_000.0
+    for _ in range(ticks):
+        t += interval
+        engine.tick(now=t)
+        writer.on_tick(engine)
+    writer.close()
+    return writer.recorded
+
+
+def info(directory):
+    paths = segments(directory)
+    total = 0
+    first = last = None
+    for path in paths:
+        records, _ = open_segment(path)
+        if len(records):
+            total += len(records)
+            first = float(records["time"][0]) if first is None else first
+            last = float(records["time"][-1])
+    span = (last - first) if first is not None else 0.0
+    return {"segments": len(paths), "records": total, "seconds": round(span, 3)}
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Inspect or generate tick recordings")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p = sub.add_parser("info", help="summarize a recording directory")
+    p.add_argument("directory")
+    p = sub.add_parser("generate", help="write a seeded synthetic session")
+    p.add_argument("directory")
+    p.add_argument("--ticks", type=int, default=3600)
+    p.add_argument("--interval", type=float, default=1.0, help="seconds between ticks")
+    p.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.command == "info":
+        print(json.dumps(info(args.directory)))
+    else:
+        print(f"Wrote {generate(args.directory, args.ticks, args.interval, args.seed)} records")
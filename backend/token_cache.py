@@ -0,0 +1,93 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", "10000"))
+TOKEN_CACHE_TTL = float(os.getenv("TOKEN_CACHE_TTL", "30"))
+
+
+class TokenCache:
+    # Bounded LRU of token -> (expiry, user snapshot). Entries expire after the
+    # TTL or when the JWT itself expires, whichever comes first, and are
+    # dropped explicitly whenever the account they belong to is written.
+
+    def __init__(self, maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._by_user = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, token):
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(token)
+            if entry is None:
+                self.misses += 1
+                return None
+            expires_at, user = entry
+            if expires_at <= now:
+                self._remove(token, user.id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(token)
+            self.hits += 1
+            return user
+
+    def put(self, token, claims, user):
+        expires_at = time.time() + self.ttl
+        if claims.get("exp") is not None:
+            expires_at = min(expires_at, float(claims["exp"]))
+        with self._lock:
+            old = self._entries.pop(token, None)
+            if old is not None:
+                self._forget(token, old[1].id)
+            self._entries[token] = (expires_at, user)
+            self._by_user.setdefault(user.id, set()).add(token)
+            while len(self._entries) > self.maxsize:
+                evicted, (_, evicted_user) = self._entries.popitem(last=False)
+                self._forget(evicted, evicted_user.id)
+
+    def invalidate_user(self, user_id):
+        with self._lock:
+            tokens = self._by_user.pop(user_id, ())
+            for token in tokens:
+                self._entries.pop(token, None)
+            if tokens:
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._by_user.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "invalidations": self.invalidations,
+            }
+
+    def _remove(self, token, user_id):
+        self._entries.pop(token, None)
+        self._forget(token, user_id)
+
+    def _forget(self, token, user_id):
+        tokens = self._by_user.get(user_id)
+        if tokens is not None:
+            tokens.discard(token)
+            if not tokens:
+                del self._by_user[user_id]
+
+
+cache = TokenCache()
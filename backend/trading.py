@@ -0,0 +1,110 @@
+from datetime import datetime
+from sqlalchemy import case, update
+import models, quotes, events, ledger
+
+# Close logic shared by the single and batch close endpoints and the SL/TP
+# trigger engine.
+
+# Rows per UPDATE, keeping each statement well under SQLite's variable limit
+CLOSE_CHUNK = 500
+
+def realized_profit(trade, close_price):
+    multiplier = 1 if trade.type == 'buy' else -1
+    contract_size = quotes.engine.contract_size_of(trade.symbol)
+    raw_profit = (close_price - trade.entry_price) * trade.volume * multiplier * contract_size
+
+    # Apply forced outcome if any
+    if trade.forced_outcome == "WIN":
+        raw_profit = abs(raw_profit) if raw_profit != 0 else 100
+    elif trade.forced_outcome == "LOSS":
+        raw_profit = -abs(raw_profit) if raw_profit != 0 else -100
+    return raw_profit
+
+async def close_trades(db, trades, close_prices):
+    # Closes trades with set-based UPDATEs in one transaction. Only rows that
+    # are still OPEN are touched, so a trade raced by another request, worker
+    # or the trigger engine is closed (and credited) exactly once; it is just
+    # missing from the result. Each account gets a single aggregated balance
+    # delta. Returns (closed trades, {user_id: user}).
+    now = datetime.utcnow()
+    prices = {}
+    profits = {}
+    for trade, close_price in zip(trades, close_prices):
+        prices[trade.id] = close_price
+        profits[trade.id] = realized_profit(trade, close_price)
+
+    closed = []
+    ids = list(prices)
+    for start in range(0, len(ids), CLOSE_CHUNK):
+        chunk = ids[start:start + CLOSE_CHUNK]
+        stmt = (
+            update(models.Trade)
+            .where(models.Trade.id.in_(chunk), models.Trade.status == "OPEN")
+            .values(
+                status="CLOSED",
+                close_time=now,
+                close_price=case({i: prices[i] for i in chunk}, value=models.Trade.id),
+                profit=case({i: profits[i] for i in chunk}, value=models.Trade.id),
+            )
+            .returning(models.Trade)
+            .execution_options(populate_existing=True)
+        )
+        closed.extend((await db.scalars(stmt)).all())
+
+    users = await _credit(db, closed, "trade_close")
+    await db.commit()
+    with events.batched():
+        for trade in closed:
+            events.trade_closed(trade)
+        for user in users.values():
+            events.account_changed(user)
+    return closed, users
+
+async def settle_trade(db, trade_id, outcome, profit):
+    # Admin settlement at a fixed profit. Same guarantees as close_trades:
+    # returns (trade, user), or (None, None) if the trade wasn't OPEN.
+    stmt = (
+        update(models.Trade)
+        .where(models.Trade.id == trade_id, models.Trade.status == "OPEN")
+        .values(
+            status="CLOSED",
+            close_time=datetime.utcnow(),
+            close_price=models.Trade.entry_price,
+            profit=profit,
+            forced_outcome=outcome,
+        )
+        .returning(models.Trade)
+        .execution_options(populate_existing=True)
+    )
+    trade = await db.scalar(stmt)
+    if trade is None:
+        await db.rollback()
+        return None, None
+    users = await _credit(db, [trade], "settlement")
+    await db.commit()
+    user = users.get(trade.user_id)
+    events.trade_closed(trade, user)
+    return trade, user
+
+async def _credit(db, closed, kind):
+    # Balance and equity move by SQL-side increments, never read-modify-write,
+    # so concurrent closes on one account (from any worker) can't lose P/L.
+    # Each realized profit is also appended to the ledger in the same transaction.
+    deltas = {}
+    for trade in closed:
+        deltas[trade.user_id] = deltas.get(trade.user_id, 0.0) + trade.profit
+    if not deltas:
+        return {}
+    await ledger.record_many(db, [
+        {"user_id": t.user_id, "kind": kind, "amount": t.profit, "equity_delta": t.profit, "trade_id": t.id, "created_at": t.close_time}
+        for t in closed
+    ])
+    delta = case(deltas, value=models.User.id)
+    stmt = (
+        update(models.User)
+        .where(models.User.id.in_(list(deltas)))
+        .values(balance=models.User.balance + delta, equity=models.User.equity + delta)
+        .returning(models.User)
+        .execution_options(populate_existing=True)
+    )
+    return {user.id: user for user in (await db.scalars(stmt)).all()}
@@ -0,0 +1,187 @@
+import heapq
+
+import numpy as np
+from sqlalchemy import select
+
+import models, quotes, trading, logs
+from database import AsyncSessionLocal
+
+log = logs.get_logger("triggers")
+
+# Book sides. Longs are watched against the bid, shorts against the ask:
+#   buy SL  fires when bid <= sl   (BELOW)    buy TP  fires when bid >= tp (ABOVE)
+#   sell SL fires when ask >= sl   (ABOVE)    sell TP fires when ask <= tp (BELOW)
+BUY_BELOW, BUY_ABOVE, SELL_BELOW, SELL_ABOVE = range(4)
+
+# Books are rebuilt without their cancelled entries once these outnumber
+# the live ones (and there are at least this many entries)
+COMPACT_MIN = 1024
+
+
+class LevelBook:
+    # One heap per (symbol, book side) ordered so the level closest to being
+    # crossed is on top. Cancelled entries are skipped when they surface
+    # (lazy deletion), and the top of every heap is mirrored into a NumPy
+    # array so one comparison per side finds the symbols that crossed.
+    # Workers that never pop (followers) drop them with compact() instead.
+
+    def __init__(self, n_symbols):
+        self.heaps = [[[] for _ in range(n_symbols)] for _ in range(4)]
+        self.size = 0
+        self.heads = np.empty((4, n_symbols))
+        self.heads[[BUY_BELOW, SELL_BELOW]] = -np.inf
+        self.heads[[BUY_ABOVE, SELL_ABOVE]] = np.inf
+
+    def push(self, side, sym, level, key):
+        heap = self.heaps[side][sym]
+        # BELOW books are max-heaps (stored negated), ABOVE books min-heaps
+        heapq.heappush(heap, (-level if side in (BUY_BELOW, SELL_BELOW) else level, key))
+        self.size += 1
+        self._sync_head(side, sym)
+
+    def crossed_symbols(self, side, prices):
+        if side in (BUY_BELOW, SELL_BELOW):
+            return np.nonzero(prices <= self.heads[side])[0]
+        return np.nonzero(prices >= self.heads[side])[0]
+
+    def pop_crossed(self, side, sym, price, is_live):
+        # Pops every live entry whose level the price has reached: O(k log n)
+        heap = self.heaps[side][sym]
+        below = side in (BUY_BELOW, SELL_BELOW)
+        fired = []
+        while heap:
+            stored, key = heap[0]
+            level = -stored if below else stored
+            if not is_live(key, level):
+                heapq.heappop(heap)
+                self.size -= 1
+                continue
+            if (price <= level) if below else (price >= level):
+                heapq.heappop(heap)
+                self.size -= 1
+                fired.append(key)
+            else:
+                break
+        self._sync_head(side, sym)
+        return fired
+
+    def compact(self, is_live):
+        # O(n) rebuild keeping only live entries
+        self.size = 0
+        for side, heaps in enumerate(self.heaps):
+            below = side in (BUY_BELOW, SELL_BELOW)
+            for sym, heap in enumerate(heaps):
+                heap[:] = [(stored, key) for stored, key in heap if is_live(key, -stored if below else stored)]
+                heapq.heapify(heap)
+                self.size += len(heap)
+                self._sync_head(side, sym)
+
+    def _sync_head(self, side, sym):
+        heap = self.heaps[side][sym]
+        below = side in (BUY_BELOW, SELL_BELOW)
+        if heap:
+            self.heads[side, sym] = -heap[0][0] if below else heap[0][0]
+        else:
+            self.heads[side, sym] = -np.inf if below else np.inf
+
+
+class TriggerEngine:
+    def __init__(self, quote_engine):
+        self.quotes = quote_engine
+        self.book = LevelBook(len(quote_engine.symbols))
+        self.live = {}  # trade_id -> (sym, side, sl, tp)
+        self.levels = 0  # SL/TP levels of the live trades
+        # Only the leader worker executes; followers just keep the book current
+        self.active = True
+
+    async def load(self, db):
+        trades = (await db.scalars(select(models.Trade).where(
+            models.Trade.status == "OPEN",
+            (models.Trade.sl.is_not(None)) | (models.Trade.tp.is_not(None)),
+        ))).all()
+        # Rebuilt from scratch, after the read (startup and events.reload)
+        self.book = LevelBook(len(self.quotes.symbols))
+        self.live = {}
+        self.levels = 0
+        for trade in trades:
+            self.add(trade)
+
+    def add(self, trade):
+        sym = self.quotes.row(trade.symbol)
+        if sym is None or (trade.sl is None and trade.tp is None):
+            return
+        if trade.id in self.live:
+            self.remove(trade.id)
+        self.live[trade.id] = (sym, trade.type, trade.sl, trade.tp)
+        self.levels += (trade.sl is not None) + (trade.tp is not None)
+        if trade.type == "buy":
+            if trade.sl is not None:
+                self.book.push(BUY_BELOW, sym, trade.sl, trade.id)
+            if trade.tp is not None:
+                self.book.push(BUY_ABOVE, sym, trade.tp, trade.id)
+        else:
+            if trade.sl is not None:
+                self.book.push(SELL_ABOVE, sym, trade.sl, trade.id)
+            if trade.tp is not None:
+                self.book.push(SELL_BELOW, sym, trade.tp, trade.id)
+
+    def remove(self, trade_id):
+        # Heap entries are left in place and dropped when they reach the top
+        # (on the leader) or by the next compaction
+        entry = self.live.pop(trade_id, None)
+        if entry is None:
+            return
+        self.levels -= (entry[2] is not None) + (entry[3] is not None)
+        if self.book.size > max(2 * self.levels, COMPACT_MIN):
+            self.book.compact(self._is_live)
+
+    def _is_live(self, trade_id, level):
+        entry = self.live.get(trade_id)
+        return entry is not None and level in (entry[2], entry[3])
+
+    def collect(self):
+        # Trade ids whose SL or TP has been crossed by the current quotes
+        fired = set()
+        for side, prices in ((BUY_BELOW, self.quotes.bid), (BUY_ABOVE, self.quotes.bid),
+                             (SELL_BELOW, self.quotes.ask), (SELL_ABOVE, self.quotes.ask)):
+            for sym in self.book.crossed_symbols(side, prices):
+                fired.update(self.book.pop_crossed(side, sym, prices[sym], self._is_live))
+        return fired
+
+    async def on_tick(self, quote_engine):
+        if not self.active:
+            return
+        fired = self.collect()
+        if not fired:
+            return
+        removed = {trade_id: self.live.pop(trade_id) for trade_id in fired if trade_id in self.live}
+        for sym, side, sl, tp in removed.values():
+            self.levels -= (sl is not None) + (tp is not None)
+        try:
+            await self.execute(removed)
+        except Exception:
+            # Put them back so the next tick retries. Not re-raised: the
+            # listeners after this one must still see the tick.
+            log.exception("SL/TP close failed", extra={"fields": {"trades": len(removed)}})
+            for trade_id, (sym, side, sl, tp) in removed.items():
+                self.live[trade_id] = (sym, side, sl, tp)
+                self.levels += (sl is not None) + (tp is not None)
+                book_sl = BUY_BELOW if side == "buy" else SELL_ABOVE
+                book_tp = BUY_ABOVE if side == "buy" else SELL_BELOW
+                if sl is not None:
+                    self.book.push(book_sl, sym, sl, trade_id)
+                if tp is not None:
+                    self.book.push(book_tp, sym, tp, trade_id)
+
+    async def execute(self, trade_ids):
+        # Close every triggered position in one transaction through trading.close_trades
+        async with AsyncSessionLocal() as db:
+            trades = (await db.scalars(select(models.Trade).where(
+                models.Trade.id.in_(list(trade_ids)), models.Trade.status == "OPEN",
+            ))).all()
+            prices = [self.quotes.close_price(t.symbol, t.type) for t in trades]
+            await trading.close_trades(db, trades, prices)
+        return trades
+
+
+engine = TriggerEngine(quotes.engine)
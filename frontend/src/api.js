@@ -109,6 +109,12 @@ export const api = {
         return await response.json();
     },
 
+    // Quotes (server-side price feed)
+    getQuotes: async () => {
+        const response = await fetchWithTimeout(`${API_URL}/quotes/`);
+        return response.json();
+    },
+
     // Admin: Get all users
     getAllUsers: async (token) => {
         const response = await fetchWithTimeout(`${API_URL}/admin/users`, {
@@ -188,3 +194,10 @@ export const api = {
         return response.json();
     }
 };
+
+// Push channel: an initial snapshot, then batched trade/account events and quote ticks
+export const connectSocket = (token, onMessage) => {
+    const socket = new WebSocket(`${SOCKET_URL}/ws?token=${encodeURIComponent(token)}`);
+    socket.onmessage = (event) => onMessage(JSON.parse(event.data));
+    return socket;
+};